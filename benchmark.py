@@ -0,0 +1,392 @@
+"""
+Measures how fast `ReberGenerator` generates and encodes data, across a grid of generator parameters, and optionally
+flags regressions against a stored baseline.
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --output new.json --baseline baseline.json
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from grammar import Grammar
+from reber import ReberDataType, ReberGenerator
+
+# a case builds, from a generator and a number of rows, a fn that processes that many rows. It can instead build a
+# (prepare, run) pair, where prepare makes the args of one call of run outside of the timed region, e.g. a fresh copy
+# of the rows that run edits in place
+PreparedRun = Tuple[Callable[[], tuple], Callable[..., object]]
+Case = Callable[[ReberGenerator, int], Union[Callable[[], object], PreparedRun]]
+
+
+def _make_data_case(datatype: ReberDataType, vectorized: bool) -> Case:
+    percentages = {d.value: 100 if d == datatype else 0 for d in ReberDataType}
+
+    def setup(reber: ReberGenerator, m_total: int) -> Callable[[], object]:
+        return lambda: reber.make_data(
+            m_total, vectorized=vectorized, as_frame=False, **percentages
+        )
+
+    return setup
+
+
+def _encode_as_padded_ints_case(
+    reber: ReberGenerator, m_total: int
+) -> Callable[[], object]:
+    strings = [reber.make_valid_embedded_reber_string() for _ in range(m_total)]
+    return lambda: [reber.encode_as_padded_ints(string) for string in strings]
+
+
+def _perturb_str_list_case(reber: ReberGenerator, m_total: int) -> Callable[[], object]:
+    X = np.empty((m_total, reber.max_length), dtype=np.int64)
+    reber._fill_valid_rows(X)
+    str_lists = [reber._decode_row_as_str_list(row) for row in X]
+
+    def run():
+        for str_list in str_lists:
+            reber._perturb_str_list(str_list[:])
+
+    return run
+
+
+def _perturb_rows_case(reber: ReberGenerator, m_total: int) -> PreparedRun:
+    X = np.empty((m_total, reber.max_length), dtype=np.int64)
+    reber._fill_valid_rows(X)
+    return lambda: (X.copy(),), reber.perturb_rows
+
+
+class _RejectionSampler:
+    """
+    How valid strings used to be sampled, before `_make_embedded_reber_list_of_correct_length` sampled by length: walk
+    the grammar from its start, taking each edge with its probability, and throw away the strings that are too long.
+    It walks the tables of the generator's own `Grammar`, so it can't drift from the grammar that is benchmarked.
+    """
+
+    def __init__(self, grammar: Grammar, max_length: int, seed: int):
+        self.max_length = max_length
+        self._random = random.Random(seed)
+        self._start_state = grammar.start_state
+        self._end_state = grammar.end_state
+        # the letters, next states and probabilities of the edges of each state, as plain python lists
+        self._state_to_edges = [
+            (
+                [
+                    grammar.alphabet[letter - 1]
+                    for letter in grammar.emission[state, :out_degree]
+                ],
+                grammar.next_state[state, :out_degree].tolist(),
+                grammar.probability[state, :out_degree].tolist(),
+            )
+            for state, out_degree in enumerate(grammar.out_degree)
+        ]
+
+    def _make_str_list(self) -> List[str]:
+        curr_state = self._start_state
+        str_list = []
+        while curr_state != self._end_state:
+            letters, next_states, probabilities = self._state_to_edges[curr_state]
+            (edge_idx,) = self._random.choices(
+                range(len(letters)), weights=probabilities
+            )
+            str_list.append(letters[edge_idx])
+            curr_state = next_states[edge_idx]
+        return str_list
+
+    def make_embedded_reber_list_of_correct_length(self) -> List[str]:
+        while True:
+            str_list = self._make_str_list()
+            if len(str_list) <= self.max_length:
+                return str_list
+
+
+def _rejection_sampling_case(
+    reber: ReberGenerator, m_total: int
+) -> Callable[[], object]:
+    sampler = _RejectionSampler(reber.grammar, reber.max_length, seed=0)
+    return lambda: [
+        sampler.make_embedded_reber_list_of_correct_length() for _ in range(m_total)
+    ]
+
+
+def _length_conditioned_sampling_case(
+    reber: ReberGenerator, m_total: int
+) -> Callable[[], object]:
+    return lambda: [
+        reber._make_embedded_reber_list_of_correct_length() for _ in range(m_total)
+    ]
+
+
+def _fill_valid_rows_case(reber: ReberGenerator, m_total: int) -> Callable[[], object]:
+    X = np.empty((m_total, reber.max_length), dtype=np.int64)
+    return lambda: reber._fill_valid_rows(X)
+
+
+CASES: Dict[str, Case] = {
+    **{
+        f"make_data[{datatype.value}]": _make_data_case(datatype, vectorized=True)
+        for datatype in ReberDataType
+    },
+    **{
+        f"make_data_not_vectorized[{datatype.value}]": _make_data_case(
+            datatype, vectorized=False
+        )
+        for datatype in ReberDataType
+    },
+    "encode_as_padded_ints": _encode_as_padded_ints_case,
+    "perturb_str_list": _perturb_str_list_case,
+    "perturb_rows": _perturb_rows_case,
+    "rejection_sampling": _rejection_sampling_case,
+    "length_conditioned_sampling": _length_conditioned_sampling_case,
+    "fill_valid_rows": _fill_valid_rows_case,
+}
+
+
+def _as_prepared_run(run: Union[Callable[[], object], PreparedRun]) -> PreparedRun:
+    return run if isinstance(run, tuple) else (tuple, run)
+
+
+def _time_case(prepared_run: PreparedRun, repeat: int) -> float:
+    prepare, run = prepared_run
+    best_seconds = float("inf")
+    for _ in range(repeat):
+        args = prepare()
+        start = time.perf_counter()
+        run(*args)
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+    return best_seconds
+
+
+def _measure_peak_bytes(prepared_run: PreparedRun) -> int:
+    prepare, run = prepared_run
+    args = prepare()
+    tracemalloc.start()
+    try:
+        run(*args)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak_bytes
+
+
+def run_benchmarks(
+    max_lengths: Sequence[int],
+    num_perturbations_list: Sequence[int],
+    m_totals: Sequence[int],
+    case_names: Optional[Sequence[str]] = None,
+    repeat: int = 3,
+    seed: int = 0,
+) -> List[dict]:
+    """
+    :return: one record per case and combination of parameters, holding the best of `repeat` timings and the peak
+        memory allocated while running the case once more
+    """
+    results = []
+    for max_length, num_perturbations, m_total in itertools.product(
+        max_lengths, num_perturbations_list, m_totals
+    ):
+        reber = ReberGenerator(
+            max_length, num_perturbations=num_perturbations, seed=seed
+        )
+        for name in case_names or CASES:
+            run = _as_prepared_run(CASES[name](reber, m_total))
+            seconds = _time_case(run, repeat)
+            results.append(
+                {
+                    "name": name,
+                    "max_length": max_length,
+                    "num_perturbations": num_perturbations,
+                    "m_total": m_total,
+                    "seconds": seconds,
+                    "rows_per_second": m_total / seconds if seconds else float("inf"),
+                    "peak_bytes": _measure_peak_bytes(run),
+                }
+            )
+    return results
+
+
+# run in a fresh interpreter, so that importing and loading count towards the time to the first prediction
+_COLD_START_SNIPPETS = {
+    "numpy_inference": (
+        "from numpy_inference import NumpyLSTMClassifier\n"
+        "model = NumpyLSTMClassifier.from_file({model_path!r})\n"
+    ),
+    "keras_predict": (
+        "import tensorflow as tf\n"
+        "model = tf.keras.models.load_model({model_path!r})\n"
+    ),
+}
+_COLD_START_TEMPLATE = (
+    "import time\n"
+    "start = time.perf_counter()\n"
+    "{load}"
+    "model.predict([[1, 2, 1, 2, 0]])\n"
+    "print(time.perf_counter() - start)\n"
+)
+
+
+def _measure_cold_start_seconds(name: str, model_path: str) -> float:
+    load = _COLD_START_SNIPPETS[name].format(model_path=model_path)
+    output = subprocess.run(
+        [sys.executable, "-c", _COLD_START_TEMPLATE.format(load=load)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.split()[-1])
+
+
+def run_inference_benchmarks(
+    model_path: str,
+    keras_model_path: Optional[str] = None,
+    max_length: int = 15,
+    m_totals: Sequence[int] = (1, 100, 10_000),
+    repeat: int = 3,
+    seed: int = 0,
+) -> List[dict]:
+    """
+    Compares `NumpyLSTMClassifier` against keras' `model.predict`
+    :param model_path: a model written by `numpy_inference.export_keras_model`
+    :param keras_model_path: the same model as saved by keras. Defaults to only benchmarking numpy_inference.
+    :return: records like those of `run_benchmarks`, plus the seconds from starting a python process to its first
+        prediction
+    """
+    from numpy_inference import NumpyLSTMClassifier
+
+    name_to_model_path = {"numpy_inference": model_path}
+    name_to_model = {"numpy_inference": NumpyLSTMClassifier.from_file(model_path)}
+    if keras_model_path is not None:
+        import tensorflow as tf
+
+        name_to_model_path["keras_predict"] = keras_model_path
+        name_to_model["keras_predict"] = tf.keras.models.load_model(keras_model_path)
+    reber = ReberGenerator(max_length, seed=seed)
+    results = []
+    for name, model in name_to_model.items():
+        cold_start_seconds = _measure_cold_start_seconds(name, name_to_model_path[name])
+        for m_total in m_totals:
+            ((X, _),) = reber.iter_batches(m_total, num_batches=1)
+            run = _as_prepared_run(functools.partial(model.predict, X))
+            seconds = _time_case(run, repeat)
+            results.append(
+                {
+                    "name": name,
+                    "max_length": max_length,
+                    "num_perturbations": reber.num_perturbations,
+                    "m_total": m_total,
+                    "seconds": seconds,
+                    "rows_per_second": m_total / seconds if seconds else float("inf"),
+                    "peak_bytes": _measure_peak_bytes(run),
+                    "cold_start_seconds": cold_start_seconds,
+                }
+            )
+    return results
+
+
+def _result_key(result: dict) -> tuple:
+    return (
+        result["name"],
+        result["max_length"],
+        result["num_perturbations"],
+        result["m_total"],
+    )
+
+
+def find_regressions(
+    results: List[dict], baseline: List[dict], tolerance: float
+) -> List[str]:
+    """
+    :param tolerance: the fraction by which throughput may drop (or peak memory grow) before it counts as a regression
+    :return: a description of every result that is worse than its counterpart in the baseline
+    """
+    key_to_baseline = {_result_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        baseline_result = key_to_baseline.get(_result_key(result))
+        if baseline_result is None:
+            continue
+        description = "{} (max_length={}, num_perturbations={}, m_total={})".format(
+            *_result_key(result)
+        )
+        min_rows_per_second = baseline_result["rows_per_second"] * (1 - tolerance)
+        if result["rows_per_second"] < min_rows_per_second:
+            regressions.append(
+                f"{description}: {result['rows_per_second']:.0f} rows/s, "
+                f"baseline {baseline_result['rows_per_second']:.0f} rows/s"
+            )
+        max_peak_bytes = baseline_result["peak_bytes"] * (1 + tolerance)
+        if result["peak_bytes"] > max_peak_bytes:
+            regressions.append(
+                f"{description}: peak memory {result['peak_bytes']} bytes, "
+                f"baseline {baseline_result['peak_bytes']} bytes"
+            )
+    return regressions
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--max-lengths", type=int, nargs="+", default=[12, 15, 20])
+    parser.add_argument("--num-perturbations", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--m-totals", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--inference-model",
+        help="also benchmark numpy_inference on this model, written by export_keras_model",
+    )
+    parser.add_argument(
+        "--keras-model", help="also benchmark keras' model.predict on this saved model"
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        args.max_lengths,
+        args.num_perturbations,
+        args.m_totals,
+        case_names=args.cases,
+        repeat=args.repeat,
+    )
+    if args.inference_model:
+        results += run_inference_benchmarks(
+            args.inference_model,
+            args.keras_model,
+            m_totals=args.m_totals,
+            repeat=args.repeat,
+        )
+    for result in results:
+        line = (
+            "{name:<40} max_length={max_length:<3} num_perturbations={num_perturbations:<2} "
+            "m_total={m_total:<8} {rows_per_second:>14,.0f} rows/s {peak_bytes:>14,} peak bytes".format(
+                **result
+            )
+        )
+        if "cold_start_seconds" in result:
+            line += f" {result['cold_start_seconds']:.3f}s to first prediction"
+        print(line)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
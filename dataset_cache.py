@@ -0,0 +1,214 @@
+"""
+An on-disk cache for `ReberGenerator.make_data`, so that reruns of an experiment don't regenerate the same dataset.
+Entries are stored as .npy files that are opened as read-only memory maps, so opening one is nearly free and every
+process that opens the same entry shares the same pages.
+"""
+
+from collections import namedtuple
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+import grammar
+import ragged
+import reber
+import row_keys
+from reber import (
+    COMPACT_DTYPE,
+    DatatypeToRowCount,
+    ReberDataType,
+    ReberDatatypeToPercentage,
+    ReberGenerator,
+)
+
+# the modules whose code generation runs: any change to them invalidates every entry
+_GENERATION_MODULES = (reber, grammar, ragged, row_keys)
+
+
+def _hash_sources(modules) -> str:
+    sources_hash = hashlib.sha256()
+    for module in modules:
+        sources_hash.update(Path(module.__file__).read_bytes())
+    return sources_hash.hexdigest()
+
+
+_CODE_VERSION = _hash_sources(_GENERATION_MODULES)
+_X_FILENAME = "X.npy"
+_Y_FILENAME = "y.npy"
+_PARAMS_FILENAME = "params.json"
+
+CacheEntry = namedtuple(
+    "CacheEntry", ["key", "path", "num_bytes", "last_used", "params"]
+)
+
+
+class DatasetCache:
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = None):
+        """
+        :param cache_dir: directory that holds one subdirectory per cached dataset
+        :param max_bytes: once the entries take up more than this many bytes, the least recently used ones are
+            evicted. Defaults to never evicting anything.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _make_params(
+        generator: ReberGenerator,
+        m_total: int,
+        dtype: np.dtype,
+        **kwargs: Dict[str, int],
+    ) -> dict:
+        if generator.seed is None:
+            raise ValueError("Only generators with a seed generate reproducible data")
+        datatype_to_percentage = ReberDatatypeToPercentage.from_kwargs(**kwargs)
+        init_kwargs = dict(generator._init_kwargs, grammar=generator.grammar.spec)
+        if init_kwargs["length_distribution"] is not None:
+            init_kwargs["length_distribution"] = sorted(
+                init_kwargs["length_distribution"].items()
+            )
+        seed_sequence = generator._seed_sequence
+        return {
+            "code_version": _CODE_VERSION,
+            "generator": f"{type(generator).__module__}.{type(generator).__qualname__}",
+            "init_kwargs": init_kwargs,
+            "seed_entropy": seed_sequence.entropy,
+            "seed_spawn_key": list(seed_sequence.spawn_key),
+            # make_data returns new data on every call, so the number of previous calls is part of the key too
+            "seed_num_children_spawned": seed_sequence.n_children_spawned,
+            "m_total": m_total,
+            "datatype_to_percentage": {
+                datatype.value: datatype_to_percentage.get(datatype)
+                for datatype in ReberDataType
+            },
+            "dtype": np.dtype(dtype).str,
+        }
+
+    @staticmethod
+    def _make_key(params: dict) -> str:
+        serialized_params = json.dumps(params, sort_keys=True).encode()
+        return hashlib.sha256(serialized_params).hexdigest()[:32]
+
+    def make_data(
+        self,
+        generator: ReberGenerator,
+        m_total: int,
+        dtype: np.dtype = COMPACT_DTYPE,
+        num_workers: int = 1,
+        **kwargs: Dict[str, int],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same as `generator.make_data(m_total, as_frame=False, ...)`, except that the result is read from the cache
+        if the same data was generated before. On a miss the data is generated straight into the files of the new
+        entry.
+        :param generator: must have been given a seed
+        :return: X, y as read-only memory maps
+        """
+        if m_total < 100:
+            raise AssertionError(f"m_total must be at least 100; was only {m_total}")
+        params = self._make_params(generator, m_total, dtype, **kwargs)
+        key = self._make_key(params)
+        entry_dir = self.cache_dir / key
+        if entry_dir.exists():
+            # keep the generator in the same state as if it had generated the data itself
+            generator._seed_sequence.spawn(1)
+        else:
+            self._write_entry(generator, entry_dir, params, num_workers, **kwargs)
+        self._touch(entry_dir)
+        self._evict(keep=key)
+        return (
+            np.load(entry_dir / _X_FILENAME, mmap_mode="r"),
+            np.load(entry_dir / _Y_FILENAME, mmap_mode="r"),
+        )
+
+    def _write_entry(
+        self,
+        generator: ReberGenerator,
+        entry_dir: Path,
+        params: dict,
+        num_workers: int,
+        **kwargs: Dict[str, int],
+    ) -> None:
+        m_total = params["m_total"]
+        dtype = np.dtype(params["dtype"])
+        metadata = DatatypeToRowCount(
+            m_total, ReberDatatypeToPercentage.from_kwargs(**kwargs)
+        )
+        # write into a temporary directory and rename it at the end so that other processes never see half an entry
+        tmp_dir = Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-"))
+        try:
+            X = np.lib.format.open_memmap(
+                tmp_dir / _X_FILENAME,
+                mode="w+",
+                dtype=dtype,
+                shape=(m_total, generator.max_length),
+            )
+            y = np.lib.format.open_memmap(
+                tmp_dir / _Y_FILENAME, mode="w+", dtype=dtype, shape=(m_total,)
+            )
+            generator._fill_data(X, y, metadata, num_workers)
+            X.flush()
+            y.flush()
+            del X, y
+            (tmp_dir / _PARAMS_FILENAME).write_text(json.dumps(params, sort_keys=True))
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another process wrote the same entry first; theirs is just as good
+            if not entry_dir.exists():
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _touch(entry_dir: Path) -> None:
+        # the modification time of the params file records when an entry was last used
+        os.utime(entry_dir / _PARAMS_FILENAME)
+
+    def list_entries(self) -> List[CacheEntry]:
+        """
+        :return: every entry in the cache, least recently used first
+        """
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            params_path = entry_dir / _PARAMS_FILENAME
+            if entry_dir.name.startswith(".") or not params_path.exists():
+                continue
+            entries.append(
+                CacheEntry(
+                    key=entry_dir.name,
+                    path=entry_dir,
+                    num_bytes=sum(f.stat().st_size for f in entry_dir.iterdir()),
+                    last_used=params_path.stat().st_mtime,
+                    params=json.loads(params_path.read_text()),
+                )
+            )
+        return sorted(entries, key=lambda entry: entry.last_used)
+
+    def purge(self, key: Optional[str] = None) -> None:
+        """
+        :param key: the entry to remove. Defaults to removing every entry.
+        """
+        for entry in self.list_entries():
+            if key is None or entry.key == key:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _evict(self, keep: str) -> None:
+        if self.max_bytes is None:
+            return
+        entries = self.list_entries()
+        total_bytes = sum(entry.num_bytes for entry in entries)
+        for entry in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            if entry.key == keep:
+                continue
+            # open memory maps keep working after their files are removed
+            shutil.rmtree(entry.path, ignore_errors=True)
+            total_bytes -= entry.num_bytes
@@ -0,0 +1,195 @@
+"""
+Summaries of generated datasets that are added up batch by batch, instead of materializing all of X in pandas to call
+`X.describe()`: the distribution of string lengths, the frequency of each symbol at each position, the number of rows
+of each datatype and label, and the fraction of X that is padding. Accumulators of different workers (or batches)
+can be merged.
+
+    dataset_stats = DatasetStats(reber.max_length)
+    X, y = reber.make_data(1_000_000, as_frame=False, dataset_stats=dataset_stats)
+    # or, for any iterator of (X, y) or (X, y, origins) batches
+    for X, y in dataset_stats.track(reber.iter_batches(256, num_batches=1000)):
+        ...
+    dataset_stats.length_histogram()
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Iterable, Iterator, Optional, Union
+
+from grammar import PADDING_VALUE
+from ragged import RaggedRows, row_lengths
+from reber import EMBEDDED_REBER_GRAMMAR_SPEC, ReberDataType
+
+
+class DatasetStats:
+    """
+    Counts over all the rows passed to `update` so far, which take the same memory however many rows that is
+    """
+
+    # rows counted at once, which bounds the size of the temporary index arrays
+    _chunk_num_rows = 2**16
+
+    def __init__(
+        self, max_length: int, alphabet: str = EMBEDDED_REBER_GRAMMAR_SPEC["alphabet"]
+    ):
+        """
+        :param max_length: the width of the padded rows that will be counted
+        :param alphabet: the letters that the symbols 1, 2, ... encode, e.g. `ReberGenerator.grammar.alphabet`
+        """
+        self.max_length = max_length
+        self.alphabet = alphabet
+        self.num_rows = 0
+        # [length]
+        self.length_counts = np.zeros(max_length + 1, dtype=np.int64)
+        # [position, symbol], where symbol PADDING_VALUE counts the rows that are over by that position
+        self.symbol_counts = np.zeros((max_length, len(alphabet) + 1), dtype=np.int64)
+        # [index in `list(ReberDataType)`], only over the rows whose datatype was given
+        self.datatype_counts = np.zeros(len(ReberDataType), dtype=np.int64)
+        # [label], only over the rows whose labels were given
+        self.label_counts = np.zeros(2, dtype=np.int64)
+
+    def update(
+        self,
+        X: Union[np.ndarray, RaggedRows],
+        y: Optional[np.ndarray] = None,
+        origins: Optional[np.ndarray] = None,
+        datatype: Optional[ReberDataType] = None,
+    ) -> None:
+        """
+        Counts the rows of X
+        :param X: (N, self.max_length) matrix of encoded and padded strings, or the same rows as `RaggedRows`
+        :param y: optionally, the labels of the rows
+        :param origins: optionally, the ORIGIN_DTYPE records of the rows, to count the rows of each datatype
+        :param datatype: alternatively to origins, the datatype of all rows of X
+        """
+        if isinstance(X, RaggedRows):
+            for start in range(0, len(X.offsets) - 1, self._chunk_num_rows):
+                self._update_ragged(
+                    RaggedRows(
+                        X.symbols, X.offsets[start : start + self._chunk_num_rows + 1]
+                    )
+                )
+        else:
+            X = np.asarray(X)
+            if X.shape[1] != self.max_length:
+                raise ValueError(
+                    f"X must have {self.max_length} columns; has {X.shape[1]}"
+                )
+            for start in range(0, X.shape[0], self._chunk_num_rows):
+                self._update_padded(X[start : start + self._chunk_num_rows])
+        num_rows = len(X.offsets) - 1 if isinstance(X, RaggedRows) else X.shape[0]
+        self.num_rows += num_rows
+        if y is not None:
+            self.label_counts += np.bincount(np.asarray(y), minlength=2)[:2]
+        if origins is not None:
+            self.datatype_counts += np.bincount(
+                origins["datatype"], minlength=len(ReberDataType)
+            )
+        elif datatype is not None:
+            self.datatype_counts[list(ReberDataType).index(datatype)] += num_rows
+
+    def _check_symbols(self, symbols: np.ndarray) -> None:
+        if symbols.size and symbols.max() >= self.symbol_counts.shape[1]:
+            raise ValueError(
+                f"X may only contain values in [0, {self.symbol_counts.shape[1]})"
+            )
+
+    def _update_padded(self, X: np.ndarray) -> None:
+        self._check_symbols(X)
+        self.length_counts += np.bincount(row_lengths(X), minlength=self.max_length + 1)
+        num_symbols = self.symbol_counts.shape[1]
+        # one bin per (position, symbol)
+        bins = X.astype(np.intp) + np.arange(self.max_length) * num_symbols
+        self.symbol_counts += np.bincount(
+            bins.ravel(), minlength=self.symbol_counts.size
+        ).reshape(self.symbol_counts.shape)
+
+    def _update_ragged(self, rows: RaggedRows) -> None:
+        lengths = np.diff(rows.offsets)
+        if lengths.size and lengths.max() > self.max_length:
+            raise ValueError(
+                f"Rows of up to {lengths.max()} symbols don't fit into {self.max_length} columns"
+            )
+        symbols = rows.symbols[rows.offsets[0] : rows.offsets[-1]]
+        self._check_symbols(symbols)
+        length_counts = np.bincount(lengths, minlength=self.max_length + 1)
+        self.length_counts += length_counts
+        positions = np.arange(symbols.size) - np.repeat(
+            rows.offsets[:-1] - rows.offsets[0], lengths
+        )
+        num_symbols = self.symbol_counts.shape[1]
+        self.symbol_counts += np.bincount(
+            positions * num_symbols + symbols, minlength=self.symbol_counts.size
+        ).reshape(self.symbol_counts.shape)
+        # the rows that are over by each position are the ones that are at most that long
+        self.symbol_counts[:, PADDING_VALUE] += length_counts.cumsum()[:-1]
+
+    def track(self, batches: Iterable[tuple]) -> Iterator[tuple]:
+        """
+        :param batches: (X, y) or (X, y, origins) tuples, e.g. from `ReberGenerator.iter_batches` or
+            `prefetch.PrefetchingBatches`
+        :return: the same batches, counting each one as it passes through
+        """
+        for batch in batches:
+            X, y, *origins = batch
+            self.update(X, y, origins[0] if origins else None)
+            yield batch
+
+    def merge(self, other: "DatasetStats") -> None:
+        """
+        Adds the length, symbol, datatype and label counts of other to these: the stats of disjoint shards of a dataset
+        merge into the stats of the whole dataset. Both must have the same max_length and alphabet.
+        """
+        if (other.max_length, other.alphabet) != (self.max_length, self.alphabet):
+            raise ValueError(
+                "Only stats with the same max_length and alphabet can be merged"
+            )
+        self.num_rows += other.num_rows
+        self.length_counts += other.length_counts
+        self.symbol_counts += other.symbol_counts
+        self.datatype_counts += other.datatype_counts
+        self.label_counts += other.label_counts
+
+    @property
+    def padding_fraction(self) -> float:
+        """
+        The fraction of the cells of the padded rows that are padding
+        """
+        num_cells = self.num_rows * self.max_length
+        return (
+            self.symbol_counts[:, PADDING_VALUE].sum() / num_cells if num_cells else 0.0
+        )
+
+    def length_histogram(self) -> pd.Series:
+        """
+        :return: the number of rows of each length
+        """
+        return pd.Series(
+            self.length_counts, index=pd.RangeIndex(self.max_length + 1, name="length")
+        )
+
+    def symbol_frequencies(self) -> pd.DataFrame:
+        """
+        :return: for each position, the fraction of rows that have each letter there, or that are over by then
+        """
+        return pd.DataFrame(
+            self.symbol_counts / max(self.num_rows, 1),
+            index=pd.RangeIndex(self.max_length, name="position"),
+            columns=["padding"] + list(self.alphabet),
+        )
+
+    def as_dict(self) -> dict:
+        """
+        :return: the counts as JSON-serializable python types
+        """
+        return {
+            "num_rows": self.num_rows,
+            "padding_fraction": float(self.padding_fraction),
+            "length_counts": self.length_counts.tolist(),
+            "symbol_counts": self.symbol_counts.tolist(),
+            "datatype_counts": {
+                datatype.value: int(count)
+                for datatype, count in zip(ReberDataType, self.datatype_counts)
+            },
+            "label_counts": self.label_counts.tolist(),
+        }
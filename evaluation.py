@@ -0,0 +1,161 @@
+"""
+Scores a predictor on generated rows broken down by where the rows came from, instead of hand-checking a few strings:
+a confusion matrix per `ReberDataType` and accuracy by string length, by kind of edit and by the column of the first
+edit. Rows are streamed through in batches and only counts are kept, so the memory used doesn't grow with the number
+of rows.
+
+    evaluation = evaluate(reber, make_numpy_predictor("test_model.npz"), num_batches=1000)
+    evaluation.confusion_matrices()[ReberDataType.SYMMETRY_DISTURBED]
+    evaluation.accuracy_by_edit_col()
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict
+
+from numpy_inference import Predictor
+from ragged import row_lengths
+from reber import EditKind, ReberDataType, ReberGenerator
+
+
+class StreamingEvaluation:
+    """
+    Counts of predictions against true labels, added up batch by batch with `update`. The true label of a row is
+    whether the grammar's recognizer accepts it, so RANDOM rows that happen to be valid count as valid.
+    """
+
+    def __init__(self, max_length: int, threshold: float = 0.5):
+        """
+        :param max_length: the width of the rows that will be evaluated
+        :param threshold: predictions of at least threshold count as predicting that the row is valid
+        """
+        self.max_length = max_length
+        self.threshold = threshold
+        self.num_rows = 0
+        # [datatype, true label, predicted label]
+        self._confusion_counts = np.zeros((len(ReberDataType), 2, 2), dtype=np.int64)
+        # [length, whether the prediction was right]
+        self._length_counts = np.zeros((max_length + 1, 2), dtype=np.int64)
+        # [edit kinds, whether the prediction was right]
+        self._edit_kinds_counts = np.zeros((sum(EditKind) + 1, 2), dtype=np.int64)
+        # [first edit col + 1, whether the prediction was right], so that unedited rows are counted in row 0
+        self._edit_col_counts = np.zeros((max_length + 1, 2), dtype=np.int64)
+
+    def update(
+        self,
+        X: np.ndarray,
+        origins: np.ndarray,
+        predictions: np.ndarray,
+        y: np.ndarray,
+    ) -> None:
+        """
+        :param X: (N, self.max_length) matrix of encoded and padded strings
+        :param origins: the ORIGIN_DTYPE records of the rows of X, e.g. from `ReberGenerator.iter_batches`
+        :param predictions: the probability that each row is valid, as a vector or an (N, 1) matrix
+        :param y: the true label of each row
+        """
+        predicted_y = (np.ravel(predictions) >= self.threshold).astype(np.intp)
+        y = np.asarray(y, dtype=np.intp)
+        is_correct = (predicted_y == y).astype(np.intp)
+        np.add.at(self._confusion_counts, (origins["datatype"], y, predicted_y), 1)
+        np.add.at(self._length_counts, (row_lengths(X), is_correct), 1)
+        np.add.at(self._edit_kinds_counts, (origins["edit_kinds"], is_correct), 1)
+        np.add.at(
+            self._edit_col_counts,
+            (origins["first_edit_col"].astype(np.intp) + 1, is_correct),
+            1,
+        )
+        self.num_rows += X.shape[0]
+
+    def merge(self, other: "StreamingEvaluation") -> None:
+        """
+        Adds the confusion, length and edit counts of other to these, so that rows evaluated in separate batches or
+        processes are reported as one evaluation. Both must use the same max_length and threshold.
+        """
+        if (other.max_length, other.threshold) != (self.max_length, self.threshold):
+            raise ValueError(
+                "Only evaluations with the same max_length and threshold can be merged"
+            )
+        self.num_rows += other.num_rows
+        self._confusion_counts += other._confusion_counts
+        self._length_counts += other._length_counts
+        self._edit_kinds_counts += other._edit_kinds_counts
+        self._edit_col_counts += other._edit_col_counts
+
+    def confusion_matrices(self) -> Dict[ReberDataType, np.ndarray]:
+        """
+        :return: for each datatype, a 2x2 matrix of the number of rows with each [true label, predicted label]
+        """
+        return {
+            datatype: self._confusion_counts[datatype_idx].copy()
+            for datatype_idx, datatype in enumerate(ReberDataType)
+        }
+
+    @staticmethod
+    def _accuracies(counts: np.ndarray, index: pd.Index) -> pd.Series:
+        num_rows = counts.sum(axis=1)
+        has_rows = num_rows > 0
+        return pd.Series(
+            counts[has_rows, 1] / num_rows[has_rows], index=index[has_rows]
+        )
+
+    def accuracy_by_datatype(self) -> pd.Series:
+        """
+        :return: the accuracy over the rows of each datatype that was seen
+        """
+        counts = self._confusion_counts
+        num_correct = counts[:, 0, 0] + counts[:, 1, 1]
+        return self._accuracies(
+            np.stack([counts.sum(axis=(1, 2)) - num_correct, num_correct], axis=1),
+            pd.Index([datatype.value for datatype in ReberDataType], name="datatype"),
+        )
+
+    def accuracy_by_length(self) -> pd.Series:
+        """
+        :return: the accuracy over the rows of each length that was seen
+        """
+        return self._accuracies(
+            self._length_counts, pd.RangeIndex(self.max_length + 1, name="length")
+        )
+
+    def accuracy_by_edit_kinds(self) -> pd.Series:
+        """
+        :return: the accuracy over the rows with each combination of `EditKind`s that was seen, where 0 means
+            unedited rows
+        """
+        return self._accuracies(
+            self._edit_kinds_counts,
+            pd.RangeIndex(self._edit_kinds_counts.shape[0], name="edit_kinds"),
+        )
+
+    def accuracy_by_edit_col(self) -> pd.Series:
+        """
+        :return: the accuracy over the edited rows by the leftmost column that was edited
+        """
+        return self._accuracies(
+            self._edit_col_counts[1:],
+            pd.RangeIndex(self.max_length, name="first_edit_col"),
+        )
+
+
+def evaluate(
+    generator: ReberGenerator,
+    predictor: Predictor,
+    num_batches: int,
+    batch_size: int = 4096,
+    threshold: float = 0.5,
+    **kwargs: Dict[str, int],
+) -> StreamingEvaluation:
+    """
+    Generates num_batches batches with `generator.iter_batches` and evaluates predictor on them
+    :param predictor: maps a (batch_size, generator.max_length) matrix of encoded strings to the probability that each
+        one is valid, e.g. one of the predictors of `prediction_server`
+    :param kwargs: maps ReberDataTypes (the strings of the names of the enums) to percentages, like for
+        `generator.iter_batches`
+    """
+    evaluation = StreamingEvaluation(generator.max_length, threshold)
+    for X, _, origins in generator.iter_batches(
+        batch_size, num_batches, return_origins=True, **kwargs
+    ):
+        evaluation.update(X, origins, predictor(X), generator.recognizer.predict(X))
+    return evaluation
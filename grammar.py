@@ -0,0 +1,561 @@
+"""
+Regular grammars, described by a declarative spec (a python dict or JSON) and compiled into dense numpy tables that
+`reber.ReberGenerator` walks and recognizes strings with.
+
+A spec looks like:
+    {
+        "alphabet": "BEPSTVX",
+        "start_graph": "embedded_reber",
+        "graphs": {
+            "reber": {"start": 0, "end": 7, "edges": [[0, 1, "B"], [1, 2, "T"], ...]},
+            "embedded_reber": {"start": 0, "end": 7, "edges": [..., [2, 3, {"graph": "reber"}], ...]},
+        },
+    }
+Each edge is [from_node, to_node, label] or [from_node, to_node, label, weight]. A label is either a non-empty string
+of letters of the alphabet, or {"graph": name} to emit any string of another graph in the spec. A random walk
+through a graph picks among the outgoing edges of each node with probability proportional to their weights, which
+default to 1. Weights may not be negative, and the edges of each node must have a positive total weight. An edge of
+weight 0 is never taken, so it is left out of the compiled grammar altogether. The walk stops as soon as it reaches
+the end node of a graph, so the end node may not have any outgoing edges.
+"""
+
+from collections import defaultdict, deque
+import itertools
+import json
+
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+PADDING_VALUE = 0
+
+
+class Grammar:
+    """
+    The start graph of a spec, with every edge that emits a sub-graph inlined, flattened so that every edge emits
+    exactly one (shifted) letter. Each path keeps the probability that the random walk through the spec assigns it.
+
+    next_state[s, k], emission[s, k] and probability[s, k] describe the kth outgoing edge of state s.
+    Unused edge slots have a probability of 0 so they can never be chosen.
+    """
+
+    def __init__(self, alphabet: str, graphs: Dict[str, dict], start_graph: str):
+        if len(set(alphabet)) != len(alphabet):
+            raise ValueError(f"The alphabet {alphabet} has repeated letters")
+        if start_graph not in graphs:
+            raise ValueError(f"Unknown start graph {start_graph}")
+        self.spec = {"alphabet": alphabet, "graphs": graphs, "start_graph": start_graph}
+        self.alphabet = alphabet
+        self.letter_to_int = {  # shifted so that 0 will represent a padding token
+            letter: idx + 1 for idx, letter in enumerate(alphabet)
+        }
+        self.num_letters = len(alphabet)
+        self._graphs = graphs
+        self._state_counter = itertools.count()
+        # state -> [(letter or None for an epsilon edge, next state, probability)]
+        self._edges: Dict[int, List[Tuple[Optional[int], int, float]]] = defaultdict(
+            list
+        )
+
+        start_state = next(self._state_counter)
+        end_state = next(self._state_counter)
+        self._inline(start_graph, start_state, end_state, graph_stack=())
+        self._remove_epsilon_edges()
+        self._build_arrays(start_state, end_state)
+        # only needed while compiling
+        del self._graphs, self._state_counter, self._edges
+        self.recognizer = Recognizer(self)
+        self._letter_transitions = self._make_letter_transitions()
+        self.alternates, self.next_chars = self._derive_letter_sets()
+
+    @classmethod
+    def from_spec(cls, spec: dict) -> "Grammar":
+        return cls(spec["alphabet"], spec["graphs"], spec["start_graph"])
+
+    @classmethod
+    def from_json(cls, path: str) -> "Grammar":
+        with open(path) as f:
+            return cls.from_spec(json.load(f))
+
+    def _inline(
+        self,
+        graph_name: str,
+        entry_state: int,
+        exit_state: int,
+        graph_stack: Tuple[str, ...],
+    ) -> None:
+        if graph_name in graph_stack:
+            raise ValueError(
+                f"Graph {graph_name} contains itself, so the grammar isn't regular"
+            )
+        graph = self._graphs[graph_name]
+        node_to_state = defaultdict(lambda: next(self._state_counter))
+        node_to_state[graph["start"]] = entry_state
+        node_to_state[graph["end"]] = exit_state
+        node_to_edges = defaultdict(list)
+        for edge in graph["edges"]:
+            from_node, to_node, label, *weight = edge
+            if from_node == graph["end"]:
+                raise ValueError(
+                    f"The end node {from_node} of graph {graph_name} has an outgoing edge, but the walk stops there"
+                )
+            weight = weight[0] if weight else 1
+            if weight < 0:
+                raise ValueError(
+                    f"Edge {from_node} -> {to_node} of graph {graph_name} has a negative weight {weight}"
+                )
+            node_to_edges[from_node].append((to_node, label, weight))
+
+        for from_node, edges in node_to_edges.items():
+            from_state = node_to_state[from_node]
+            total_weight = sum(weight for _, _, weight in edges)
+            if total_weight <= 0:
+                raise ValueError(
+                    f"The edges of node {from_node} of graph {graph_name} must have a positive total weight"
+                )
+            for to_node, label, weight in edges:
+                if weight == 0:
+                    # never taken, so no string may be recognized through it either
+                    continue
+                to_state = node_to_state[to_node]
+                probability = weight / total_weight
+                if isinstance(label, dict):
+                    sub_graph_name = label["graph"]
+                    if sub_graph_name not in self._graphs:
+                        raise ValueError(f"Unknown graph {sub_graph_name}")
+                    sub_entry_state = next(self._state_counter)
+                    self._edges[from_state].append((None, sub_entry_state, probability))
+                    self._inline(
+                        sub_graph_name,
+                        sub_entry_state,
+                        to_state,
+                        graph_stack + (graph_name,),
+                    )
+                    continue
+                unknown_letters = set(label) - set(self.alphabet)
+                if unknown_letters:
+                    raise ValueError(
+                        f"Letters {sorted(unknown_letters)} of graph {graph_name} are not in the alphabet"
+                    )
+                if not label:
+                    raise ValueError(
+                        f"Edge {from_node} -> {to_node} of graph {graph_name} must emit at least one letter"
+                    )
+                curr_state = from_state
+                for i, letter in enumerate(label):
+                    next_state = (
+                        to_state if i == len(label) - 1 else next(self._state_counter)
+                    )
+                    edge_probability = probability if i == 0 else 1
+                    self._edges[curr_state].append(
+                        (self.letter_to_int[letter], next_state, edge_probability)
+                    )
+                    curr_state = next_state
+
+    def _remove_epsilon_edges(self) -> None:
+        # an epsilon edge u -> v with probability p is replaced by v's outgoing edges, each scaled by p
+        has_epsilon = True
+        while has_epsilon:
+            has_epsilon = False
+            for state, edges in list(self._edges.items()):
+                new_edges = []
+                for letter, to_state, probability in edges:
+                    if letter is None:
+                        has_epsilon = True
+                        new_edges.extend(
+                            (next_letter, next_state, probability * next_probability)
+                            for next_letter, next_state, next_probability in self._edges[
+                                to_state
+                            ]
+                        )
+                    else:
+                        new_edges.append((letter, to_state, probability))
+                self._edges[state] = new_edges
+
+    def _build_arrays(self, start_state: int, end_state: int) -> None:
+        # renumber the states reachable from the start so that the arrays stay small
+        old_to_new = {start_state: 0}
+        queue = deque([start_state])
+        while queue:
+            state = queue.popleft()
+            for _, to_state, _ in self._edges[state]:
+                if to_state not in old_to_new:
+                    old_to_new[to_state] = len(old_to_new)
+                    queue.append(to_state)
+        if end_state not in old_to_new:
+            raise ValueError("The end node is not reachable from the start node")
+
+        num_states = len(old_to_new)
+        max_out_degree = max(len(self._edges[state]) for state in old_to_new)
+        self.start_state = 0
+        self.end_state = old_to_new[end_state]
+        self.num_states = num_states
+        self.out_degree = np.zeros(num_states, dtype=np.int64)
+        self.next_state = np.full(
+            (num_states, max_out_degree), self.end_state, dtype=np.int64
+        )
+        self.emission = np.full(
+            (num_states, max_out_degree), PADDING_VALUE, dtype=np.int64
+        )
+        self.probability = np.zeros((num_states, max_out_degree))
+        for old_state, state in old_to_new.items():
+            edges = self._edges[old_state]
+            self.out_degree[state] = len(edges)
+            for k, (letter, to_state, probability) in enumerate(edges):
+                self.next_state[state, k] = old_to_new[to_state]
+                self.emission[state, k] = letter
+                self.probability[state, k] = probability
+
+    def _derive_letter_sets(self) -> Tuple[Dict[str, Set[str]], Dict[str, Set[str]]]:
+        """
+        :return: alternates, next_chars where
+            alternates maps each letter to the letters that can take its place in some valid string, i.e. replacing
+            a letter with anything else is guaranteed to yield an invalid string
+            next_chars maps each letter, and "" for the start of the string, to the letters that can follow it in
+            some valid string, i.e. inserting anything else after it is guaranteed to yield an invalid string
+        """
+        transitions = self.recognizer.transitions
+        is_live = self.recognizer.is_live
+        letters = range(1, self.num_letters + 1)
+
+        def live_letters(state: int) -> Set[str]:
+            return {
+                self.alphabet[letter - 1]
+                for letter in letters
+                if is_live[transitions[state, letter]]
+            }
+
+        alternates = {letter: set() for letter in self.alphabet}
+        next_chars = {letter: set() for letter in self.alphabet}
+        next_chars[""] = live_letters(self.recognizer.start_state)
+        for state in np.flatnonzero(is_live):
+            state_letters = live_letters(state)
+            for letter in state_letters:
+                alternates[letter] |= state_letters - {letter}
+                next_state = transitions[state, self.letter_to_int[letter]]
+                next_chars[letter] |= live_letters(next_state)
+        return alternates, next_chars
+
+    def _weighted_path_totals(
+        self, max_length: int, edge_weights: np.ndarray
+    ) -> np.ndarray:
+        # totals[s, r] = sum, over every path from s to the end state that emits exactly r letters, of the product of
+        # the weights of the edges along that path
+        totals = np.zeros((self.num_states, max_length + 1), dtype=edge_weights.dtype)
+        totals[self.end_state, 0] = 1
+        for r in range(1, max_length + 1):
+            totals[:, r] = (edge_weights * totals[self.next_state, r - 1]).sum(axis=1)
+        # the walk stops as soon as it reaches the end state
+        totals[self.end_state, 1:] = 0
+        return totals
+
+    def finish_probabilities(self, max_length: int) -> np.ndarray:
+        """
+        :return: a (num_states, max_length + 1) matrix whose [s, r] entry is the probability that a walk starting at
+            state s reaches the end state after emitting exactly r letters
+        """
+        return self._weighted_path_totals(max_length, self.probability)
+
+    def path_counts(self, max_length: int) -> np.ndarray:
+        """
+        :return: a (num_states, max_length + 1) matrix whose [s, r] entry is the number of distinct paths from state s
+            to the end state that emit exactly r letters
+        """
+        return self._weighted_path_totals(
+            max_length, (self.probability > 0).astype(np.int64)
+        )
+
+    # rows scored at once, which bounds the size of the forward probabilities of nondeterministic grammars
+    _score_chunk_num_rows = 2**16
+
+    def _make_letter_transitions(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        :return: next_state, log_probability where [s, x] describe the edge of state s that emits symbol x, and padding
+            keeps the end state where it is. Any other symbol leads to the extra state num_states, which never leaves.
+            None if some state has several edges emitting the same letter, so that a string can take several paths.
+        """
+        num_symbols = self.num_letters + 1
+        dead_state = self.num_states
+        next_state = np.full((self.num_states + 1, num_symbols), dead_state)
+        log_probability = np.zeros((self.num_states + 1, num_symbols))
+        for state in range(self.num_states):
+            # the walk stops as soon as it reaches the end state
+            if state == self.end_state:
+                continue
+            for k in np.flatnonzero(self.probability[state] > 0):
+                letter = self.emission[state, k]
+                if next_state[state, letter] != dead_state:
+                    return None
+                next_state[state, letter] = self.next_state[state, k]
+                log_probability[state, letter] = np.log(self.probability[state, k])
+        next_state[self.end_state, PADDING_VALUE] = self.end_state
+        return next_state, log_probability
+
+    def _forward_probabilities(self, X: np.ndarray) -> np.ndarray:
+        """
+        :return: the probability of every row of X, summed over all the paths that emit it
+        """
+        num_symbols = self.num_letters + 1
+        # [x, s, t] is the probability of stepping from state s to state t while emitting symbol x
+        symbol_steps = np.zeros((num_symbols, self.num_states, self.num_states))
+        for state in range(self.num_states):
+            if state == self.end_state:
+                continue
+            for k in np.flatnonzero(self.probability[state] > 0):
+                symbol_steps[
+                    self.emission[state, k], state, self.next_state[state, k]
+                ] += self.probability[state, k]
+        symbol_steps[PADDING_VALUE, self.end_state, self.end_state] = 1
+        state_probabilities = np.zeros((X.shape[0], self.num_states))
+        state_probabilities[:, self.start_state] = 1
+        for col in range(X.shape[1]):
+            for symbol in range(num_symbols):
+                rows = X[:, col] == symbol
+                state_probabilities[rows] = (
+                    state_probabilities[rows] @ symbol_steps[symbol]
+                )
+        return state_probabilities[:, self.end_state]
+
+    def log_probabilities(self, X: np.ndarray) -> np.ndarray:
+        """
+        :param X: (N, L) matrix of encoded and padded strings
+        :return: the log of the probability that the random walk through the grammar, without any limit on its
+            length, emits each row; -inf for rows that aren't strings of the grammar
+        """
+        X = np.asarray(X)
+        num_symbols = self.num_letters + 1
+        if X.size and (X.min() < 0 or X.max() >= num_symbols):
+            raise ValueError(f"X may only contain values in [0, {num_symbols})")
+        log_probabilities = np.empty(X.shape[0])
+        for start in range(0, X.shape[0], self._score_chunk_num_rows):
+            chunk = X[start : start + self._score_chunk_num_rows]
+            out = log_probabilities[start : start + self._score_chunk_num_rows]
+            if self._letter_transitions is None:
+                with np.errstate(divide="ignore"):
+                    out[:] = np.log(self._forward_probabilities(chunk))
+                continue
+            next_state, log_probability = self._letter_transitions
+            states = np.full(chunk.shape[0], self.start_state)
+            out[:] = 0
+            for col in range(chunk.shape[1]):
+                symbols = chunk[:, col]
+                out += log_probability[states, symbols]
+                states = next_state[states, symbols]
+            out[states != self.end_state] = -np.inf
+        return log_probabilities
+
+
+class Recognizer:
+    """
+    A deterministic automaton, compiled from a `Grammar`, that recognizes whole batches of padded and encoded strings
+    (like the rows of X from `ReberGenerator.make_data`) at once by stepping every row through a transition table one
+    column at a time. Padding is only accepted at the end of a row, after a complete string.
+    """
+
+    def __init__(self, grammar: Grammar):
+        num_symbols = grammar.num_letters + 1  # including padding
+        # subset construction: each automaton state is the set of grammar states that the prefix read so far could
+        # have led to. The empty set is the dead state.
+        dead = frozenset()
+        start = frozenset([grammar.start_state])
+        subset_to_state = {dead: 0, start: 1}
+        transitions = [[0] * num_symbols, [0] * num_symbols]
+        queue = deque([start])
+        while queue:
+            subset = queue.popleft()
+            for letter in range(1, num_symbols):
+                next_subset = frozenset(
+                    grammar.next_state[state, k]
+                    for state in subset
+                    for k in range(grammar.out_degree[state])
+                    if grammar.emission[state, k] == letter
+                )
+                if next_subset not in subset_to_state:
+                    subset_to_state[next_subset] = len(subset_to_state)
+                    transitions.append([0] * num_symbols)
+                    queue.append(next_subset)
+                transitions[subset_to_state[subset]][letter] = subset_to_state[
+                    next_subset
+                ]
+        # once an accepted string is followed by padding, nothing but more padding may follow
+        padded = len(transitions)
+        transitions.append([padded] + [0] * grammar.num_letters)
+        accepting = [grammar.end_state in subset for subset in subset_to_state]
+        for subset, state in subset_to_state.items():
+            if grammar.end_state in subset:
+                transitions[state][PADDING_VALUE] = padded
+
+        self.num_symbols = num_symbols
+        self.start_state = subset_to_state[start]
+        self.transitions = np.array(transitions, dtype=np.intp)
+        self.accepting = np.array(accepting + [True])
+        self.is_live = self._find_live_states(np.array(accepting + [False]))
+
+    def _find_live_states(self, accepting: np.ndarray) -> np.ndarray:
+        """
+        :return: a boolean vector that is True for every state from which some letters lead to an accepting state
+        """
+        is_live = accepting.copy()
+        changed = True
+        while changed:
+            leads_to_live = is_live[self.transitions[:, 1:]].any(axis=1)
+            changed = bool((leads_to_live & ~is_live).any())
+            is_live |= leads_to_live
+        return is_live
+
+    def accepts(self, X: np.ndarray) -> np.ndarray:
+        """
+        :param X: (N, L) matrix of encoded and padded strings
+        :return: a boolean vector that is True for every row of X that is a valid string
+        """
+        X = np.asarray(X)
+        if X.size and (X.min() < 0 or X.max() >= self.num_symbols):
+            raise ValueError(f"X may only contain values in [0, {self.num_symbols})")
+        states = np.full(X.shape[0], self.start_state, dtype=np.intp)
+        for col in range(X.shape[1]):
+            states = self.transitions[states, X[:, col]]
+        return self.accepting[states]
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        :return: the class label of each row of X; 1 means that the string is valid, like in `ReberDataType`
+        """
+        return self.accepts(X).astype(np.int64)
+
+
+class StringIndex:
+    """
+    Numbers every string of at most max_length letters that a `Recognizer` accepts, in lexicographic order of the
+    encoded letters (a string comes right before its extensions), so that the strings can be counted, and any rank
+    turned into its string and back in O(max_length) steps, for whole batches at once.
+    """
+
+    def __init__(self, recognizer: Recognizer, max_length: int):
+        num_states = recognizer.transitions.shape[0]
+        letter_transitions = recognizer.transitions[:, 1:]
+        accepting = recognizer.accepting.astype(np.int64)
+        # num_strings_up_to[q, r] = number of strings of at most r letters that lead from state q to acceptance.
+        # The same in floats tells us if the ints overflowed.
+        num_strings_up_to = np.zeros((num_states, max_length + 1), dtype=np.int64)
+        approx_num_strings_up_to = np.zeros(num_strings_up_to.shape)
+        num_strings_up_to[:, 0] = approx_num_strings_up_to[:, 0] = accepting
+        for r in range(1, max_length + 1):
+            num_strings_up_to[:, r] = accepting + num_strings_up_to[
+                letter_transitions, r - 1
+            ].sum(axis=1)
+            approx_num_strings_up_to[:, r] = accepting + approx_num_strings_up_to[
+                letter_transitions, r - 1
+            ].sum(axis=1)
+        if approx_num_strings_up_to.max() >= 2**62:
+            raise OverflowError(
+                f"There are too many strings of at most {max_length} letters to index"
+            )
+        # num_strings_before[q, a, r] = number of strings of at most r letters, following state q, whose first letter
+        # comes before letter a, for a in [1, num_symbols]
+        self._num_strings_before = np.zeros(
+            (num_states, recognizer.num_symbols + 1, max_length + 1), dtype=np.int64
+        )
+        self._num_strings_before[:, 2:] = num_strings_up_to[letter_transitions].cumsum(
+            axis=1
+        )
+
+        self.max_length = max_length
+        self._recognizer = recognizer
+        self._letter_transitions = letter_transitions
+        self._accepting = recognizer.accepting
+        self.num_strings = int(num_strings_up_to[recognizer.start_state, max_length])
+        self.length_counts = np.diff(
+            num_strings_up_to[recognizer.start_state], prepend=0
+        )
+
+    def __len__(self) -> int:
+        return self.num_strings
+
+    def unrank(self, ranks: np.ndarray, dtype: np.dtype = np.uint8) -> np.ndarray:
+        """
+        :param ranks: vector of ints in [0, len(self))
+        :return: a (len(ranks), self.max_length) matrix of the encoded and padded strings with those ranks
+        """
+        ranks = np.array(ranks, dtype=np.int64).ravel()
+        if ranks.size and (ranks.min() < 0 or ranks.max() >= self.num_strings):
+            raise ValueError(f"Ranks must be in [0, {self.num_strings})")
+        X = np.full((ranks.size, self.max_length), PADDING_VALUE, dtype=dtype)
+        row_idxes = np.arange(ranks.size)
+        states = np.full(ranks.size, self._recognizer.start_state, dtype=np.intp)
+        for col in range(self.max_length):
+            # the string that ends here comes before all of its extensions
+            is_accepting = self._accepting[states]
+            is_unfinished = ~(is_accepting & (ranks == 0))
+            ranks -= is_accepting
+            row_idxes = row_idxes[is_unfinished]
+            states = states[is_unfinished]
+            ranks = ranks[is_unfinished]
+            # counts of the strings that start with each letter, cumulated
+            num_strings_through_letter = self._num_strings_before[
+                states, 2:, self.max_length - col - 1
+            ]
+            letter_idxes = (num_strings_through_letter <= ranks[:, None]).sum(axis=1)
+            letters = letter_idxes + 1
+            ranks -= self._num_strings_before[
+                states, letters, self.max_length - col - 1
+            ]
+            states = self._letter_transitions[states, letter_idxes]
+            X[row_idxes, col] = letters
+        return X
+
+    def rank(self, X: np.ndarray) -> np.ndarray:
+        """
+        Inverse of `unrank`
+        :param X: (N, L) matrix of encoded and padded strings, each of which must be accepted and at most
+            self.max_length letters long
+        :return: a vector of the rank of each row
+        """
+        X = np.asarray(X)
+        is_indexed = self._recognizer.accepts(X)
+        is_indexed &= (X != PADDING_VALUE).sum(axis=1) <= self.max_length
+        unindexed_row_idxes = np.flatnonzero(~is_indexed)
+        if unindexed_row_idxes.size:
+            raise ValueError(
+                f"{unindexed_row_idxes.size} rows aren't valid strings of at most {self.max_length} letters, "
+                f"e.g. rows {unindexed_row_idxes[:10].tolist()}"
+            )
+        ranks = np.zeros(X.shape[0], dtype=np.int64)
+        states = np.full(X.shape[0], self._recognizer.start_state, dtype=np.intp)
+        for col in range(min(X.shape[1], self.max_length)):
+            row_idxes = np.flatnonzero(X[:, col] != PADDING_VALUE)
+            row_states = states[row_idxes]
+            letters = X[row_idxes, col].astype(np.intp)
+            ranks[row_idxes] += self._accepting[row_states]
+            ranks[row_idxes] += self._num_strings_before[
+                row_states, letters, self.max_length - col - 1
+            ]
+            states[row_idxes] = self._letter_transitions[row_states, letters - 1]
+        return ranks
+
+    def sample(
+        self,
+        num_rows: int,
+        np_random: np.random.Generator,
+        dtype: np.dtype = np.uint8,
+    ) -> np.ndarray:
+        """
+        :return: num_rows distinct strings, drawn uniformly at random without replacement, in random order
+        """
+        if num_rows > self.num_strings:
+            raise ValueError(
+                f"Only {self.num_strings} distinct strings have at most {self.max_length} letters; "
+                f"{num_rows} were asked for"
+            )
+        return self.unrank(
+            np_random.choice(self.num_strings, num_rows, replace=False), dtype
+        )
+
+    def iter_rows(
+        self, batch_size: int = 2**14, dtype: np.dtype = np.uint8
+    ) -> Iterator[np.ndarray]:
+        """
+        :return: an iterator over every string in lexicographic order, in batches of at most batch_size rows
+        """
+        for start in range(0, self.num_strings, batch_size):
+            yield self.unrank(
+                np.arange(start, min(start + batch_size, self.num_strings)), dtype
+            )
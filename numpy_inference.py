@@ -0,0 +1,218 @@
+"""
+Runs the Embedding -> LSTM -> Dense classifiers trained in the notebook on the CPU with nothing but numpy, so scoring
+strings needs neither TensorFlow's import nor its graph startup.
+
+    # once, wherever TensorFlow is installed
+    export_keras_model(tf.keras.models.load_model("test_model"), "test_model.npz")
+    # then, anywhere
+    classifier = NumpyLSTMClassifier.from_file("test_model.npz")
+    classifier.predict(X)  # like model.predict(X)
+"""
+
+import json
+
+import numpy as np
+from typing import Callable, Dict, List
+
+from ragged import row_lengths
+
+# maps a (N, max_length) matrix of encoded strings to the probability that each one is valid
+Predictor = Callable[[np.ndarray], np.ndarray]
+
+_CONFIG_KEY = "config"
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-x))
+
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    exp_x = np.exp(x - x.max(axis=-1, keepdims=True))
+    return exp_x / exp_x.sum(axis=-1, keepdims=True)
+
+
+_ACTIVATIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "tanh": np.tanh,
+    "sigmoid": _sigmoid,
+    "hard_sigmoid": lambda x: np.clip(0.2 * x + 0.5, 0, 1),  # as keras defines it
+    "softmax": _softmax,
+}
+# layers that do nothing at inference time
+_SKIPPED_LAYERS = {"InputLayer", "Dropout", "SpatialDropout1D"}
+
+
+def _get_activation(name: str) -> Callable[[np.ndarray], np.ndarray]:
+    if name not in _ACTIVATIONS:
+        raise ValueError(f"Unsupported activation {name}")
+    return _ACTIVATIONS[name]
+
+
+def export_keras_model(model, path: str) -> None:
+    """
+    Saves the weights of a keras model, e.g. the one that `clf.export_model()` returns in the notebook, to a .npz
+    file that `NumpyLSTMClassifier.from_file` loads
+    :param model: a keras model made of an Embedding, then LSTMs, then Dense and Activation layers. Dropout layers
+        are left out.
+    """
+    layer_configs = []
+    arrays = {}
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind in _SKIPPED_LAYERS:
+            continue
+        config = layer.get_config()
+        layer_config = {"kind": kind}
+        if kind == "Embedding":
+            layer_config["mask_zero"] = config.get("mask_zero", False)
+        elif kind == "LSTM":
+            if config.get("go_backwards") or config.get("stateful"):
+                raise ValueError(f"Layer {layer.name} runs backwards or is stateful")
+            layer_config["activation"] = config["activation"]
+            layer_config["recurrent_activation"] = config["recurrent_activation"]
+            layer_config["return_sequences"] = config["return_sequences"]
+        elif kind in ("Dense", "Activation"):
+            layer_config["activation"] = config["activation"]
+        else:
+            raise ValueError(f"Layer {layer.name} of type {kind} isn't supported")
+        layer_weights = layer.get_weights()
+        layer_config["num_weights"] = len(layer_weights)
+        for weight_idx, weight in enumerate(layer_weights):
+            arrays[f"{len(layer_configs)}_{weight_idx}"] = weight
+        layer_configs.append(layer_config)
+    np.savez(path, **{_CONFIG_KEY: json.dumps(layer_configs)}, **arrays)
+
+
+class NumpyLSTMClassifier:
+    """
+    The forward pass of an exported Embedding -> LSTM(s) -> Dense classifier, over whole padded batches at once.
+
+    When the embedding masks padding (mask_zero), the recurrence of each row stops at its true length, like keras
+    skips masked timesteps: rows are sorted by length so that each timestep only updates the rows that are still
+    running. Otherwise keras runs the recurrence over the padding as well, and so does this.
+    """
+
+    def __init__(self, layer_configs: List[dict], weights: List[List[np.ndarray]]):
+        """
+        :param layer_configs: one dict per layer, as written by `export_keras_model`
+        :param weights: the keras weights of each layer
+        """
+        kinds = [config["kind"] for config in layer_configs]
+        if kinds[:2] != ["Embedding", "LSTM"]:
+            raise ValueError(
+                f"The model must start with an Embedding and an LSTM; starts with {kinds[:2]}"
+            )
+        self.layer_configs = layer_configs
+        self.weights = [
+            [np.asarray(weight, dtype=np.float32) for weight in layer_weights]
+            for layer_weights in weights
+        ]
+        (embeddings,) = self.weights[0]
+        self.mask_zero = layer_configs[0]["mask_zero"]
+        self.num_symbols = embeddings.shape[0]
+        # the first LSTM only ever sees embedded symbols, so its input projection is a lookup table as well
+        kernel, _, *bias = self.weights[1]
+        self._symbol_to_projection = embeddings @ kernel + sum(bias)
+
+    @classmethod
+    def from_file(cls, path: str) -> "NumpyLSTMClassifier":
+        """
+        :param path: a file written by `export_keras_model`
+        """
+        with np.load(path) as arrays:
+            layer_configs = json.loads(str(arrays[_CONFIG_KEY]))
+            weights = [
+                [
+                    arrays[f"{layer_idx}_{weight_idx}"]
+                    for weight_idx in range(config["num_weights"])
+                ]
+                for layer_idx, config in enumerate(layer_configs)
+            ]
+        return cls(layer_configs, weights)
+
+    @staticmethod
+    def _run_lstm(
+        config: dict,
+        weights: List[np.ndarray],
+        input_projections: np.ndarray,
+        lengths: np.ndarray,
+    ) -> np.ndarray:
+        """
+        :param input_projections: (N, T, 4 * units) inputs already multiplied by the kernel, plus the bias
+        :param lengths: the number of timesteps to run each row for, in decreasing order
+        :return: the (N, T, units) outputs if the layer returns sequences, otherwise the (N, units) last outputs
+        """
+        _, recurrent_kernel, *_ = weights
+        activation = _get_activation(config["activation"])
+        recurrent_activation = _get_activation(config["recurrent_activation"])
+        num_rows, num_timesteps, _ = input_projections.shape
+        units = recurrent_kernel.shape[0]
+        h = np.zeros((num_rows, units), dtype=np.float32)
+        c = np.zeros((num_rows, units), dtype=np.float32)
+        outputs = (
+            np.zeros((num_rows, num_timesteps, units), dtype=np.float32)
+            if config["return_sequences"]
+            else None
+        )
+        for t in range(num_timesteps):
+            # rows [0, n) are the ones whose recurrence hasn't stopped yet
+            n = np.count_nonzero(lengths > t)
+            z = input_projections[:n, t] + h[:n] @ recurrent_kernel
+            i, f, g, o = np.split(z, 4, axis=1)
+            c[:n] *= recurrent_activation(f)
+            c[:n] += recurrent_activation(i) * activation(g)
+            h[:n] = recurrent_activation(o) * activation(c[:n])
+            if outputs is not None:
+                # the outputs at masked timesteps stay 0; the next layer is masked the same way and ignores them
+                outputs[:n, t] = h[:n]
+        return h if outputs is None else outputs
+
+    def _predict_batch(self, X: np.ndarray) -> np.ndarray:
+        if self.mask_zero:
+            lengths = row_lengths(X)
+        else:
+            lengths = np.full(X.shape[0], X.shape[1])
+        # longest rows first
+        row_order = np.argsort(-lengths, kind="stable")
+        lengths = lengths[row_order]
+        X = X[row_order, : lengths.max(initial=0)]
+
+        lstm_config, lstm_weights = self.layer_configs[1], self.weights[1]
+        values = self._run_lstm(
+            lstm_config, lstm_weights, self._symbol_to_projection[X], lengths
+        )
+        for config, weights in zip(self.layer_configs[2:], self.weights[2:]):
+            if config["kind"] == "LSTM":
+                kernel, _, *bias = weights
+                values = self._run_lstm(
+                    config, weights, values @ kernel + sum(bias), lengths
+                )
+            elif config["kind"] == "Dense":
+                kernel, *bias = weights
+                values = _get_activation(config["activation"])(
+                    values @ kernel + sum(bias)
+                )
+            else:
+                values = _get_activation(config["activation"])(values)
+
+        predictions = np.empty_like(values)
+        predictions[row_order] = values
+        return predictions
+
+    def predict(self, X: np.ndarray, batch_size: int = 4096) -> np.ndarray:
+        """
+        :param X: (N, L) matrix of encoded and padded strings, like the rows of X from `ReberGenerator.make_data`
+        :param batch_size: number of rows to run through the model at once, which bounds the memory used
+        :return: the outputs of the last layer, e.g. an (N, 1) matrix of the probability that each row is valid, like
+            keras' `model.predict`
+        """
+        X = np.asarray(X)
+        if X.size and (X.min() < 0 or X.max() >= self.num_symbols):
+            raise ValueError(f"X may only contain values in [0, {self.num_symbols})")
+        return np.concatenate(
+            [
+                self._predict_batch(X[start : start + batch_size])
+                for start in range(0, max(X.shape[0], 1), batch_size)
+            ]
+        )
@@ -0,0 +1,270 @@
+"""
+A local server that answers "is this string an embedded reber string?" for many clients at once, by grouping the
+strings that arrive close together into micro-batches for one call of the model each.
+
+    python prediction_server.py --socket /tmp/reber.sock --predictor numpy --model test_model.npz
+
+Clients connect to the Unix socket (or to --port on localhost) and send one raw string per line. The server answers
+every line, in order, with a line of JSON: {"prediction": p} where p is the probability that the string is valid, or
+{"error": message} if the string can't be encoded. The line "#stats" is answered with `MicroBatcher.stats()`.
+"""
+
+import argparse
+import asyncio
+from collections import Counter, deque
+import json
+import time
+
+import numpy as np
+from typing import Optional, Sequence
+
+from numpy_inference import NumpyLSTMClassifier, Predictor
+from reber import ReberGenerator
+
+STATS_REQUEST = "#stats"
+
+
+def make_recognizer_predictor(generator: ReberGenerator) -> Predictor:
+    """
+    :return: a predictor that is exactly right, as it runs the grammar's recognizer instead of a model
+    """
+    return lambda X: generator.recognizer.predict(X).astype(np.float32)
+
+
+def make_numpy_predictor(model_path: str) -> Predictor:
+    """
+    :param model_path: a model written by `numpy_inference.export_keras_model`
+    """
+    classifier = NumpyLSTMClassifier.from_file(model_path)
+    return lambda X: classifier.predict(X)[:, 0]
+
+
+def make_keras_predictor(model_path: str) -> Predictor:
+    """
+    :param model_path: a model saved by keras, like `model.save('test_model')` in the notebook
+    """
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path)
+    return lambda X: model.predict(X)[:, 0]
+
+
+class MicroBatcher:
+    """
+    Collects single rows from concurrent callers into batches of at most max_batch_size rows, waiting at most
+    max_wait_seconds after the first row of a batch for more rows to arrive, and runs the predictor on each batch in
+    a worker thread so that the event loop keeps accepting rows meanwhile
+    """
+
+    # the number of most recent latencies that the percentiles are computed over
+    _num_latencies_kept = 10_000
+
+    def __init__(
+        self,
+        predictor: Predictor,
+        max_batch_size: int = 256,
+        max_wait_seconds: float = 0.002,
+    ):
+        if max_batch_size < 1:
+            raise AssertionError(
+                f"max_batch_size must be at least 1; was {max_batch_size}"
+            )
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._batching_task: Optional[asyncio.Task] = None
+        # the futures of the rows that were queued but not predicted yet
+        self._unfinished_futures = set()
+        self.num_requests = 0
+        self.batch_size_histogram = Counter()
+        self._latencies = deque(maxlen=self._num_latencies_kept)
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._batching_task = asyncio.ensure_future(self._run_batches())
+
+    async def stop(self) -> None:
+        """
+        Stops batching. The callers of rows that weren't predicted yet, whether they were still queued or in the batch
+        being predicted, get a RuntimeError.
+        """
+        self._batching_task.cancel()
+        try:
+            await self._batching_task
+        except asyncio.CancelledError:
+            pass
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        for future in list(self._unfinished_futures):
+            if not future.done():
+                future.set_exception(
+                    RuntimeError("The batcher stopped before predicting the row")
+                )
+
+    async def predict(self, row: Sequence[int]) -> float:
+        """
+        :param row: one encoded and padded string
+        :return: the prediction of self.predictor for the row, once the batch it ended up in has been predicted
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._unfinished_futures.add(future)
+        future.add_done_callback(self._unfinished_futures.discard)
+        self._queue.put_nowait((row, future, time.perf_counter()))
+        return await future
+
+    async def _collect_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            seconds_left = deadline - time.perf_counter()
+            if seconds_left <= 0:
+                # take whatever arrived meanwhile without waiting any longer
+                while len(batch) < self.max_batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), seconds_left))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            rows, futures, enqueue_times = zip(*batch)
+            try:
+                predictions = await loop.run_in_executor(
+                    None, self.predictor, np.array(rows)
+                )
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            done_time = time.perf_counter()
+            for future, prediction, enqueue_time in zip(
+                futures, predictions, enqueue_times
+            ):
+                # the caller may have given up on the prediction
+                if not future.done():
+                    future.set_result(float(prediction))
+                self._latencies.append(done_time - enqueue_time)
+            self.num_requests += len(batch)
+            self.batch_size_histogram[len(batch)] += 1
+
+    def stats(self) -> dict:
+        """
+        :return: the number of rows waiting for a batch, the number of rows predicted so far, how many batches of
+            each size were predicted, and the median and 99th percentile of the seconds from a row arriving to its
+            prediction, over the most recent rows
+        """
+        latencies = np.array(self._latencies)
+        p50, p99 = np.percentile(latencies, [50, 99]) if latencies.size else (0, 0)
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "num_requests": self.num_requests,
+            "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+            "latency_p50_seconds": float(p50),
+            "latency_p99_seconds": float(p99),
+        }
+
+
+class PredictionServer:
+    def __init__(self, generator: ReberGenerator, batcher: MicroBatcher):
+        """
+        :param generator: encodes the strings, which must fit into its max_length
+        """
+        self.generator = generator
+        self.batcher = batcher
+
+    async def _answer(self, line: str) -> dict:
+        if line == STATS_REQUEST:
+            return self.batcher.stats()
+        try:
+            row = self.generator.encode_as_padded_ints(line)
+        except AssertionError as e:
+            return {"error": str(e)}
+        try:
+            prediction = await self.batcher.predict(row)
+        except Exception as e:
+            # the connection has to go on answering the lines after this one
+            return {"error": f"Prediction failed: {e}"}
+        return {"prediction": prediction}
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        # answers are written in the order of the lines, while the lines themselves are predicted concurrently
+        answers: asyncio.Queue = asyncio.Queue()
+
+        async def write_answers():
+            while True:
+                answer = await answers.get()
+                if answer is None:
+                    break
+                writer.write(json.dumps(await answer).encode() + b"\n")
+                await writer.drain()
+
+        writer_task = asyncio.ensure_future(write_answers())
+        try:
+            async for raw_line in reader:
+                line = raw_line.decode(errors="replace").rstrip("\r\n")
+                answers.put_nowait(asyncio.ensure_future(self._answer(line)))
+        finally:
+            answers.put_nowait(None)
+            await writer_task
+            writer.close()
+            await writer.wait_closed()
+
+    async def serve(
+        self, socket_path: Optional[str] = None, port: Optional[int] = None
+    ) -> asyncio.AbstractServer:
+        """
+        Starts serving on a Unix socket at socket_path, or else on localhost at port
+        """
+        await self.batcher.start()
+        if socket_path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, socket_path)
+        return await asyncio.start_server(self.handle_connection, "127.0.0.1", port)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--socket", help="path of the Unix socket to listen on")
+    parser.add_argument("--port", type=int, default=8470)
+    parser.add_argument("--max-length", type=int, default=15)
+    parser.add_argument(
+        "--predictor", choices=["recognizer", "numpy", "keras"], default="recognizer"
+    )
+    parser.add_argument("--model", help="model file for the numpy or keras predictor")
+    parser.add_argument("--max-batch-size", type=int, default=256)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    generator = ReberGenerator(args.max_length)
+    if args.predictor == "recognizer":
+        predictor = make_recognizer_predictor(generator)
+    elif args.model is None:
+        parser.error(f"--predictor {args.predictor} needs --model")
+    elif args.predictor == "numpy":
+        predictor = make_numpy_predictor(args.model)
+    else:
+        predictor = make_keras_predictor(args.model)
+    server = PredictionServer(
+        generator,
+        MicroBatcher(predictor, args.max_batch_size, args.max_wait_ms / 1000),
+    )
+
+    async def serve_forever():
+        async with await server.serve(args.socket, args.port) as asyncio_server:
+            await asyncio_server.serve_forever()
+
+    asyncio.run(serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Generates batches in background threads or processes while the consumer (e.g. a training loop) works on the previous
+ones, so that it doesn't have to wait for generation in between.
+
+    with PrefetchingBatches(reber, batch_size=256, num_batches=1000, num_workers=2) as batches:
+        model.fit(batches, steps_per_epoch=1000)
+    print(batches.stats())
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Union
+
+from reber import COMPACT_DTYPE, ReberGenerator
+
+# how often blocked workers check whether they should stop
+_POLL_SECONDS = 0.1
+
+
+class _WorkerDone:
+    pass
+
+
+class _WorkerFailed:
+    def __init__(self, exception: BaseException, formatted_traceback: str):
+        self.exception = exception
+        self.formatted_traceback = formatted_traceback
+
+
+class WorkerError(RuntimeError):
+    """
+    Raised in the consumer when a worker failed; the worker's exception is the cause
+    """
+
+
+def _put_until_stopped(batch_queue, item: object, stop_event) -> bool:
+    """
+    :return: whether the item was put, rather than the worker being asked to stop while waiting for space
+    """
+    while not stop_event.is_set():
+        try:
+            batch_queue.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _produce_batches(
+    batch_queue,
+    stop_event,
+    generator_cls: type,
+    generator_kwargs: dict,
+    seed_sequence: np.random.SeedSequence,
+    batch_size: int,
+    num_batches: Optional[int],
+    dtype: np.dtype,
+    ragged: bool,
+    return_origins: bool,
+    datatype_kwargs: Dict[str, int],
+) -> None:
+    # each worker builds its own generator from the constructor arguments, seeded with its own seed, rather than being
+    # sent a copy of the generator: a copy would carry the state of the generator's RNGs, and every worker would
+    # generate the same batches
+    try:
+        reber = generator_cls(**generator_kwargs, seed=seed_sequence)
+        for batch in reber.iter_batches(
+            batch_size,
+            num_batches,
+            dtype,
+            ragged=ragged,
+            return_origins=return_origins,
+            **datatype_kwargs,
+        ):
+            if not _put_until_stopped(batch_queue, batch, stop_event):
+                return
+        _put_until_stopped(batch_queue, _WorkerDone(), stop_event)
+    except Exception as e:
+        _put_until_stopped(
+            batch_queue, _WorkerFailed(e, traceback.format_exc()), stop_event
+        )
+
+
+class PrefetchingBatches:
+    """
+    An iterator over (X, y) (or (X, y, origins)) batches like `ReberGenerator.iter_batches`, generated ahead of time
+    by background workers into a bounded queue. Workers block once the queue is full (backpressure), an exception in
+    a worker is raised in the consumer as a `WorkerError`, and `close` (or leaving the `with` block) stops the workers.
+
+    Each worker has its own seed, derived from the generator's, so every worker's batches are reproducible; with more
+    than one worker, the order in which their batches interleave isn't.
+    """
+
+    def __init__(
+        self,
+        generator: ReberGenerator,
+        batch_size: int,
+        num_batches: Optional[int] = None,
+        num_workers: int = 1,
+        queue_depth: int = 4,
+        use_processes: bool = False,
+        dtype: np.dtype = COMPACT_DTYPE,
+        ragged: bool = False,
+        return_origins: bool = False,
+        **kwargs: Dict[str, int],
+    ):
+        """
+        :param generator: the generator whose batches to prefetch. Workers generate with copies of it.
+        :param num_batches: number of batches to yield before stopping, split among the workers. Defaults to
+            yielding batches forever.
+        :param num_workers: number of threads (or processes) generating batches
+        :param queue_depth: number of ready batches that may wait for the consumer
+        :param use_processes: whether to generate in processes rather than threads. Processes sidestep the GIL, but
+            every batch has to be pickled over to the consumer.
+        :param ragged: whether to yield each X as `RaggedRows` rather than as a padded matrix
+        :param return_origins: whether to also yield the origins of the rows, like `ReberGenerator.iter_batches`
+        :param kwargs: maps ReberDataTypes (the strings of the names of the enums) to percentages, like for
+            `ReberGenerator.iter_batches`
+        """
+        if num_workers < 1:
+            raise AssertionError(f"num_workers must be at least 1; was {num_workers}")
+        if queue_depth < 1:
+            raise AssertionError(f"queue_depth must be at least 1; was {queue_depth}")
+        self.num_workers = num_workers
+        self.queue_depth = queue_depth
+        if use_processes:
+            context = multiprocessing.get_context()
+            self._queue = context.Queue(maxsize=queue_depth)
+            self._stop_event = context.Event()
+            worker_cls = context.Process
+        else:
+            self._queue = queue.Queue(maxsize=queue_depth)
+            self._stop_event = threading.Event()
+            worker_cls = threading.Thread
+        if num_batches is None:
+            worker_num_batches: List[Optional[int]] = [None] * num_workers
+        else:
+            worker_num_batches = [
+                len(range(worker_idx, num_batches, num_workers))
+                for worker_idx in range(num_workers)
+            ]
+        # a new seed per iterator so that repeated iterators don't return the same data
+        (prefetch_seed_sequence,) = generator._seed_sequence.spawn(1)
+        self._workers = [
+            worker_cls(
+                target=_produce_batches,
+                args=(
+                    self._queue,
+                    self._stop_event,
+                    type(generator),
+                    generator._init_kwargs,
+                    worker_seed_sequence,
+                    batch_size,
+                    worker_num_batches[worker_idx],
+                    dtype,
+                    ragged,
+                    return_origins,
+                    kwargs,
+                ),
+                daemon=True,
+            )
+            for worker_idx, worker_seed_sequence in enumerate(
+                prefetch_seed_sequence.spawn(num_workers)
+            )
+        ]
+        self._num_running_workers = num_workers
+        self._closed = False
+        self.num_batches = 0
+        self.wait_seconds = 0.0
+        self.num_waits = 0
+        for worker in self._workers:
+            worker.start()
+
+    def __iter__(self) -> Iterator[tuple]:
+        return self
+
+    def __next__(self) -> tuple:
+        while self._num_running_workers and not self._closed:
+            item = self._get()
+            if isinstance(item, _WorkerDone):
+                self._num_running_workers -= 1
+            elif isinstance(item, _WorkerFailed):
+                self.close()
+                raise WorkerError(
+                    f"A worker failed:\n{item.formatted_traceback}"
+                ) from item.exception
+            else:
+                self.num_batches += 1
+                return item
+        self.close()
+        raise StopIteration
+
+    def _get(self) -> Union[tuple, _WorkerDone, _WorkerFailed]:
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        # the consumer is faster than the workers
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    return self._queue.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    # e.g. a worker process that was killed
+                    if not any(worker.is_alive() for worker in self._workers):
+                        try:
+                            return self._queue.get_nowait()
+                        except queue.Empty:
+                            self.close()
+                            raise WorkerError("The workers exited without finishing")
+        finally:
+            self.wait_seconds += time.perf_counter() - start
+            self.num_waits += 1
+
+    def stats(self) -> dict:
+        """
+        :return: how many batches the consumer took, how many times it found no batch ready, and how long it waited
+            in total and per batch. Waiting on most batches means more workers would help; never waiting means
+            fewer would do.
+        """
+        return {
+            "num_batches": self.num_batches,
+            "num_waits": self.num_waits,
+            "wait_seconds": self.wait_seconds,
+            "wait_seconds_per_batch": (
+                self.wait_seconds / self.num_batches if self.num_batches else 0.0
+            ),
+        }
+
+    def close(self) -> None:
+        """
+        Stops the workers and waits for them to finish. Batches that weren't consumed yet are dropped.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stop_event.set()
+        for worker in self._workers:
+            # workers can't block on a full queue for longer than _POLL_SECONDS once stopped
+            while worker.is_alive():
+                self._drain()
+                worker.join(timeout=_POLL_SECONDS)
+        self._drain()
+
+    def _drain(self) -> None:
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __enter__(self) -> "PrefetchingBatches":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,130 @@
+"""
+Ways of holding encoded strings without padding every row out to max_length, as most generated strings are much
+shorter than that: ragged rows (one flat buffer of symbols plus offsets) and batches of rows of similar length that
+are only padded to the longest length in their bucket.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from typing import Iterator, Optional, Sequence, Tuple
+
+from grammar import PADDING_VALUE
+
+# the symbols of row i are symbols[offsets[i] : offsets[i + 1]]
+RaggedRows = namedtuple("RaggedRows", ["symbols", "offsets"])
+
+
+def row_lengths(X: np.ndarray) -> np.ndarray:
+    """
+    :param X: (N, L) matrix of encoded strings, padded with PADDING_VALUE at the end of each row
+    :return: the number of symbols in each row
+    """
+    return (np.asarray(X) != PADDING_VALUE).sum(axis=1)
+
+
+def to_ragged(X: np.ndarray) -> RaggedRows:
+    """
+    :param X: (N, L) matrix of encoded strings, padded with PADDING_VALUE at the end of each row
+    :return: the rows of X without their padding
+    """
+    X = np.asarray(X)
+    offsets = np.zeros(X.shape[0] + 1, dtype=np.int64)
+    np.cumsum(row_lengths(X), out=offsets[1:])
+    # padding only ever follows the symbols of a row, so the symbols come out in row order
+    return RaggedRows(symbols=X[X != PADDING_VALUE], offsets=offsets)
+
+
+def to_padded(rows: RaggedRows, width: Optional[int] = None) -> np.ndarray:
+    """
+    Inverse of `to_ragged`
+    :param width: the number of columns to pad the rows to. Defaults to the length of the longest row.
+    :return: an (N, width) matrix with the dtype of rows.symbols
+    """
+    lengths = np.diff(rows.offsets)
+    if width is None:
+        width = int(lengths.max()) if lengths.size else 0
+    elif lengths.size and lengths.max() > width:
+        raise ValueError(
+            f"Rows of up to {lengths.max()} symbols don't fit into {width} columns"
+        )
+    X = np.full((lengths.size, width), PADDING_VALUE, dtype=rows.symbols.dtype)
+    X[np.arange(width) < lengths[:, None]] = rows.symbols[
+        rows.offsets[0] : rows.offsets[-1]
+    ]
+    return X
+
+
+class LengthBucketedBatches:
+    """
+    Splits rows into buckets by length, and batches of each bucket are only padded to the longest length the bucket
+    allows. Iterating yields every row once, in batches shuffled within and across buckets.
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        y: np.ndarray,
+        batch_size: int,
+        bucket_boundaries: Optional[Sequence[int]] = None,
+        seed: Optional[int] = None,
+    ):
+        """
+        :param X: (N, L) matrix of encoded strings, padded with PADDING_VALUE at the end of each row
+        :param y: the labels of the rows of X
+        :param bucket_boundaries: increasing lengths; bucket i holds the rows that are longer than
+            bucket_boundaries[i - 1] but at most bucket_boundaries[i] symbols long. A last bucket holds all longer
+            rows. Defaults to one bucket per length.
+        :param seed: seed of the shuffling
+        """
+        if batch_size < 1:
+            raise AssertionError(f"batch_size must be at least 1; was {batch_size}")
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self._np_random = np.random.default_rng(seed)
+        width = X.shape[1]
+        if bucket_boundaries is None:
+            bucket_boundaries = range(width)
+        bucket_widths = np.unique(
+            np.minimum(np.append(bucket_boundaries, width), width)
+        )
+        lengths = row_lengths(X)
+        bucket_idxes = np.searchsorted(bucket_widths, lengths)
+        self._buckets = [
+            (int(bucket_width), np.flatnonzero(bucket_idxes == bucket_idx))
+            for bucket_idx, bucket_width in enumerate(bucket_widths)
+        ]
+        self._buckets = [
+            (w, row_idxes) for w, row_idxes in self._buckets if row_idxes.size
+        ]
+
+        num_symbols = int(lengths.sum())
+        self.num_padding_cells = (
+            sum(w * row_idxes.size for w, row_idxes in self._buckets) - num_symbols
+        )
+        self.num_unbucketed_padding_cells = X.shape[0] * width - num_symbols
+        # the fraction of the padding of X that the batches leave out
+        self.saved_padding_fraction = (
+            1 - self.num_padding_cells / self.num_unbucketed_padding_cells
+            if self.num_unbucketed_padding_cells
+            else 0.0
+        )
+
+    def __len__(self) -> int:
+        return sum(
+            -(-row_idxes.size // self.batch_size) for _, row_idxes in self._buckets
+        )
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        batches = []
+        for bucket_width, row_idxes in self._buckets:
+            shuffled_row_idxes = self._np_random.permutation(row_idxes)
+            for start in range(0, shuffled_row_idxes.size, self.batch_size):
+                batch_row_idxes = np.sort(
+                    shuffled_row_idxes[start : start + self.batch_size]
+                )
+                batches.append((bucket_width, batch_row_idxes))
+        for batch_idx in self._np_random.permutation(len(batches)):
+            bucket_width, batch_row_idxes = batches[batch_idx]
+            yield self.X[batch_row_idxes, :bucket_width], self.y[batch_row_idxes]
@@ -1,14 +1,81 @@
-# https://web.archive.org/web/20100801214816/https://cnl.salk.edu/~schraudo/teach/NNcourse/figs/reber.gif
-# TODO: find better labelling, make it clear to a reader which node means what
-from collections import namedtuple
+import bisect
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import itertools
+import json
+import logging
 import random
-from enum import Enum
+import time
+from enum import Enum, IntFlag
 
+import numpy as np
 import pandas as pd
-from typing import List, Tuple, Dict, Callable
+from typing import (
+    TYPE_CHECKING,
+    List,
+    Tuple,
+    Dict,
+    Callable,
+    Optional,
+    Union,
+    Iterator,
+    Iterable,
+)
+
+from grammar import PADDING_VALUE, Grammar, StringIndex
+from ragged import RaggedRows, row_lengths, to_ragged
+from row_keys import KeyIndex, max_packed_length, pack_rows
+
+if TYPE_CHECKING:
+    # dataset_stats imports this module
+    from dataset_stats import DatasetStats
 
-Edge = namedtuple("Edge", ["to", "get_str_list"])
-PADDING_VALUE = 0
+# the shifted reber letters and the padding value all fit into a byte
+COMPACT_DTYPE = np.uint8
+
+logger = logging.getLogger(__name__)
+
+# https://web.archive.org/web/20100801214816/https://cnl.salk.edu/~schraudo/teach/NNcourse/figs/reber.gif
+# TODO: find better labelling, make it clear to a reader which node means what
+# start and end nodes are the same in both graphs for convenience. See grammar.py for the format.
+EMBEDDED_REBER_GRAMMAR_SPEC = {
+    "alphabet": "BEPSTVX",
+    "start_graph": "embedded_reber",
+    "graphs": {
+        "reber": {
+            "start": 0,
+            "end": 7,
+            "edges": [
+                [0, 1, "B"],
+                [1, 2, "T"],
+                [1, 6, "P"],
+                [2, 2, "S"],
+                [2, 3, "X"],
+                [3, 4, "S"],
+                [3, 6, "X"],
+                [4, 7, "E"],
+                [5, 3, "P"],
+                [5, 4, "V"],
+                [6, 6, "T"],
+                [6, 5, "V"],
+            ],
+        },
+        "embedded_reber": {
+            "start": 0,
+            "end": 7,
+            "edges": [
+                [0, 1, "B"],
+                [1, 2, "T"],
+                [1, 6, "P"],
+                [2, 3, {"graph": "reber"}],
+                [3, 4, "T"],
+                [4, 7, "E"],
+                [5, 4, "P"],
+                [6, 5, {"graph": "reber"}],
+            ],
+        },
+    },
+}
 
 
 class ReberDataType(Enum):
@@ -18,11 +85,51 @@ class ReberDataType(Enum):
     RANDOM = "random"  # string that is randomly sampled from the reber alphabet (not guaranteed invalid reber, but probably)
 
     def get_class_label(self):
-        # all we care about is valid or invalid reber. All other classes are invalid, just in different ways
-        # TODO: maybe each one SHOULD have a class label so that we can make a confusion matrix!
+        # all we care about is valid or invalid reber. All other classes are invalid, just in different ways; pass
+        # return_origins to `ReberGenerator.make_data` to tell them apart, e.g. for `evaluation.StreamingEvaluation`
         return 1 if self == self.VALID else 0
 
 
+class EditKind(IntFlag):
+    # the edits that made a row invalid; a row that was perturbed several times can combine both kinds
+    REPLACEMENT = 1
+    INSERTION = 2
+    SYMMETRY_FLIP = 4
+
+
+# where each row came from, as returned by `ReberGenerator.make_data` with return_origins:
+# - datatype: the index of the row's ReberDataType in `list(ReberDataType)`
+# - edit_kinds: the `EditKind`s of the edits made to the row, or 0 if none were
+# - first_edit_col: the leftmost column of the finished row that was edited, or -1 if none was
+ORIGIN_DTYPE = np.dtype(
+    [("datatype", np.uint8), ("edit_kinds", np.uint8), ("first_edit_col", np.int16)]
+)
+
+
+def make_origins(num_rows: int) -> np.ndarray:
+    """
+    :return: ORIGIN_DTYPE records of num_rows unedited rows, all of the first datatype
+    """
+    origins = np.zeros(num_rows, dtype=ORIGIN_DTYPE)
+    origins["first_edit_col"] = -1
+    return origins
+
+
+def origins_to_frame(origins: np.ndarray) -> pd.DataFrame:
+    """
+    :return: the origins as a DataFrame, with the datatype as a categorical of the values of the ReberDataTypes
+    """
+    return pd.DataFrame(
+        {
+            "datatype": pd.Categorical.from_codes(
+                origins["datatype"], [datatype.value for datatype in ReberDataType]
+            ),
+            "edit_kinds": origins["edit_kinds"],
+            "first_edit_col": origins["first_edit_col"],
+        }
+    )
+
+
 class ReberDatatypeToPercentage:
     """
     Map of {ReberDataType: percentage} where percentage represents what proportion of data generated will be of that
@@ -92,53 +199,189 @@ class DatatypeToRowCount:
         return self.datatype_to_row_count[datatype]
 
 
-class ReberGenerator:
-    # start and end idxes are the same in both graphs for convenience
-    _reber_start_node_idx = 0
-    _reber_end_node_idx = 7
-    _reber_letters = "BEPSTVX"
-    _reber_letter_shifted_idx = {  # shifted so that 0 will represent a padding token
-        char: idx + 1 for idx, char in enumerate(_reber_letters)
-    }
-    _reber_letters_set = set(_reber_letters)
-    # TODO: these could be built programatically. try making something in an integration test.
+def _choose_weighted(weights: np.ndarray, np_random: np.random.Generator) -> np.ndarray:
     """
-    used for performing random in-place replacements. the values represent the set of possible characters that might
-    be able to replace the key character and still leave a valid reber in place (which would violate the assumption
-    that all perturbations yield invalid reber strings). This lets us avoid replacing a character with a valid alternate
+    :param weights: (n, k) matrix of non-negative weights, each row having a positive sum
+    :return: for each row, an index in [0, k) chosen with probability proportional to its weight
     """
-    _reber_alternates = {
-        "B": set(),
-        "E": set(),
-        "P": {"T", "V"},
-        "T": {"P", "V"},
-        "S": {"X"},
-        "V": {"T", "P"},
-        "X": {"S"},
-    }
+    cumulative_weights = weights.cumsum(axis=1)
+    total_weights = cumulative_weights[:, -1]
+    assert (total_weights > 0).all(), "Every row of weights must have a positive sum"
+    draws = np_random.random(weights.shape[0]) * total_weights
+    # a draw can round up to the total weight, which would pick the index past the last one, so clamp it to the last
+    # index with a positive weight (rather than to k - 1, whose weight may be 0, e.g. an unused edge slot)
+    last_positive_idxes = weights.shape[1] - 1 - (weights[:, ::-1] > 0).argmax(axis=1)
+    return np.minimum(
+        (draws[:, None] >= cumulative_weights).sum(axis=1), last_positive_idxes
+    )
+
+
+class EncodingError(AssertionError):
     """
-    maps each char to a set of chars that could possibly *follow* that char in a reber string.
-    Used for making invalid additions.
+    Raised by `ReberGenerator.encode_many` when some strings can't be encoded. Lists every offending row rather than
+    just the first one.
+    """
+
+    def __init__(
+        self,
+        unrecognized_letter_row_idxes: np.ndarray,
+        too_long_row_idxes: np.ndarray,
+        max_length: int,
+    ):
+        self.unrecognized_letter_row_idxes = unrecognized_letter_row_idxes
+        self.too_long_row_idxes = too_long_row_idxes
+        messages = []
+        if unrecognized_letter_row_idxes.size:
+            messages.append(
+                f"{unrecognized_letter_row_idxes.size} strings have chars outside of the alphabet, e.g. rows "
+                f"{unrecognized_letter_row_idxes[:10].tolist()}"
+            )
+        if too_long_row_idxes.size:
+            messages.append(
+                f"{too_long_row_idxes.size} strings are longer than {max_length}, e.g. rows "
+                f"{too_long_row_idxes[:10].tolist()}"
+            )
+        super().__init__("; ".join(messages))
+
+
+class GenerationStats:
     """
-    _reber_next_chars = {
-        "": {"B"},  # represents the letter "before" the first B
-        "B": {"T", "P"},
-        "E": {"T", "P"},
-        "P": {"E", "S", "T", "V", "X"},
-        "S": {"E", "X", "S"},
-        "T": {"E", "S", "X", "T", "V"},
-        "V": {"P", "E"},
-        "X": {"T", "V", "X", "S"},
-    }
-
-    def __init__(self, max_length: int, num_perturbations: int = 2):
+    Where a `ReberGenerator` spent its time and what it did, collected once `ReberGenerator.enable_stats` is called
+    """
+
+    def __init__(self):
+        self.num_make_data_calls = 0
+        # seconds spent generating rows of each datatype (refill rows included), summed over worker processes
+        self.datatype_to_seconds = {datatype: 0.0 for datatype in ReberDataType}
+        # rows of each datatype that make_data was asked for
+        self.datatype_to_num_rows = {datatype: 0 for datatype in ReberDataType}
+        # rows generated on top of those, to take the place of rejected rows. Every row generated is either returned
+        # or rejected, so sum(datatype_to_num_rows) + num_refill_rows - num_rejected_rows rows are returned.
+        self.num_refill_rows = 0
+        # rows that were generated but thrown away, e.g. duplicates when deduplicating
+        self.num_rejected_rows = 0
+        self.num_replacements = 0
+        self.num_insertions = 0
+        self.num_symmetry_flips = 0
+        self.encode_seconds = 0.0
+        self.frame_seconds = 0.0
+
+    def add_rows(self, datatype: ReberDataType, num_rows: int, seconds: float) -> None:
+        self.datatype_to_num_rows[datatype] += int(num_rows)
+        self.datatype_to_seconds[datatype] += seconds
+
+    def merge(self, other: "GenerationStats") -> None:
+        """
+        Adds the counts and seconds of other, e.g. the stats of one shard generated in a worker process, to these
+        """
+        for datatype in ReberDataType:
+            self.add_rows(
+                datatype,
+                other.datatype_to_num_rows[datatype],
+                other.datatype_to_seconds[datatype],
+            )
+        for name in [
+            "num_make_data_calls",
+            "num_refill_rows",
+            "num_rejected_rows",
+            "num_replacements",
+            "num_insertions",
+            "num_symmetry_flips",
+            "encode_seconds",
+            "frame_seconds",
+        ]:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self) -> dict:
+        """
+        :return: the stats as a JSON serializable dict
+        """
+        stats = dict(vars(self))
+        for name in ["datatype_to_seconds", "datatype_to_num_rows"]:
+            stats[name] = {
+                datatype.value: value for datatype, value in stats[name].items()
+            }
+        return stats
+
+
+class ReberGenerator:
+    def __init__(
+        self,
+        max_length: int,
+        num_perturbations: int = 2,
+        length_distribution: Optional[Dict[int, float]] = None,
+        seed: Union[None, int, np.random.SeedSequence] = None,
+        grammar: Optional[Grammar] = None,
+    ):
         """
         :param max_length: the maximum length of any string, valid reber or otherwise, generated by `self.make_data`.
             Even if no string generated reaches max_length, all rows of X will be padded to reach max_length.
         :param num_perturbations: the number of perturbations made by `self.make_perturbed_embedded_reber_string`
+        :param length_distribution: optional map of {length: weight} that valid embedded reber strings (and the
+            strings derived from them) are sampled from, e.g. `{length: 1 for length in range(9, max_length + 1)}`
+            for uniformly distributed lengths. Defaults to the lengths that a random walk through the grammar
+            produces, given that it must stop within max_length.
+        :param seed: seeds all of the randomness of this generator (which never touches the global `random` and
+            `np.random` state). Two generators built with the same arguments and seed generate the same data.
+        :param grammar: the grammar that valid strings are sampled from and recognized with. Defaults to the
+            embedded reber grammar. The SYMMETRY_DISTURBED datatype flips the T/P symmetry of the embedded reber
+            grammar, so it can only be made for grammars whose strings all have at least 3 letters, and a "T" or a
+            "P" as their second and second to last letters. The PERTURBED datatype
+            needs some letter that can be replaced, or inserted, in a way that guarantees an invalid string.
         """
         self.max_length = max_length
         self.num_perturbations = num_perturbations
+        self.seed = seed
+        self._init_kwargs = dict(
+            max_length=max_length,
+            num_perturbations=num_perturbations,
+            length_distribution=length_distribution,
+            grammar=grammar,
+        )
+        self.grammar = grammar or Grammar.from_spec(EMBEDDED_REBER_GRAMMAR_SPEC)
+        self._reber_letters = self.grammar.alphabet
+        self._reber_letter_shifted_idx = self.grammar.letter_to_int
+        self._reber_letters_set = set(self._reber_letters)
+        """
+        used for performing random in-place replacements. the values represent the set of possible characters that
+        might be able to replace the key character and still leave a valid reber in place (which would violate the
+        assumption that all perturbations yield invalid reber strings). This lets us avoid replacing a character with
+        a valid alternate
+        """
+        self._reber_alternates = self.grammar.alternates
+        """
+        maps each char to a set of chars that could possibly *follow* that char in a reber string ("" represents the
+        letter "before" the first one). Used for making invalid additions.
+        """
+        self._reber_next_chars = self.grammar.next_chars
+        # the letters that the string perturbation fns choose from, as lists in the order of the alphabet: choosing
+        # from a set would depend on its iteration order, which changes with PYTHONHASHSEED, and so would the data
+        self._replacement_letters = {
+            letter: [
+                other_letter
+                for other_letter in self._reber_letters
+                if other_letter not in alternates and other_letter != letter
+            ]
+            for letter, alternates in self._reber_alternates.items()
+        }
+        self._insertion_letters = {
+            letter: [
+                other_letter
+                for other_letter in self._reber_letters
+                if other_letter not in next_chars
+            ]
+            for letter, next_chars in self._reber_next_chars.items()
+        }
+        self._seed_sequence = (
+            seed
+            if isinstance(seed, np.random.SeedSequence)
+            else np.random.SeedSequence(seed)
+        )
+        np_seed_sequence, python_seed_sequence = self._seed_sequence.spawn(2)
+        self._np_random = np.random.default_rng(np_seed_sequence)
+        self._random = random.Random(
+            int.from_bytes(python_seed_sequence.generate_state(4).tobytes(), "little")
+        )
         self._datatype_to_make_str_fn = {
             ReberDataType.VALID: self.make_valid_embedded_reber_string,
             ReberDataType.PERTURBED: self.make_perturbed_embedded_reber_string,
@@ -146,59 +389,193 @@ class ReberGenerator:
             ReberDataType.RANDOM: self.make_random,
         }
         assert set(self._datatype_to_make_str_fn) == set(e for e in ReberDataType)
-        self._reber_graph: Dict[int, List[Edge]] = {
-            0: [Edge(to=1, get_str_list=lambda: ["B"])],
-            1: [
-                Edge(to=2, get_str_list=lambda: ["T"]),
-                Edge(to=6, get_str_list=lambda: ["P"]),
-            ],
-            2: [
-                Edge(to=2, get_str_list=lambda: ["S"]),
-                Edge(to=3, get_str_list=lambda: ["X"]),
-            ],
-            3: [
-                Edge(to=4, get_str_list=lambda: ["S"]),
-                Edge(to=6, get_str_list=lambda: ["X"]),
-            ],
-            4: [Edge(to=7, get_str_list=lambda: ["E"])],
-            5: [
-                Edge(to=3, get_str_list=lambda: ["P"]),
-                Edge(to=4, get_str_list=lambda: ["V"]),
-            ],
-            6: [
-                Edge(to=6, get_str_list=lambda: ["T"]),
-                Edge(to=5, get_str_list=lambda: ["V"]),
-            ],
-        }
-        self._embedded_reber_graph: Dict[int, List[Edge]] = {
-            0: [Edge(to=1, get_str_list=lambda: ["B"])],
-            1: [
-                Edge(to=2, get_str_list=lambda: ["T"]),
-                Edge(to=6, get_str_list=lambda: ["P"]),
-            ],
-            2: [Edge(to=3, get_str_list=self._make_reber_list)],
-            3: [Edge(to=4, get_str_list=lambda: ["T"])],
-            4: [Edge(to=7, get_str_list=lambda: ["E"])],
-            5: [Edge(to=4, get_str_list=lambda: ["P"])],
-            6: [Edge(to=5, get_str_list=self._make_reber_list)],
+        self._finish_probabilities = self.grammar.finish_probabilities(max_length)
+        walk_length_probabilities = self._finish_probabilities[self.grammar.start_state]
+        # the fraction of random walks through the embedded grammar that are longer than max_length, i.e. the
+        # fraction of walks that would have been thrown away had we sampled by rejection
+        self.avoided_rejection_rate = 1 - walk_length_probabilities.sum()
+        self._length_probabilities = self._make_length_probabilities(
+            walk_length_probabilities, length_distribution
+        )
+        self._walk_steps = self._make_walk_steps()
+        # maps each byte to the encoded letter it represents, or to _UNRECOGNIZED_BYTE
+        self._byte_to_encoded_letter = np.full(
+            256, self._UNRECOGNIZED_BYTE, dtype=np.uint8
+        )
+        self._encoded_letter_to_byte = np.zeros(
+            len(self._reber_letters) + 1, dtype=np.uint8
+        )
+        for letter, encoded_letter in self._reber_letter_shifted_idx.items():
+            self._byte_to_encoded_letter[ord(letter)] = encoded_letter
+            self._encoded_letter_to_byte[encoded_letter] = ord(letter)
+        self._length_cum_probabilities = self._length_probabilities.cumsum().tolist()
+        # [i, j] says whether encoded letter j may replace (or be inserted after) encoded letter i and guarantee
+        # an invalid string, see `_reber_alternates` and `_reber_next_chars`
+        self._replacement_masks = self._make_letter_masks(
+            {
+                letter: alternates | {letter}
+                for letter, alternates in self._reber_alternates.items()
+            }
+        )
+        self._insertion_masks = self._make_letter_masks(self._reber_next_chars)
+        # the encoded letters that some letter may replace, and the encoded letters (or the padding value, for the
+        # start of the string) that some letter may be inserted after. Every other edit would leave some string valid,
+        # so it is never made.
+        self._is_replaceable = self._replacement_masks.any(axis=1)
+        self._is_insertable_after = self._insertion_masks.any(axis=1)
+        self._can_perturb = bool(
+            self._is_replaceable.any() or self._is_insertable_after.any()
+        )
+        self._can_symmetry_disturb = self._has_symmetry()
+        self.recognizer = self.grammar.recognizer
+        self._string_index = None
+        self.stats: Optional[GenerationStats] = None
+        self._log_stats = False
+        self._datatype_to_fill_rows_fn = {
+            ReberDataType.VALID: self._fill_valid_rows,
+            ReberDataType.PERTURBED: self._fill_perturbed_rows,
+            ReberDataType.SYMMETRY_DISTURBED: self._fill_symmetry_disturbed_rows,
+            ReberDataType.RANDOM: self._fill_random_rows,
         }
+        assert set(self._datatype_to_fill_rows_fn) == set(e for e in ReberDataType)
+
+    def _make_length_probabilities(
+        self,
+        walk_length_probabilities: np.ndarray,
+        length_distribution: Optional[Dict[int, float]],
+    ) -> np.ndarray:
+        """
+        :return: a vector whose ith entry is the probability of sampling a valid embedded reber string of length i
+        """
+        if length_distribution is None:
+            length_weights = walk_length_probabilities
+        else:
+            length_weights = np.zeros(self.max_length + 1)
+            for length, weight in length_distribution.items():
+                if not 0 <= length <= self.max_length:
+                    raise ValueError(
+                        f"Length {length} is outside of [0, {self.max_length}]"
+                    )
+                if weight < 0:
+                    raise ArithmeticError("A negative weight doesn't make sense")
+                length_weights[length] = weight
+            impossible_lengths = np.flatnonzero(
+                (length_weights > 0) & (walk_length_probabilities == 0)
+            )
+            if impossible_lengths.size:
+                raise ValueError(
+                    f"No valid embedded reber string has length {impossible_lengths.tolist()}"
+                )
+        total_weight = length_weights.sum()
+        # if no string fits into max_length we only complain once someone actually asks for one
+        return length_weights / total_weight if total_weight else length_weights
+
+    def _has_symmetry(self) -> bool:
+        """
+        :return: whether every string of the grammar, like those of the embedded reber grammar, has at least 3 letters
+            and a "T" or a "P" as its second and second to last letters, so that flipping them makes sense
+        """
+        if not {"T", "P"} <= self._reber_letters_set:
+            return False
+        recognizer = self.grammar.recognizer
+        is_flippable = np.zeros(recognizer.num_symbols, dtype=bool)
+        is_flippable[[self._reber_letter_shifted_idx[letter] for letter in "TP"]] = True
+        letters = np.arange(1, recognizer.num_symbols)
 
-    def _make_reber_list(self) -> List[str]:
-        return self._make_reber_str_list(is_embedded=False)
+        def live_steps(state: int) -> Iterator[Tuple[int, int]]:
+            for letter in letters:
+                next_state = recognizer.transitions[state, letter]
+                if recognizer.is_live[next_state]:
+                    yield letter, next_state
+
+        # the states after 0, 1 and 2 letters may not accept, and the second letter must be flippable
+        if recognizer.accepting[recognizer.start_state]:
+            return False
+        for _, first_state in live_steps(recognizer.start_state):
+            if recognizer.accepting[first_state]:
+                return False
+            for letter, second_state in live_steps(first_state):
+                if not is_flippable[letter] or recognizer.accepting[second_state]:
+                    return False
+        # every letter that one more letter can complete a string after must be flippable
+        can_finish_in_one_letter = recognizer.accepting[
+            recognizer.transitions[:, letters]
+        ].any(axis=1)
+        seen_states = {recognizer.start_state}
+        states_to_visit = [recognizer.start_state]
+        while states_to_visit:
+            state = states_to_visit.pop()
+            for letter, next_state in live_steps(state):
+                if can_finish_in_one_letter[next_state] and not is_flippable[letter]:
+                    return False
+                if next_state not in seen_states:
+                    seen_states.add(next_state)
+                    states_to_visit.append(next_state)
+        return True
+
+    def _make_walk_steps(
+        self,
+    ) -> List[List[Tuple[List[str], List[int], Optional[List[float]]]]]:
+        """
+        Plain python copies of the tables that `_make_embedded_reber_list_of_correct_length` walks, so that sampling
+        one string at a time has neither numpy's per call overhead nor any weights to compute
+        :return: [num_letters_left][state] -> the letters and next states of the edges from state that can still
+            finish in num_letters_left more letters, and their cumulative weights, or None when there is only one
+        """
+        grammar = self.grammar
+        walk_steps = []
+        for num_letters_left in range(self.max_length):
+            state_to_step = []
+            for state in range(grammar.num_states):
+                letters = []
+                next_states = []
+                weights = []
+                for k in range(grammar.out_degree[state]):
+                    next_state = int(grammar.next_state[state, k])
+                    weight = float(
+                        grammar.probability[state, k]
+                        * self._finish_probabilities[next_state, num_letters_left]
+                    )
+                    if weight > 0:
+                        letters.append(
+                            self._reber_letters[grammar.emission[state, k] - 1]
+                        )
+                        next_states.append(next_state)
+                        weights.append(weight)
+                cum_weights = (
+                    list(itertools.accumulate(weights)) if len(weights) > 1 else None
+                )
+                state_to_step.append((letters, next_states, cum_weights))
+            walk_steps.append(state_to_step)
+        return walk_steps
+
+    def _replaceable_idxes(self, str_list: List[str]) -> List[int]:
+        return [
+            idx
+            for idx, letter in enumerate(str_list)
+            if self._replacement_letters[letter]
+        ]
+
+    def _insertion_idxes(self, str_list: List[str]) -> List[int]:
+        # the empty string is the char before str_list[0]
+        return [
+            idx
+            for idx, letter_before in enumerate([""] + str_list)
+            if self._insertion_letters[letter_before]
+        ]
 
     def _randomly_inplace_edit_str_list(self, str_list: List[str]) -> List[str]:
         new_str_list = str_list[:]
-        random_index = random.randrange(0, len(new_str_list))
+        # only replace a letter that some other letter can replace and yield invalid reber
+        replaceable_idxes = self._replaceable_idxes(new_str_list)
+        random_index = replaceable_idxes[self._random.randrange(len(replaceable_idxes))]
         curr_letter = new_str_list[random_index]
         # only replace with a letter that will yield invalid reber
-        possible_replacement_letters = list(
-            self._reber_letters_set
-            - self._reber_alternates[curr_letter]
-            - {curr_letter}
-        )
-        replacement_letter = random.choice(possible_replacement_letters)
+        replacement_letter = self._random.choice(self._replacement_letters[curr_letter])
 
         new_str_list[random_index] = replacement_letter
+        if self.stats is not None:
+            self.stats.num_replacements += 1
         return new_str_list
 
     def _add_random_char_to_str_list(self, str_list: List[str]) -> List[str]:
@@ -207,51 +584,74 @@ class ReberGenerator:
         I added this because I once tried adding a single P at the end of a string (making it invalid) but the model
         I had trained predicted it was valid with 0.98 confidence.
         """
-        addition_idx = random.randrange(len(str_list) + 1)
+        insertion_idxes = self._insertion_idxes(str_list)
+        addition_idx = insertion_idxes[self._random.randrange(len(insertion_idxes))]
         # the empty string is the char before str_list[0]
         letter_before_addition_idx = (
             str_list[addition_idx - 1] if addition_idx > 0 else ""
         )
         # only add letter that will yield invalid reber
-        possible_letters_to_add = list(
-            self._reber_letters_set - self._reber_next_chars[letter_before_addition_idx]
+        letter_to_add = self._random.choice(
+            self._insertion_letters[letter_before_addition_idx]
         )
-        letter_to_add = random.choice(possible_letters_to_add)
 
         new_list = str_list[:]
         new_list.insert(addition_idx, letter_to_add)
+        if self.stats is not None:
+            self.stats.num_insertions += 1
         return new_list
 
-    def _perturb_str_list(self, str_list: List[str]) -> None:
+    def _perturb_str_list(self, str_list: List[str]) -> bool:
+        """
+        :return: whether all `self.num_perturbations` edits could be made. Some strings of some grammars have no letter
+            that can be replaced, and no room or place to insert one, so that no edit guarantees an invalid string.
+        """
         # TODO: is it better to return new list or mutate old list? Faster? Easier to read?
         for _ in range(self.num_perturbations):
-            possible_perturb_fns: List[Callable] = [
-                self._randomly_inplace_edit_str_list
-            ]
-            if len(str_list) < self.max_length:
+            possible_perturb_fns: List[Callable] = []
+            if any(self._replacement_letters[letter] for letter in str_list):
+                possible_perturb_fns.append(self._randomly_inplace_edit_str_list)
+            if len(str_list) < self.max_length and any(
+                self._insertion_letters[letter] for letter in [""] + str_list
+            ):
                 possible_perturb_fns.append(self._add_random_char_to_str_list)
-            perturb_fn = random.choice(possible_perturb_fns)
+            if not possible_perturb_fns:
+                return False
+            perturb_fn = self._random.choice(possible_perturb_fns)
             str_list[:] = perturb_fn(str_list)
+        return True
 
-    def _make_reber_str_list(self, is_embedded) -> List[str]:
+    def _make_embedded_reber_list_of_correct_length(self) -> List[str]:
         """
-        :return list of chars that represent a reber string or an embedded reber string
+        Single string version of `_fill_valid_rows`
         """
-        graph = self._embedded_reber_graph if is_embedded else self._reber_graph
-        curr_node_idx = self._reber_start_node_idx
+        if not self._length_probabilities.any():
+            raise ValueError(
+                f"No valid embedded reber string is at most {self.max_length} chars long"
+            )
+        (length,) = self._random.choices(
+            range(self.max_length + 1), cum_weights=self._length_cum_probabilities
+        )
+        curr_state = self.grammar.start_state
         str_list = []
-        while curr_node_idx != self._reber_end_node_idx:
-            edge = random.choice(graph[curr_node_idx])
-            str_list.extend(edge.get_str_list())
-            curr_node_idx = edge.to
+        for num_letters_left in range(length - 1, -1, -1):
+            letters, next_states, cum_weights = self._walk_steps[num_letters_left][
+                curr_state
+            ]
+            edge_idx = (
+                0
+                if cum_weights is None
+                else bisect.bisect(
+                    cum_weights,
+                    self._random.random() * cum_weights[-1],
+                    0,
+                    len(cum_weights) - 1,
+                )
+            )
+            str_list.append(letters[edge_idx])
+            curr_state = next_states[edge_idx]
         return str_list
 
-    def _make_embedded_reber_list_of_correct_length(self) -> List[str]:
-        while True:
-            str_list = self._make_reber_str_list(is_embedded=True)
-            if len(str_list) <= self.max_length:
-                return str_list
-
     def make_valid_embedded_reber_string(self) -> str:
         return "".join(self._make_embedded_reber_list_of_correct_length())
 
@@ -260,20 +660,26 @@ class ReberGenerator:
         Creates a string, guaranteed not to match the reber grammar (i.e. to be invalid),
         that is `self.num_perturbations` edits different from a valid reber string
         """
-        str_list = self._make_embedded_reber_list_of_correct_length()
-        self._perturb_str_list(str_list)
-        return "".join(str_list)
+        self._check_can_make(ReberDataType.PERTURBED)
+        for _ in range(self._max_perturb_attempts):
+            str_list = self._make_embedded_reber_list_of_correct_length()
+            if self._perturb_str_list(str_list):
+                return "".join(str_list)
+            if self.stats is not None:
+                self.stats.num_refill_rows += 1
+                self.stats.num_rejected_rows += 1
+        raise ValueError(self._perturb_attempts_failed_message())
 
     def make_random(self) -> str:
         """
         :return: a string whose characters are randomly sampled from the reber alphabet
         """
         min_embedded_reber_length = 8  # if you look at the grammar you see this is true
-        num_chars = random.randrange(
+        num_chars = self._random.randrange(
             start=min_embedded_reber_length, stop=self.max_length
         )
         return "".join(
-            random.choice(list(self._reber_letters_set)) for _ in range(num_chars)
+            self._random.choice(self._reber_letters) for _ in range(num_chars)
         )
 
     def make_symmetry_disturbed_reber_string(self) -> str:
@@ -282,43 +688,888 @@ class ReberGenerator:
         :return: an invalid reber string, created by taking a valid reber string and changing only the second
             or second to last character
         """
+        self._check_can_make(ReberDataType.SYMMETRY_DISTURBED)
         str_list = self._make_embedded_reber_list_of_correct_length()
-        index_to_change = 1 if random.random() < 0.5 else -2
+        index_to_change = 1 if self._random.random() < 0.5 else -2
         str_list[index_to_change] = "P" if str_list[index_to_change] == "T" else "T"
+        if self.stats is not None:
+            self.stats.num_symmetry_flips += 1
         return "".join(str_list)
 
+    # the number of times in a row that perturbing newly generated valid strings may fail before giving up
+    _max_perturb_attempts = 20
+
+    def _perturb_attempts_failed_message(self) -> str:
+        return (
+            f"Failed to make {self.num_perturbations} edits that guarantee an invalid string to any of "
+            f"{self._max_perturb_attempts} batches of valid strings of at most {self.max_length} chars in a row"
+        )
+
+    def _check_can_make(self, datatype: ReberDataType) -> None:
+        """
+        :raises ValueError: if no rows of datatype can be made with `self.grammar`
+        """
+        if datatype == ReberDataType.PERTURBED and not self._can_perturb:
+            raise ValueError(
+                "No letter of the grammar can be replaced or inserted in a way that guarantees an invalid string, "
+                "so it can't make perturbed rows"
+            )
+        if (
+            datatype == ReberDataType.SYMMETRY_DISTURBED
+            and not self._can_symmetry_disturb
+        ):
+            raise ValueError(
+                "symmetry_disturbed rows flip the T/P symmetry of the embedded reber grammar, but some strings of "
+                "the grammar are shorter than 3 letters, or don't have a T or a P as their second and second to last "
+                "letters; pass symmetry_disturbed=0"
+            )
+
+    def _check_datatypes(
+        self, datatype_to_percentage: ReberDatatypeToPercentage
+    ) -> None:
+        """
+        Checks, before generating anything, that every datatype asked for can be made with `self.grammar`
+        """
+        for datatype in ReberDataType:
+            if datatype_to_percentage.get(datatype):
+                self._check_can_make(datatype)
+
     def _create_rows_of_datatype(
         self, num_rows: int, datatype: ReberDataType
     ) -> List[List[int]]:
         make_str: Callable = self._datatype_to_make_str_fn[datatype]
-        return [
-            self.encode_as_padded_ints(string=make_str(), safe=False)
-            for _ in range(num_rows)
+        if self.stats is None:
+            return [
+                self.encode_as_padded_ints(string=make_str(), safe=False)
+                for _ in range(num_rows)
+            ]
+        # the same, but timing the encoding apart from the generating
+        strings = [make_str() for _ in range(num_rows)]
+        start = time.perf_counter()
+        rows = [
+            self.encode_as_padded_ints(string=string, safe=False) for string in strings
         ]
+        self.stats.encode_seconds += time.perf_counter() - start
+        return rows
+
+    # ------------------------- vectorized engine
+    # rows are filled in chunks so that the temporary arrays used while walking stay small, whatever m_total is
+    # make_data splits each datatype into shards of rows that are each generated with their own seed, so that the
+    # output only depends on the seed and not on how the shards are distributed among processes
+    _shard_num_rows = 2**16
+    _fill_chunk_num_rows = 2**14
+
+    # Each `_fill_*_rows` fn overwrites every row of `out`, a (num_rows, self.max_length) int array, with encoded and
+    # padded strings of one datatype. Strings follow the same distribution as the corresponding `make_*` fn. If
+    # `origins` (ORIGIN_DTYPE records of unedited rows, one per row of `out`) isn't None, the edits made to each row
+    # are recorded in it.
+
+    def _fill_valid_rows(
+        self, out: np.ndarray, origins: Optional[np.ndarray] = None
+    ) -> None:
+        """
+        Rather than walking the grammar and throwing away walks that are too long, first pick each row's length and
+        then only ever take edges from which the end of the grammar can be reached in exactly the remaining number
+        of letters. Edges are picked with probability proportional to (probability of taking the edge) *
+        (probability of finishing in the remaining letters from where it leads), so within a length, strings are as
+        likely as they are for the plain random walk.
+        """
+        if not self._length_probabilities.any():
+            raise ValueError(
+                f"No valid embedded reber string is at most {self.max_length} chars long"
+            )
+        grammar = self.grammar
+        num_rows = out.shape[0]
+        out[:] = PADDING_VALUE
+        if not num_rows:
+            return
+        lengths = self._np_random.choice(
+            self.max_length + 1, size=num_rows, p=self._length_probabilities
+        )
+        row_idxes = np.arange(num_rows)
+        states = np.full(num_rows, grammar.start_state)
+        for col in range(lengths.max()):
+            is_walking = lengths > col
+            walking_rows = row_idxes[is_walking]
+            walking_states = states[is_walking]
+            num_letters_left = lengths[is_walking] - col - 1
+            edge_weights = (
+                grammar.probability[walking_states]
+                * self._finish_probabilities[
+                    grammar.next_state[walking_states], num_letters_left[:, None]
+                ]
+            )
+            edge_idxes = _choose_weighted(edge_weights, self._np_random)
+            out[walking_rows, col] = grammar.emission[walking_states, edge_idxes]
+            states[walking_rows] = grammar.next_state[walking_states, edge_idxes]
+
+    def _fill_perturbed_rows(
+        self, out: np.ndarray, origins: Optional[np.ndarray] = None
+    ) -> None:
+        self._check_can_make(ReberDataType.PERTURBED)
+        self._fill_valid_rows(out)
+        # the rows that couldn't be perturbed are made again from new valid rows
+        unfinished_row_idxes = np.flatnonzero(~self.perturb_rows(out, origins))
+        num_fruitless_batches = 0
+        while unfinished_row_idxes.size:
+            batch = np.empty((unfinished_row_idxes.size, out.shape[1]), dtype=out.dtype)
+            batch_origins = None
+            if origins is not None:
+                batch_origins = make_origins(batch.shape[0])
+                batch_origins["datatype"] = origins["datatype"][unfinished_row_idxes]
+            self._fill_valid_rows(batch)
+            is_perturbed = self.perturb_rows(batch, batch_origins)
+            out[unfinished_row_idxes[is_perturbed]] = batch[is_perturbed]
+            if origins is not None:
+                origins[unfinished_row_idxes[is_perturbed]] = batch_origins[
+                    is_perturbed
+                ]
+            if self.stats is not None:
+                self.stats.num_refill_rows += batch.shape[0]
+                self.stats.num_rejected_rows += batch.shape[0]
+            unfinished_row_idxes = unfinished_row_idxes[~is_perturbed]
+            num_fruitless_batches = (
+                0 if is_perturbed.any() else num_fruitless_batches + 1
+            )
+            if num_fruitless_batches == self._max_perturb_attempts:
+                raise ValueError(self._perturb_attempts_failed_message())
+
+    def _fill_symmetry_disturbed_rows(
+        self, out: np.ndarray, origins: Optional[np.ndarray] = None
+    ) -> None:
+        self._fill_valid_rows(out)
+        self.symmetry_disturb_rows(out, origins)
+
+    def _fill_random_rows(
+        self, out: np.ndarray, origins: Optional[np.ndarray] = None
+    ) -> None:
+        min_embedded_reber_length = 8
+        num_rows = out.shape[0]
+        lengths = self._np_random.integers(
+            min_embedded_reber_length, self.max_length, size=num_rows
+        )
+        out[:] = self._np_random.integers(
+            1, len(self._reber_letters) + 1, size=out.shape
+        )
+        out[np.arange(self.max_length) >= lengths[:, None]] = PADDING_VALUE
+
+    # ------------------------- vectorized perturbations
+    # batch versions of the string perturbation fns above. They edit blocks of encoded and padded rows in place.
+
+    def _make_letter_masks(self, letter_to_letters: Dict[str, set]) -> np.ndarray:
+        """
+        :param letter_to_letters: maps a letter, or "" for the padding value, to a set of letters
+        :return: an (num_symbols, num_symbols) boolean matrix whose [i, j] entry says whether encoded letter j is
+            *not* in the set of encoded letter i. The padding value never is.
+        """
+        num_symbols = len(self._reber_letters) + 1
+        masks = np.zeros((num_symbols, num_symbols), dtype=bool)
+        for letter, letters in letter_to_letters.items():
+            idx = self._reber_letter_shifted_idx.get(letter, PADDING_VALUE)
+            for other_letter in self._reber_letters_set - letters:
+                masks[idx, self._reber_letter_shifted_idx[other_letter]] = True
+        return masks
+
+    def _replace_random_letters(self, X: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """
+        Batch version of `_randomly_inplace_edit_str_list`: replaces one random replaceable letter of each row of X.
+        Every row must have one.
+        :return: the column replaced in each row
+        """
+        row_idxes = np.arange(X.shape[0])
+        cols = _choose_weighted(
+            self._is_replaceable[X] & (np.arange(X.shape[1]) < lengths[:, None]),
+            self._np_random,
+        )
+        curr_letters = X[row_idxes, cols]
+        X[row_idxes, cols] = _choose_weighted(
+            self._replacement_masks[curr_letters], self._np_random
+        )
+        return cols
+
+    def _insert_random_letters(self, X: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """
+        Batch version of `_add_random_char_to_str_list`: inserts one random letter into each row of X, shifting the
+        rest of the row (and so its padding) one column to the right. Every row must be shorter than its width, and
+        have some letter, or the start, that a letter may be inserted after.
+        :return: the column inserted into in each row
+        """
+        num_rows, width = X.shape
+        row_idxes = np.arange(num_rows)
+        # the letter before each column that could be inserted into: the padding value, i.e. the letter "before" the
+        # first letter, when inserting at the start
+        letters_before_cols = np.concatenate(
+            [np.full((num_rows, 1), PADDING_VALUE, dtype=X.dtype), X], axis=1
+        )
+        cols = _choose_weighted(
+            self._is_insertable_after[letters_before_cols]
+            & (np.arange(width + 1) <= lengths[:, None]),
+            self._np_random,
+        )
+        letters_before = letters_before_cols[row_idxes, cols]
+        letters_to_add = _choose_weighted(
+            self._insertion_masks[letters_before], self._np_random
+        )
+        col_idxes = np.arange(width)
+        source_cols = col_idxes - (col_idxes > cols[:, None])
+        X[:] = np.take_along_axis(X, source_cols, axis=1)
+        X[row_idxes, cols] = letters_to_add
+        return cols
+
+    @staticmethod
+    def _record_edits(
+        origins: np.ndarray, is_edited: np.ndarray, cols: np.ndarray, kind: EditKind
+    ) -> None:
+        """
+        :param cols: the column edited in each row where is_edited. An insertion shifts the columns of earlier edits
+            to its right, but those are never the leftmost edit after it anyway.
+        """
+        edited_origins = origins[is_edited]
+        edited_origins["edit_kinds"] |= np.uint8(kind)
+        first_edit_cols = edited_origins["first_edit_col"]
+        edited_origins["first_edit_col"] = np.where(
+            first_edit_cols < 0, cols, np.minimum(first_edit_cols, cols)
+        )
+        origins[is_edited] = edited_origins
+
+    def perturb_rows(
+        self, X: np.ndarray, origins: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Batch version of `_perturb_str_list`: makes `self.num_perturbations` edits to every row of X in place, each
+        edit either replacing a letter or, if the row is shorter than X is wide, inserting one (with equal odds).
+        Edits are only made where they guarantee an invalid string, so a row with no replaceable letter and no room
+        or place to insert one can't be edited any further.
+        :param X: (N, L) matrix of encoded and padded valid embedded reber strings
+        :param origins: optionally, ORIGIN_DTYPE records of the rows of X to record the edits in
+        :return: a boolean vector that is True for every row that got all of its edits. The other rows are left with
+            only some of them.
+        """
+        is_perturbed = np.ones(X.shape[0], dtype=bool)
+        for _ in range(self.num_perturbations):
+            lengths = (X != PADDING_VALUE).sum(axis=1)
+            can_replace = self._is_replaceable[X].any(axis=1)
+            can_insert = (lengths < X.shape[1]) & (
+                self._is_insertable_after[PADDING_VALUE]
+                | (self._is_insertable_after[X] & (X != PADDING_VALUE)).any(axis=1)
+            )
+            is_perturbed &= can_replace | can_insert
+            inserting = (
+                is_perturbed
+                & can_insert
+                & (~can_replace | (self._np_random.random(X.shape[0]) < 0.5))
+            )
+            replacing = is_perturbed & ~inserting
+            if self.stats is not None:
+                self.stats.num_insertions += int(np.count_nonzero(inserting))
+                self.stats.num_replacements += int(np.count_nonzero(replacing))
+            for is_edited, edit_rows, kind in [
+                (replacing, self._replace_random_letters, EditKind.REPLACEMENT),
+                (inserting, self._insert_random_letters, EditKind.INSERTION),
+            ]:
+                if is_edited.any():
+                    edited_X = X[is_edited]
+                    cols = edit_rows(edited_X, lengths[is_edited])
+                    X[is_edited] = edited_X
+                    if origins is not None:
+                        self._record_edits(origins, is_edited, cols, kind)
+        return is_perturbed
+
+    def symmetry_disturb_rows(
+        self, X: np.ndarray, origins: Optional[np.ndarray] = None
+    ) -> None:
+        """
+        Batch version of `make_symmetry_disturbed_reber_string`: flips either the second or the second to last letter
+        of every row of X between "T" and "P", in place
+        :param X: (N, L) matrix of encoded and padded valid embedded reber strings
+        :param origins: optionally, ORIGIN_DTYPE records of the rows of X to record the flips in
+        """
+        self._check_can_make(ReberDataType.SYMMETRY_DISTURBED)
+        row_idxes = np.arange(X.shape[0])
+        lengths = (X != PADDING_VALUE).sum(axis=1)
+        cols_to_change = np.where(
+            self._np_random.random(X.shape[0]) < 0.5, 1, lengths - 2
+        )
+        t = self._reber_letter_shifted_idx["T"]
+        p = self._reber_letter_shifted_idx["P"]
+        X[row_idxes, cols_to_change] = np.where(X[row_idxes, cols_to_change] == t, p, t)
+        if origins is not None:
+            self._record_edits(
+                origins,
+                np.ones(X.shape[0], dtype=bool),
+                cols_to_change,
+                EditKind.SYMMETRY_FLIP,
+            )
+        if self.stats is not None:
+            self.stats.num_symmetry_flips += X.shape[0]
+
+    def _fill_rows_of_datatype(
+        self,
+        out: np.ndarray,
+        datatype: ReberDataType,
+        origins: Optional[np.ndarray] = None,
+        refill: bool = False,
+    ) -> None:
+        """
+        :param origins: optionally, ORIGIN_DTYPE records to overwrite with where each row of out came from
+        :param refill: whether the rows are generated to take the place of rejected rows, which the stats count apart
+        """
+        fill_rows: Callable = self._datatype_to_fill_rows_fn[datatype]
+        start_time = time.perf_counter() if self.stats is not None else None
+        if origins is not None:
+            origins[:] = make_origins(out.shape[0])
+            origins["datatype"] = list(ReberDataType).index(datatype)
+        for start in range(0, out.shape[0], self._fill_chunk_num_rows):
+            stop = start + self._fill_chunk_num_rows
+            fill_rows(out[start:stop], None if origins is None else origins[start:stop])
+        if self.stats is not None:
+            seconds = time.perf_counter() - start_time
+            if refill:
+                self.stats.num_refill_rows += out.shape[0]
+                self.stats.add_rows(datatype, 0, seconds)
+            else:
+                self.stats.add_rows(datatype, out.shape[0], seconds)
+
+    def _make_shards(
+        self,
+        metadata: DatatypeToRowCount,
+        dtype: np.dtype,
+        num_workers: int,
+        with_origins: bool = False,
+    ) -> Iterator[Tuple[np.ndarray, Optional[np.ndarray], Optional[GenerationStats]]]:
+        """
+        :return: the rows of each datatype in the order of `ReberDataType`, in shards of at most
+            `self._shard_num_rows` rows, each with the origins of its rows if with_origins and with the stats of
+            generating it if `self.stats` are enabled
+        """
+        shard_datatypes = []
+        shard_num_rows = []
+        for datatype in ReberDataType:
+            num_rows = metadata.get_num_rows_of(datatype)
+            for start in range(0, num_rows, self._shard_num_rows):
+                shard_datatypes.append(datatype)
+                shard_num_rows.append(min(self._shard_num_rows, num_rows - start))
+        # a new seed per call so that repeated calls don't return the same data
+        (make_data_seed_sequence,) = self._seed_sequence.spawn(1)
+        shard_args = (
+            itertools.repeat(type(self)),
+            itertools.repeat(self._init_kwargs),
+            shard_datatypes,
+            shard_num_rows,
+            itertools.repeat(dtype),
+            make_data_seed_sequence.spawn(len(shard_datatypes)),
+            itertools.repeat(with_origins),
+            itertools.repeat(self.stats is not None),
+        )
+        if num_workers == 1:
+            yield from map(_make_shard, *shard_args)
+            return
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            yield from executor.map(_make_shard, *shard_args)
+
+    def _fill_data(
+        self,
+        X: np.ndarray,
+        y: np.ndarray,
+        metadata: DatatypeToRowCount,
+        num_workers: int,
+        origins: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Fills the preallocated X and y (which may as well be memory maps), and optionally origins, like
+        `self.make_data` would
+        """
+        start = 0
+        for shard, shard_origins, shard_stats in self._make_shards(
+            metadata, X.dtype, num_workers, with_origins=origins is not None
+        ):
+            X[start : start + shard.shape[0]] = shard
+            if shard_origins is not None:
+                origins[start : start + shard.shape[0]] = shard_origins
+            start += shard.shape[0]
+            if shard_stats is not None:
+                self.stats.merge(shard_stats)
+        start = 0
+        for datatype in ReberDataType:
+            stop = start + metadata.get_num_rows_of(datatype)
+            y[start:stop] = datatype.get_class_label()
+            start = stop
+
+    def _decode_row_as_str_list(self, row: np.ndarray) -> List[str]:
+        return [self._reber_letters[idx - 1] for idx in row if idx != PADDING_VALUE]
+
+    def _make_arrays(
+        self,
+        metadata: DatatypeToRowCount,
+        num_rows: int,
+        dtype: np.dtype,
+        with_origins: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """
+        :return: X, y and, if with_origins, the origins of the rows (otherwise None), with the rows of each datatype
+            grouped together, in the order of `ReberDataType`
+        """
+        X = np.empty((num_rows, self.max_length), dtype=dtype)
+        y = np.empty(num_rows, dtype=dtype)
+        origins = make_origins(num_rows) if with_origins else None
+        start = 0
+        for datatype in ReberDataType:
+            stop = start + metadata.get_num_rows_of(datatype)
+            self._fill_rows_of_datatype(
+                X[start:stop],
+                datatype,
+                None if origins is None else origins[start:stop],
+            )
+            y[start:stop] = datatype.get_class_label()
+            start = stop
+        return X, y, origins
+
+    def iter_batches(
+        self,
+        batch_size: int,
+        num_batches: Optional[int] = None,
+        dtype: np.dtype = COMPACT_DTYPE,
+        ragged: bool = False,
+        return_origins: bool = False,
+        **kwargs: Dict[str, int],
+    ) -> Iterator[
+        Union[
+            Tuple[Union[np.ndarray, RaggedRows], np.ndarray],
+            Tuple[Union[np.ndarray, RaggedRows], np.ndarray, np.ndarray],
+        ]
+    ]:
+        """
+        Generates data batch by batch, so that only one batch is ever held in memory. Can be passed straight to
+        `keras.Model.fit` or wrapped with `tf.data.Dataset.from_generator`.
+        :param batch_size: number of rows in each batch
+        :param num_batches: number of batches to yield before stopping. Defaults to yielding batches forever.
+        :param dtype: the dtype of X and y
+        :param ragged: whether to yield each X as `RaggedRows` rather than as a padded matrix
+        :param return_origins: whether to also yield the origins of the rows, like `self.make_data`
+        :param kwargs: maps ReberDataTypes (the strings of the names of the enums) to percentages. Every batch
+            contains exactly the number of rows of each datatype that `DatatypeToRowCount` assigns to batch_size.
+        :return: an iterator of X, y (and origins), shaped like the output of `self.make_data` but as numpy arrays,
+            whose rows are shuffled within each batch
+        """
+        if batch_size < 1:
+            raise AssertionError(f"batch_size must be at least 1; was {batch_size}")
+        datatype_to_percentage = ReberDatatypeToPercentage.from_kwargs(**kwargs)
+        self._check_datatypes(datatype_to_percentage)
+        metadata = DatatypeToRowCount(batch_size, datatype_to_percentage)
+        batch_idxes = itertools.count() if num_batches is None else range(num_batches)
+        for _ in batch_idxes:
+            X, y, origins = self._make_arrays(
+                metadata, batch_size, dtype, return_origins
+            )
+            shuffled_row_idxes = self._np_random.permutation(batch_size)
+            X = X[shuffled_row_idxes]
+            batch = to_ragged(X) if ragged else X, y[shuffled_row_idxes]
+            if return_origins:
+                batch += (origins[shuffled_row_idxes],)
+            yield batch
 
     def make_data(
-        self, m_total: int, **kwargs: Dict[str, int]
-    ) -> Tuple[pd.DataFrame, pd.Series]:
+        self,
+        m_total: int,
+        vectorized: bool = True,
+        as_frame: bool = True,
+        dtype: Optional[np.dtype] = None,
+        num_workers: int = 1,
+        check_labels: Optional[str] = None,
+        deduplicate: bool = False,
+        ragged: bool = False,
+        return_origins: bool = False,
+        dataset_stats: Optional["DatasetStats"] = None,
+        **kwargs: Dict[str, int],
+    ) -> Union[
+        Tuple[pd.DataFrame, pd.Series],
+        Tuple[np.ndarray, np.ndarray],
+        Tuple[RaggedRows, np.ndarray],
+        Tuple[pd.DataFrame, pd.Series, pd.DataFrame],
+        Tuple[Union[np.ndarray, RaggedRows], np.ndarray, np.ndarray],
+    ]:
         """
         :param m_total: total number of rows to generate
+        :param vectorized: whether to walk whole blocks of strings at once with numpy (fast) rather than generating
+            them one at a time with the `make_*` fns. Both produce strings from the same distributions.
+        :param as_frame: whether to return X and y as a pandas DataFrame and Series rather than as numpy arrays
+        :param dtype: the dtype of X and y. Defaults to int64 when `as_frame`, otherwise to `COMPACT_DTYPE`.
+            With `vectorized` and numpy output, X and y are written straight into their final arrays, so peak memory
+            is m_total * (self.max_length + 1) * dtype.itemsize bytes (plus a small constant overhead for the rows
+            being generated at any one time), i.e. self.max_length + 1 bytes per row for `COMPACT_DTYPE`.
+        :param num_workers: number of processes to generate rows in (only with `vectorized`). Rows are generated in
+            shards with seeds derived from this generator's seed, so the output doesn't depend on num_workers.
+        :param check_labels: optionally run every row through `self.recognizer` and either "verify" that each
+            label matches it (raising an AssertionError otherwise) or "repair" each label to match it. RANDOM rows
+            are not guaranteed to be invalid, so they may need repairing.
+        :param deduplicate: whether to replace repeated rows with newly generated ones until every row of X is
+            distinct, see `self._deduplicate_rows`. Raises a ValueError if there aren't enough distinct strings of
+            some datatype. Only for self.max_length of at most `row_keys.max_packed_length()` (21), so that every
+            row packs into one key.
+        :param ragged: whether to return X as `RaggedRows`, i.e. without any padding, rather than as a padded matrix.
+            Only with numpy output, i.e. not `as_frame`.
+        :param return_origins: whether to also return where each row came from (only with `vectorized`): its
+            datatype, the kinds of edits made to it and the leftmost column edited, see ORIGIN_DTYPE
+        :param dataset_stats: optionally, `dataset_stats.DatasetStats` to count the returned rows in, in one pass
+            over X before it is converted to any other format
         :param kwargs: maps ReberDataTypes (the strings of the names of the enums) to percentages
         :return: X, y where X is a (m_total, self.max_length) matrix of strings encoded as lists of ints,
              each int representing the index of a character in `self._reber_letters`, padded with 0s at
              the end of each row
              y is a vector of the corresponding labels for each row in X where 1 means that the string
              matches the reber grammar
+             With return_origins, also origins: a vector of ORIGIN_DTYPE records, or a DataFrame (see
+             `origins_to_frame`) when `as_frame`
         """
         if m_total < 100:
             raise AssertionError(f"m_total must be at least 100; was only {m_total}")
-        datatype_to_percentage = ReberDatatypeToPercentage.from_kwargs(**kwargs)
-        metadata = DatatypeToRowCount(m_total, datatype_to_percentage)
-        X_raw = []
-        y_raw = []
+        if num_workers < 1:
+            raise AssertionError(f"num_workers must be at least 1; was {num_workers}")
+        if num_workers > 1 and not vectorized:
+            raise ValueError("Only vectorized generation can use multiple workers")
+        if return_origins and not vectorized:
+            raise ValueError("Only vectorized generation can return origins")
+        if ragged and as_frame:
+            raise ValueError("Ragged output can't be a DataFrame; pass as_frame=False")
+        if deduplicate and self.max_length > max_packed_length():
+            raise ValueError(
+                f"deduplicate only supports max_length up to {max_packed_length()}; max_length is {self.max_length}"
+            )
+        if check_labels not in (None, "verify", "repair"):
+            raise ValueError(
+                f'check_labels must be None, "verify" or "repair"; was {check_labels}'
+            )
+        with self._collecting_call_stats():
+            datatype_to_percentage = ReberDatatypeToPercentage.from_kwargs(**kwargs)
+            self._check_datatypes(datatype_to_percentage)
+            metadata = DatatypeToRowCount(m_total, datatype_to_percentage)
+            if dtype is None:
+                dtype = np.int64 if as_frame else COMPACT_DTYPE
+            if vectorized:
+                X = np.empty((m_total, self.max_length), dtype=dtype)
+                y = np.empty(m_total, dtype=dtype)
+                origins = make_origins(m_total) if return_origins else None
+                self._fill_data(X, y, metadata, num_workers, origins)
+            else:
+                X_raw = []
+                y_raw = []
+                for datatype in ReberDataType:
+                    num_rows = metadata.get_num_rows_of(datatype)
+                    start_time = time.perf_counter()
+                    X_raw.extend(self._create_rows_of_datatype(num_rows, datatype))
+                    y_raw.extend([datatype.get_class_label()] * num_rows)
+                    if self.stats is not None:
+                        self.stats.add_rows(
+                            datatype, num_rows, time.perf_counter() - start_time
+                        )
+                X = np.array(X_raw, dtype=dtype).reshape(m_total, self.max_length)
+                y = np.array(y_raw, dtype=dtype)
+                origins = None
+            if deduplicate:
+                self._deduplicate_rows(X, metadata, origins)
+            if check_labels is not None:
+                self._check_labels(X, y, repair=check_labels == "repair")
+            if dataset_stats is not None:
+                start = 0
+                for datatype in ReberDataType:
+                    stop = start + metadata.get_num_rows_of(datatype)
+                    dataset_stats.update(
+                        X[start:stop], y[start:stop], datatype=datatype
+                    )
+                    start = stop
+            if ragged:
+                X = to_ragged(X)
+            elif as_frame:
+                start_time = time.perf_counter()
+                X, y = pd.DataFrame(X, copy=False), pd.Series(y, copy=False)
+                if return_origins:
+                    origins = origins_to_frame(origins)
+                if self.stats is not None:
+                    self.stats.frame_seconds += time.perf_counter() - start_time
+            return (X, y, origins) if return_origins else (X, y)
+
+    def _check_labels(self, X: np.ndarray, y: np.ndarray, repair: bool) -> None:
+        recognized_y = self.recognizer.predict(X)
+        if repair:
+            y[:] = recognized_y
+            return
+        mislabelled_row_idxes = np.flatnonzero(recognized_y != y)
+        if mislabelled_row_idxes.size:
+            raise AssertionError(
+                f"{mislabelled_row_idxes.size} rows are mislabelled, "
+                f"e.g. rows {mislabelled_row_idxes[:10].tolist()}"
+            )
+
+    # ------------------------- instrumentation
+    def enable_stats(self, log_each_call: bool = False) -> GenerationStats:
+        """
+        Starts collecting `GenerationStats`, which costs next to nothing while disabled
+        :param log_each_call: whether to also log the stats of each `self.make_data` call, as one line of JSON on the
+            "reber" logger at INFO level
+        :return: the stats, which keep adding up until `self.disable_stats` is called
+        """
+        self.stats = GenerationStats()
+        self._log_stats = log_each_call
+        return self.stats
+
+    def disable_stats(self) -> None:
+        self.stats = None
+        self._log_stats = False
+
+    @contextlib.contextmanager
+    def _collecting_call_stats(self) -> Iterator[None]:
+        """
+        Collects the stats of one `self.make_data` call apart, adds them to `self.stats`, and logs them
+        """
+        if self.stats is None:
+            yield
+            return
+        total_stats, self.stats = self.stats, GenerationStats()
+        try:
+            yield
+        finally:
+            call_stats, self.stats = self.stats, total_stats
+            call_stats.num_make_data_calls = 1
+            total_stats.merge(call_stats)
+            if self._log_stats:
+                logger.info(
+                    "make_data %s", json.dumps(call_stats.as_dict(), sort_keys=True)
+                )
+
+    # ------------------------- deduplication
+    # rows generated at once when replacing repeated rows, and the number of times in a row that doing so may come up
+    # with nothing new before giving up
+    _min_dedup_batch_num_rows = 1024
+    _max_fruitless_dedup_batches = 20
+
+    def _deduplicate_rows(
+        self,
+        X: np.ndarray,
+        metadata: DatatypeToRowCount,
+        origins: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Replaces, in place, every row of X that repeats an earlier row (of any datatype) with a newly generated row of
+        the same datatype that is distinct from all rows so far
+        :param X: rows grouped by datatype in the order of `ReberDataType`, as filled by `self._fill_data`
+        :param origins: optionally, the origins of the rows of X, which are kept in step with them
+        """
+        num_valid_rows = metadata.get_num_rows_of(ReberDataType.VALID)
+        num_valid_strings = (
+            self.get_string_index().length_counts[self._length_probabilities > 0].sum()
+        )
+        if num_valid_rows > num_valid_strings:
+            raise ValueError(
+                f"Only {num_valid_strings} distinct valid strings fit into max_length {self.max_length}; "
+                f"{num_valid_rows} were asked for"
+            )
+        key_index = KeyIndex()
+        start = 0
         for datatype in ReberDataType:
-            num_rows = metadata.get_num_rows_of(datatype)
-            X_raw.extend(self._create_rows_of_datatype(num_rows, datatype))
-            y_raw.extend([datatype.get_class_label()] * num_rows)
-        return pd.DataFrame(X_raw).astype("int64"), pd.Series(y_raw)
+            stop = start + metadata.get_num_rows_of(datatype)
+            self._deduplicate_rows_of_datatype(
+                X[start:stop],
+                datatype,
+                key_index,
+                None if origins is None else origins[start:stop],
+            )
+            start = stop
+
+    def _deduplicate_rows_of_datatype(
+        self,
+        out: np.ndarray,
+        datatype: ReberDataType,
+        key_index: KeyIndex,
+        origins: Optional[np.ndarray] = None,
+    ) -> None:
+        is_new = key_index.add(pack_rows(out))
+        num_distinct_rows = np.count_nonzero(is_new)
+        out[:num_distinct_rows] = out[is_new]
+        if origins is not None:
+            origins[:num_distinct_rows] = origins[is_new]
+        if self.stats is not None:
+            self.stats.num_rejected_rows += out.shape[0] - int(num_distinct_rows)
+        num_fruitless_batches = 0
+        while num_distinct_rows < out.shape[0]:
+            num_missing_rows = out.shape[0] - num_distinct_rows
+            batch = np.empty(
+                (
+                    max(2 * num_missing_rows, self._min_dedup_batch_num_rows),
+                    self.max_length,
+                ),
+                dtype=out.dtype,
+            )
+            batch_origins = None if origins is None else make_origins(batch.shape[0])
+            self._fill_rows_of_datatype(batch, datatype, batch_origins, refill=True)
+            is_new = key_index.add(pack_rows(batch))
+            new_rows = batch[is_new][:num_missing_rows]
+            if self.stats is not None:
+                self.stats.num_rejected_rows += batch.shape[0] - new_rows.shape[0]
+            out[num_distinct_rows : num_distinct_rows + new_rows.shape[0]] = new_rows
+            if origins is not None:
+                origins[num_distinct_rows : num_distinct_rows + new_rows.shape[0]] = (
+                    batch_origins[is_new][:num_missing_rows]
+                )
+            num_distinct_rows += new_rows.shape[0]
+            num_fruitless_batches = (
+                0 if new_rows.shape[0] else num_fruitless_batches + 1
+            )
+            if num_fruitless_batches == self._max_fruitless_dedup_batches:
+                raise ValueError(
+                    f"Couldn't find more than {num_distinct_rows} distinct {datatype.value} rows "
+                    f"of at most {self.max_length} chars"
+                )
+
+    def count_distinct_rows(
+        self, X: np.ndarray, **kwargs: Dict[str, int]
+    ) -> Dict[ReberDataType, int]:
+        """
+        :param X: rows as returned by `self.make_data` (before any shuffling), i.e. grouped by datatype in the order of
+            `ReberDataType`
+        :param kwargs: the percentages that X was made with
+        :return: the exact number of distinct rows of each datatype
+        """
+        metadata = DatatypeToRowCount(
+            X.shape[0], ReberDatatypeToPercentage.from_kwargs(**kwargs)
+        )
+        datatype_to_count = {}
+        start = 0
+        for datatype in ReberDataType:
+            stop = start + metadata.get_num_rows_of(datatype)
+            datatype_to_count[datatype] = np.unique(
+                pack_rows(np.asarray(X[start:stop]))
+            ).size
+            start = stop
+        return datatype_to_count
+
+    # ------------------------- enumeration
+    def get_string_index(self) -> StringIndex:
+        """
+        :return: the index of every valid string of at most self.max_length chars, which counts them by length, ranks
+            and unranks them, and streams them all in lexicographic order (e.g. as an exhaustive evaluation set).
+            Built on first use.
+        """
+        if self._string_index is None:
+            self._string_index = StringIndex(self.recognizer, self.max_length)
+        return self._string_index
+
+    def sample_distinct_valid_rows(
+        self, num_rows: int, dtype: np.dtype = COMPACT_DTYPE
+    ) -> np.ndarray:
+        """
+        Unlike the VALID rows of `self.make_data`, which follow the random walk through the grammar and so are mostly
+        short strings, every valid string of at most self.max_length chars is equally likely here
+        :return: a (num_rows, self.max_length) matrix of distinct valid strings, drawn uniformly at random without
+            replacement
+        """
+        return self.get_string_index().sample(num_rows, self._np_random, dtype)
+
+    # ------------------------- scoring
+    def log_probabilities(self, X: np.ndarray, truncated: bool = True) -> np.ndarray:
+        """
+        Scores rows under the distribution that VALID rows are generated from, e.g. to weight samples:
+        `np.exp(target_log_probabilities - reber.log_probabilities(X))` reweights them to another distribution over
+        valid strings, such as the uniform one of `self.sample_distinct_valid_rows`.
+        :param X: (N, self.max_length) matrix of encoded and padded strings
+        :param truncated: whether to account for the strings being at most self.max_length chars long (and for the
+            length distribution, if one was given), i.e. to score the walk conditioned on the length of the string
+            like `self._fill_valid_rows` samples it. Otherwise scores the plain random walk, without any limit on its
+            length.
+        :return: the exact log-probability of generating each row as a VALID row; -inf for rows that can't be
+        """
+        log_probabilities = self.grammar.log_probabilities(X)
+        if not truncated:
+            return log_probabilities
+        # the walk's probability of each length is replaced by the probability of sampling that length
+        walk_length_probabilities = self._finish_probabilities[self.grammar.start_state]
+        length_log_ratios = np.full(self.max_length + 1, -np.inf)
+        is_possible = walk_length_probabilities > 0
+        with np.errstate(divide="ignore"):
+            length_log_ratios[is_possible] = np.log(
+                self._length_probabilities[is_possible]
+            ) - np.log(walk_length_probabilities[is_possible])
+        return log_probabilities + length_log_ratios[row_lengths(X)]
+
+    def probabilities(self, X: np.ndarray, truncated: bool = True) -> np.ndarray:
+        """
+        :return: the exact probability of generating each row as a VALID row, see `self.log_probabilities`
+        """
+        return np.exp(self.log_probabilities(X, truncated))
+
+    # ------------------------- bulk encoding
+    _UNRECOGNIZED_BYTE = 255
+
+    @staticmethod
+    def _join_strings(
+        strings: Union[Iterable[str], np.ndarray, bytes],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: buffer, lengths where buffer holds the bytes of every string, each followed by a separator byte, and
+            lengths holds the length of each string
+        """
+        if isinstance(strings, (bytes, bytearray, memoryview)):
+            buffer = np.frombuffer(strings, dtype=np.uint8)
+            if buffer.size and buffer[-1] != ord("\n"):
+                buffer = np.append(buffer, np.uint8(ord("\n")))
+            newline_idxes = np.flatnonzero(buffer == ord("\n"))
+            lengths = np.diff(newline_idxes, prepend=-1) - 1
+            return buffer, lengths
+        if isinstance(strings, np.ndarray):
+            strings = strings.astype(str).tolist()
+        elif not isinstance(strings, (list, tuple)):
+            strings = list(strings)
+        lengths = np.fromiter(map(len, strings), dtype=np.intp, count=len(strings))
+        # non-ascii chars become one "?" byte each, so they still take up one byte and are never recognized
+        joined = "\n".join(strings).encode("ascii", errors="replace") + b"\n"
+        return np.frombuffer(joined, dtype=np.uint8), lengths
+
+    def encode_many(
+        self,
+        strings: Union[Iterable[str], np.ndarray, bytes],
+        dtype: np.dtype = COMPACT_DTYPE,
+    ) -> np.ndarray:
+        """
+        Bulk version of `encode_as_padded_ints`
+        :param strings: strings of the reber alphabet; either an iterable or array of strings, or a single buffer of
+            newline-separated strings
+        :return: a (len(strings), self.max_length) matrix whose rows are the encoded and padded strings
+        :raises EncodingError: listing every string that has chars outside of the alphabet or is too long
+        """
+        start_time = time.perf_counter() if self.stats is not None else None
+        buffer, lengths = self._join_strings(strings)
+        num_rows = lengths.size
+        row_starts = np.cumsum(lengths + 1) - lengths - 1
+        row_idxes = np.repeat(np.arange(num_rows), lengths + 1)
+        cols = np.arange(buffer.size) - row_starts[row_idxes]
+        is_letter = cols < lengths[row_idxes]  # i.e. not the separator after each row
+        row_idxes = row_idxes[is_letter]
+        cols = cols[is_letter]
+        encoded_letters = self._byte_to_encoded_letter[buffer[is_letter]]
+
+        is_unrecognized = encoded_letters == self._UNRECOGNIZED_BYTE
+        unrecognized_letter_row_idxes = np.unique(row_idxes[is_unrecognized])
+        too_long_row_idxes = np.flatnonzero(lengths > self.max_length)
+        if unrecognized_letter_row_idxes.size or too_long_row_idxes.size:
+            raise EncodingError(
+                unrecognized_letter_row_idxes, too_long_row_idxes, self.max_length
+            )
+
+        X = np.zeros((num_rows, self.max_length), dtype=dtype)
+        X[row_idxes, cols] = encoded_letters
+        if self.stats is not None:
+            self.stats.encode_seconds += time.perf_counter() - start_time
+        return X
+
+    def decode_many(self, X: np.ndarray) -> List[str]:
+        """
+        Inverse of `encode_many`
+        :param X: (N, L) matrix of encoded and padded strings
+        :return: the N strings, without padding
+        """
+        X = np.asarray(X)
+        letter_bytes = np.ascontiguousarray(self._encoded_letter_to_byte[X])
+        # numpy strips the trailing zero bytes, i.e. the padding, off of fixed width byte strings
+        return letter_bytes.view(f"S{X.shape[1]}").ravel().astype(str).tolist()
 
     def encode_as_padded_ints(self, string, safe=True) -> List[int]:
         """
@@ -343,6 +1594,27 @@ class ReberGenerator:
         return unpadded_ints + [PADDING_VALUE] * padding_length
 
 
+def _make_shard(
+    generator_cls: type,
+    generator_kwargs: dict,
+    datatype: ReberDataType,
+    num_rows: int,
+    dtype: np.dtype,
+    seed_sequence: np.random.SeedSequence,
+    with_origins: bool,
+    collect_stats: bool,
+) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[GenerationStats]]:
+    # each shard builds its own generator from the constructor arguments, seeded with the shard's own seed, rather than
+    # being sent a copy of the generator: a copy would carry the state of the generator's RNGs, and its caches
+    reber = generator_cls(**generator_kwargs, seed=seed_sequence)
+    if collect_stats:
+        reber.stats = GenerationStats()
+    out = np.empty((num_rows, reber.max_length), dtype=dtype)
+    origins = make_origins(num_rows) if with_origins else None
+    reber._fill_rows_of_datatype(out, datatype, origins)
+    return out, origins, reber.stats
+
+
 if __name__ == "__main__":
     reber = ReberGenerator(max_length=20)
     X, y = reber.make_data(m_total=1000)
@@ -0,0 +1,145 @@
+"""
+Packs encoded and padded rows (like the rows of X from `ReberGenerator.make_data`) into one uint64 key per row, so
+that rows can be deduplicated, counted and split into disjoint sets with numpy instead of python sets of strings.
+"""
+
+import numpy as np
+from typing import Optional, Tuple
+
+# enough for the 7 reber letters plus the padding value
+BITS_PER_SYMBOL = 3
+KEY_DTYPE = np.uint64
+
+
+def max_packed_length(bits_per_symbol: int = BITS_PER_SYMBOL) -> int:
+    """
+    :return: the widest rows that `pack_rows` can pack into a single key
+    """
+    return np.iinfo(KEY_DTYPE).bits // bits_per_symbol
+
+
+def pack_rows(X: np.ndarray, bits_per_symbol: int = BITS_PER_SYMBOL) -> np.ndarray:
+    """
+    :param X: (N, L) matrix of encoded and padded strings, where each value fits into bits_per_symbol bits
+    :return: a vector of N keys, equal exactly when the rows are equal. The first column is the most significant, so
+        sorting the keys sorts the rows lexicographically.
+    """
+    X = np.asarray(X)
+    num_rows, width = X.shape
+    if width > max_packed_length(bits_per_symbol):
+        raise ValueError(
+            f"Rows of width {width} don't fit into one key; at most {max_packed_length(bits_per_symbol)} do"
+        )
+    if X.size and X.max() >= 1 << bits_per_symbol:
+        raise ValueError(f"X has values that don't fit into {bits_per_symbol} bits")
+    keys = np.zeros(num_rows, dtype=KEY_DTYPE)
+    shift = KEY_DTYPE(bits_per_symbol)
+    for col in range(width):
+        keys <<= shift
+        keys |= X[:, col].astype(KEY_DTYPE)
+    return keys
+
+
+def unpack_rows(
+    keys: np.ndarray,
+    width: int,
+    dtype: np.dtype = np.uint8,
+    bits_per_symbol: int = BITS_PER_SYMBOL,
+) -> np.ndarray:
+    """
+    Inverse of `pack_rows`
+    :return: a (len(keys), width) matrix
+    """
+    keys = np.asarray(keys, dtype=KEY_DTYPE)
+    mask = KEY_DTYPE((1 << bits_per_symbol) - 1)
+    X = np.empty((keys.size, width), dtype=dtype)
+    for col in range(width):
+        shift = KEY_DTYPE(bits_per_symbol * (width - 1 - col))
+        X[:, col] = (keys >> shift) & mask
+    return X
+
+
+class KeyIndex:
+    """
+    A growing set of keys, kept as a sorted array so that membership of whole batches of keys is one `searchsorted`
+    """
+
+    def __init__(self):
+        self._keys = np.empty(0, dtype=KEY_DTYPE)
+
+    def __len__(self) -> int:
+        return self._keys.size
+
+    def _find(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: positions, is_contained where positions are where keys would be inserted to keep the index sorted,
+            and is_contained is True for every key that is in the index
+        """
+        positions = np.searchsorted(self._keys, keys)
+        in_bounds = positions < self._keys.size
+        is_contained = np.zeros(keys.size, dtype=bool)
+        is_contained[in_bounds] = self._keys[positions[in_bounds]] == keys[in_bounds]
+        return positions, is_contained
+
+    def contains(self, keys: np.ndarray) -> np.ndarray:
+        """
+        :return: a boolean vector that is True for every key that is in the index
+        """
+        return self._find(np.asarray(keys, dtype=KEY_DTYPE))[1]
+
+    def add(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Adds keys to the index, in time linear in the size of the index plus the number of keys (times log of that)
+        :return: a boolean vector that is True for the first occurrence of every key that wasn't in the index yet
+        """
+        keys = np.asarray(keys, dtype=KEY_DTYPE)
+        unique_keys, first_idxes = np.unique(keys, return_index=True)
+        positions, is_contained = self._find(unique_keys)
+        is_new_unique_key = ~is_contained
+        is_new = np.zeros(keys.size, dtype=bool)
+        is_new[first_idxes[is_new_unique_key]] = True
+        # the new keys and their insertion positions are both sorted, so this merges them in without sorting the index
+        self._keys = np.insert(
+            self._keys,
+            positions[is_new_unique_key],
+            unique_keys[is_new_unique_key],
+        )
+        return is_new
+
+
+def split_without_leaks(
+    X: np.ndarray,
+    test_size: float,
+    validation_size: float = 0,
+    seed: Optional[int] = None,
+    bits_per_symbol: int = BITS_PER_SYMBOL,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Like sklearn's `train_test_split`, except that every copy of a row ends up in the same set, so that no string in
+    the test (or validation) set was seen during training
+    :param test_size: fraction of the rows to put into the test set. Because duplicates stay together, the actual
+        fraction can be off by the number of copies of one row.
+    :param validation_size: fraction of the rows to put into the validation set
+    :return: train_idxes, validation_idxes, test_idxes: disjoint sorted indexes into the rows of X
+    """
+    if test_size < 0 or validation_size < 0 or test_size + validation_size > 1:
+        raise ValueError(
+            "test_size and validation_size must be fractions adding up to at most 1"
+        )
+    keys = pack_rows(X, bits_per_symbol)
+    _, row_to_key_idx, key_counts = np.unique(
+        keys, return_inverse=True, return_counts=True
+    )
+    # visit the distinct rows in random order, filling up the test set first, then the validation set
+    key_order = np.random.default_rng(seed).permutation(key_counts.size)
+    num_rows_before_key = np.cumsum(key_counts[key_order]) - key_counts[key_order]
+    num_test_rows = round(test_size * keys.size)
+    num_validation_rows = round(validation_size * keys.size)
+    key_split = np.empty(key_counts.size, dtype=np.int8)
+    key_split[key_order] = np.where(
+        num_rows_before_key < num_test_rows,
+        2,
+        np.where(num_rows_before_key < num_test_rows + num_validation_rows, 1, 0),
+    )
+    row_split = key_split[row_to_key_idx.ravel()]
+    return tuple(np.flatnonzero(row_split == split) for split in range(3))
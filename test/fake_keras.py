@@ -0,0 +1,47 @@
+"""
+Stand-ins for keras layers and models, which have just what `numpy_inference.export_keras_model` reads, so that
+exporting can be tested without tensorflow
+"""
+
+
+class FakeLayer:
+    def __init__(self, name, config, weights):
+        self.name = name
+        self._config = config
+        self._weights = weights
+
+    def get_config(self):
+        return self._config
+
+    def get_weights(self):
+        return self._weights
+
+
+# named like the keras layers, which is all that the exporter looks at
+class Embedding(FakeLayer):
+    pass
+
+
+class LSTM(FakeLayer):
+    pass
+
+
+class Dropout(FakeLayer):
+    pass
+
+
+class Dense(FakeLayer):
+    pass
+
+
+class Activation(FakeLayer):
+    pass
+
+
+class Bidirectional(FakeLayer):
+    pass
+
+
+class FakeModel:
+    def __init__(self, layers):
+        self.layers = layers
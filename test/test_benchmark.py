@@ -0,0 +1,131 @@
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from benchmark import (
+    CASES,
+    _RejectionSampler,
+    _time_case,
+    find_regressions,
+    run_benchmarks,
+    run_inference_benchmarks,
+)
+from reber import ReberGenerator
+from numpy_inference import export_keras_model
+from test.fake_keras import LSTM, Dense, Embedding, FakeModel
+
+
+def _result(rows_per_second, peak_bytes, name="perturb_rows"):
+    return {
+        "name": name,
+        "max_length": 15,
+        "num_perturbations": 2,
+        "m_total": 1000,
+        "seconds": 1000 / rows_per_second,
+        "rows_per_second": rows_per_second,
+        "peak_bytes": peak_bytes,
+    }
+
+
+class TestBenchmark(TestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks(
+            max_lengths=[12, 15],
+            num_perturbations_list=[1],
+            m_totals=[100],
+            case_names=["make_data[valid]", "perturb_rows"],
+            repeat=1,
+        )
+        self.assertEqual(4, len(results))
+        for result in results:
+            self.assertGreater(result["rows_per_second"], 0)
+            self.assertGreater(result["peak_bytes"], 0)
+
+    def test_every_case_runs(self):
+        results = run_benchmarks(
+            max_lengths=[12], num_perturbations_list=[2], m_totals=[100], repeat=1
+        )
+        self.assertEqual(list(CASES), [result["name"] for result in results])
+
+    def test_perturb_rows_gets_fresh_rows_outside_of_the_timing(self):
+        reber = ReberGenerator(15, seed=0)
+        prepare, run = CASES["perturb_rows"](reber, 100)
+        num_valid_rows = []
+
+        def count_then_run(X):
+            num_valid_rows.append(int(reber.recognizer.predict(X).sum()))
+            run(X)
+
+        _time_case((prepare, count_then_run), repeat=3)
+        self.assertEqual([100, 100, 100], num_valid_rows)
+
+    def test_rejection_sampler_follows_the_grammar(self):
+        reber = ReberGenerator(12, seed=0)
+        sampler = _RejectionSampler(reber.grammar, reber.max_length, seed=0)
+        X = reber.encode_many(
+            [
+                "".join(sampler.make_embedded_reber_list_of_correct_length())
+                for _ in range(20_000)
+            ]
+        )
+        distinct_X, counts = np.unique(X, axis=0, return_counts=True)
+        self.assertTrue(reber.recognizer.accepts(distinct_X).all())
+        np.testing.assert_allclose(
+            reber.probabilities(distinct_X), counts / counts.sum(), atol=0.01
+        )
+
+    def test_no_regression_within_tolerance(self):
+        baseline = [_result(rows_per_second=1000, peak_bytes=100)]
+        results = [_result(rows_per_second=850, peak_bytes=110)]
+        self.assertEqual([], find_regressions(results, baseline, tolerance=0.2))
+
+    def test_throughput_regression(self):
+        baseline = [_result(rows_per_second=1000, peak_bytes=100)]
+        results = [_result(rows_per_second=700, peak_bytes=100)]
+        (regression,) = find_regressions(results, baseline, tolerance=0.2)
+        self.assertIn("700 rows/s, baseline 1000 rows/s", regression)
+
+    def test_memory_regression(self):
+        baseline = [_result(rows_per_second=1000, peak_bytes=100)]
+        results = [_result(rows_per_second=1000, peak_bytes=200)]
+        (regression,) = find_regressions(results, baseline, tolerance=0.2)
+        self.assertIn("peak memory 200 bytes", regression)
+
+    def test_results_missing_from_baseline_are_ignored(self):
+        baseline = [_result(rows_per_second=1000, peak_bytes=100)]
+        results = [_result(rows_per_second=1, peak_bytes=10**9, name="fill_valid_rows")]
+        self.assertEqual([], find_regressions(results, baseline, tolerance=0.2))
+
+
+class TestInferenceBenchmark(TestCase):
+    def test_run_inference_benchmarks(self):
+        rng = np.random.default_rng(0)
+        model = FakeModel(
+            [
+                Embedding("embedding", {"mask_zero": True}, [rng.normal(size=(8, 4))]),
+                LSTM(
+                    "lstm",
+                    {
+                        "activation": "tanh",
+                        "recurrent_activation": "sigmoid",
+                        "return_sequences": False,
+                    },
+                    [rng.normal(size=(4, 12)), rng.normal(size=(3, 12)), np.zeros(12)],
+                ),
+                Dense(
+                    "dense",
+                    {"activation": "sigmoid"},
+                    [rng.normal(size=(3, 1)), np.zeros(1)],
+                ),
+            ]
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model_path = f"{tmp_dir}/model.npz"
+            export_keras_model(model, model_path)
+            results = run_inference_benchmarks(model_path, m_totals=[1, 100], repeat=1)
+        self.assertEqual([1, 100], [result["m_total"] for result in results])
+        for result in results:
+            self.assertEqual("numpy_inference", result["name"])
+            self.assertGreater(result["rows_per_second"], 0)
+            self.assertGreater(result["cold_start_seconds"], 0)
@@ -0,0 +1,109 @@
+import ast
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+import dataset_cache
+from dataset_cache import DatasetCache
+from reber import ReberGenerator
+
+MAX_LENGTH = 15
+
+
+class TestDatasetCache(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = DatasetCache(self._tmp_dir.name)
+
+    def tearDown(self):
+        self._tmp_dir.cleanup()
+
+    def test_code_version_covers_every_generation_module(self):
+        repo_dir = os.path.dirname(dataset_cache.__file__)
+        local_modules = set()
+        modules_to_visit = ["reber"]
+        while modules_to_visit:
+            module = modules_to_visit.pop()
+            path = os.path.join(repo_dir, f"{module}.py")
+            if module in local_modules or not os.path.exists(path):
+                continue
+            local_modules.add(module)
+            with open(path) as f:
+                for node in ast.parse(f.read()).body:
+                    if isinstance(node, ast.ImportFrom):
+                        modules_to_visit.append(node.module)
+                    elif isinstance(node, ast.Import):
+                        modules_to_visit.extend(alias.name for alias in node.names)
+        self.assertEqual(
+            local_modules,
+            {module.__name__ for module in dataset_cache._GENERATION_MODULES},
+        )
+
+    def test_miss_matches_make_data(self):
+        X, y = self.cache.make_data(ReberGenerator(MAX_LENGTH, seed=1), 200)
+        expected_X, expected_y = ReberGenerator(MAX_LENGTH, seed=1).make_data(
+            200, as_frame=False
+        )
+        self.assertIsInstance(X, np.memmap)
+        np.testing.assert_array_equal(expected_X, X)
+        np.testing.assert_array_equal(expected_y, y)
+
+    def test_hit(self):
+        X_a, _ = self.cache.make_data(ReberGenerator(MAX_LENGTH, seed=1), 200)
+        X_b, _ = self.cache.make_data(ReberGenerator(MAX_LENGTH, seed=1), 200)
+        np.testing.assert_array_equal(X_a, X_b)
+        self.assertEqual(1, len(self.cache.list_entries()))
+
+    def test_hit_advances_generator_like_make_data(self):
+        cached_reber = ReberGenerator(MAX_LENGTH, seed=1)
+        self.cache.make_data(ReberGenerator(MAX_LENGTH, seed=1), 200)
+        self.cache.make_data(cached_reber, 200)
+        X, _ = self.cache.make_data(cached_reber, 200)
+
+        reber = ReberGenerator(MAX_LENGTH, seed=1)
+        reber.make_data(200)
+        expected_X, _ = reber.make_data(200, as_frame=False)
+        np.testing.assert_array_equal(expected_X, X)
+
+    def test_different_params_are_different_entries(self):
+        self.cache.make_data(ReberGenerator(MAX_LENGTH, seed=1), 200)
+        self.cache.make_data(ReberGenerator(MAX_LENGTH, seed=2), 200)
+        self.cache.make_data(
+            ReberGenerator(MAX_LENGTH, num_perturbations=1, seed=1), 200
+        )
+        self.cache.make_data(
+            ReberGenerator(MAX_LENGTH, seed=1),
+            200,
+            valid=25,
+            perturbed=25,
+            symmetry_disturbed=25,
+            random=25,
+        )
+        self.assertEqual(4, len(self.cache.list_entries()))
+
+    def test_unseeded_generator(self):
+        with self.assertRaisesRegex(ValueError, "Only generators with a seed"):
+            self.cache.make_data(ReberGenerator(MAX_LENGTH), 200)
+
+    def test_purge(self):
+        self.cache.make_data(ReberGenerator(MAX_LENGTH, seed=1), 200)
+        self.cache.make_data(ReberGenerator(MAX_LENGTH, seed=2), 200)
+        first_key = self.cache.list_entries()[0].key
+
+        self.cache.purge(first_key)
+        self.assertEqual(1, len(self.cache.list_entries()))
+        self.cache.purge()
+        self.assertEqual([], self.cache.list_entries())
+
+    def test_evicts_least_recently_used(self):
+        self.cache.make_data(ReberGenerator(MAX_LENGTH, seed=1), 200)
+        (entry,) = self.cache.list_entries()
+        os.utime(entry.path / "params.json", (0, 0))
+        self.cache.max_bytes = entry.num_bytes
+
+        self.cache.make_data(ReberGenerator(MAX_LENGTH, seed=2), 200)
+
+        (remaining_entry,) = self.cache.list_entries()
+        self.assertNotEqual(entry.key, remaining_entry.key)
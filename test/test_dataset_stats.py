@@ -0,0 +1,97 @@
+import json
+from unittest import TestCase
+
+import numpy as np
+
+from dataset_stats import DatasetStats
+from ragged import to_ragged
+from reber import ReberDataType, ReberGenerator
+
+MAX_LENGTH = 15
+
+
+class TestDatasetStats(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(MAX_LENGTH, seed=0)
+        self.X, self.y = self.reber.make_data(1000, as_frame=False)
+
+    def test_counts(self):
+        X = np.array([[1, 2, 0], [1, 0, 0], [3, 3, 3]])
+        dataset_stats = DatasetStats(3, alphabet="ABC")
+        dataset_stats.update(X, np.array([1, 0, 0]))
+        self.assertEqual(3, dataset_stats.num_rows)
+        self.assertEqual([0, 1, 1, 1], dataset_stats.length_counts.tolist())
+        self.assertEqual(
+            [[0, 2, 0, 1], [1, 0, 1, 1], [2, 0, 0, 1]],
+            dataset_stats.symbol_counts.tolist(),
+        )
+        self.assertEqual([2, 1], dataset_stats.label_counts.tolist())
+        self.assertAlmostEqual(3 / 9, dataset_stats.padding_fraction)
+        self.assertEqual(
+            ["padding", "A", "B", "C"],
+            list(dataset_stats.symbol_frequencies().columns),
+        )
+
+    def test_matches_whole_dataset(self):
+        dataset_stats = DatasetStats(MAX_LENGTH)
+        dataset_stats.update(self.X, self.y)
+        self.assertAlmostEqual((self.X == 0).mean(), dataset_stats.padding_fraction)
+        np.testing.assert_array_equal(
+            np.bincount((self.X != 0).sum(axis=1), minlength=MAX_LENGTH + 1),
+            dataset_stats.length_histogram(),
+        )
+        np.testing.assert_allclose(
+            (self.X[:, 4] == 3).mean(),
+            dataset_stats.symbol_frequencies().loc[4, "P"],
+        )
+
+    def test_chunks_and_ragged_rows_count_the_same(self):
+        whole = DatasetStats(MAX_LENGTH)
+        whole.update(self.X)
+        chunked = DatasetStats(MAX_LENGTH)
+        chunked._chunk_num_rows = 64
+        chunked.update(self.X)
+        ragged = DatasetStats(MAX_LENGTH)
+        ragged._chunk_num_rows = 64
+        ragged.update(to_ragged(self.X))
+        for other in (chunked, ragged):
+            np.testing.assert_array_equal(whole.symbol_counts, other.symbol_counts)
+            np.testing.assert_array_equal(whole.length_counts, other.length_counts)
+
+    def test_make_data(self):
+        dataset_stats = DatasetStats(MAX_LENGTH)
+        self.reber.make_data(
+            1000, ragged=True, as_frame=False, dataset_stats=dataset_stats
+        )
+        self.assertEqual([500, 50, 400, 50], dataset_stats.datatype_counts.tolist())
+        self.assertEqual([500, 500], dataset_stats.label_counts.tolist())
+
+    def test_track_and_merge(self):
+        first = DatasetStats(MAX_LENGTH)
+        second = DatasetStats(MAX_LENGTH)
+        for X, y, origins in first.track(
+            self.reber.iter_batches(100, num_batches=3, return_origins=True)
+        ):
+            self.assertEqual(100, X.shape[0])
+        for _ in second.track(self.reber.iter_batches(100, num_batches=2)):
+            pass
+        first.merge(second)
+        self.assertEqual(500, first.num_rows)
+        self.assertEqual(500, first.length_counts.sum())
+        # only the tracked origins say which datatype the rows are
+        self.assertEqual(300, first.datatype_counts.sum())
+        self.assertEqual(
+            150, first.datatype_counts[list(ReberDataType).index(ReberDataType.VALID)]
+        )
+        with self.assertRaises(ValueError):
+            first.merge(DatasetStats(MAX_LENGTH + 1))
+
+    def test_as_dict(self):
+        dataset_stats = DatasetStats(MAX_LENGTH)
+        dataset_stats.update(self.X, self.y, datatype=ReberDataType.RANDOM)
+        as_dict = json.loads(json.dumps(dataset_stats.as_dict()))
+        self.assertEqual(1000, as_dict["datatype_counts"]["random"])
+
+    def test_wrong_width(self):
+        with self.assertRaises(ValueError):
+            DatasetStats(MAX_LENGTH + 1).update(self.X)
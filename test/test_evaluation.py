@@ -0,0 +1,95 @@
+from unittest import TestCase
+
+import numpy as np
+
+from evaluation import StreamingEvaluation, evaluate
+from prediction_server import make_recognizer_predictor
+from reber import ReberDataType, ReberGenerator, make_origins
+
+MAX_LENGTH = 15
+
+
+class TestStreamingEvaluation(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(MAX_LENGTH, seed=0)
+
+    def test_update(self):
+        X = np.zeros((4, MAX_LENGTH), dtype=np.uint8)
+        X[:, :8] = 1
+        X[1, 8] = 1
+        origins = make_origins(4)
+        origins["datatype"] = [0, 0, 1, 2]
+        origins["edit_kinds"] = [0, 0, 2, 4]
+        origins["first_edit_col"] = [-1, -1, 3, 1]
+        evaluation = StreamingEvaluation(MAX_LENGTH)
+        evaluation.update(
+            X, origins, np.array([[0.9], [0.1], [0.6], [0.2]]), [1, 1, 0, 0]
+        )
+        self.assertEqual(4, evaluation.num_rows)
+        confusion_matrices = evaluation.confusion_matrices()
+        np.testing.assert_array_equal(
+            [[0, 0], [1, 1]], confusion_matrices[ReberDataType.VALID]
+        )
+        np.testing.assert_array_equal(
+            [[0, 1], [0, 0]], confusion_matrices[ReberDataType.PERTURBED]
+        )
+        np.testing.assert_array_equal(
+            [[0, 0], [0, 0]], confusion_matrices[ReberDataType.RANDOM]
+        )
+        self.assertEqual(
+            {"valid": 0.5, "perturbed": 0.0, "symmetry_disturbed": 1.0},
+            evaluation.accuracy_by_datatype().to_dict(),
+        )
+        self.assertEqual({8: 2 / 3, 9: 0.0}, evaluation.accuracy_by_length().to_dict())
+        self.assertEqual(
+            {0: 0.5, 2: 0.0, 4: 1.0}, evaluation.accuracy_by_edit_kinds().to_dict()
+        )
+        self.assertEqual({1: 1.0, 3: 0.0}, evaluation.accuracy_by_edit_col().to_dict())
+
+    def test_recognizer_is_always_right(self):
+        evaluation = evaluate(
+            self.reber, make_recognizer_predictor(self.reber), 3, batch_size=1000
+        )
+        self.assertEqual(3000, evaluation.num_rows)
+        self.assertTrue((evaluation.accuracy_by_datatype() == 1).all())
+        self.assertTrue((evaluation.accuracy_by_length() == 1).all())
+        self.assertTrue((evaluation.accuracy_by_edit_col() == 1).all())
+        self.assertEqual(
+            {0, 1, 2, 3, 4}, set(evaluation.accuracy_by_edit_kinds().index)
+        )
+
+    def test_always_valid_predictor(self):
+        evaluation = evaluate(
+            self.reber,
+            lambda X: np.ones(X.shape[0]),
+            2,
+            batch_size=1000,
+            valid=50,
+            perturbed=0,
+            symmetry_disturbed=50,
+            random=0,
+        )
+        confusion_matrices = evaluation.confusion_matrices()
+        np.testing.assert_array_equal(
+            [[0, 0], [0, 1000]], confusion_matrices[ReberDataType.VALID]
+        )
+        np.testing.assert_array_equal(
+            [[0, 1000], [0, 0]], confusion_matrices[ReberDataType.SYMMETRY_DISTURBED]
+        )
+        self.assertEqual(
+            {"valid": 1.0, "symmetry_disturbed": 0.0},
+            evaluation.accuracy_by_datatype().to_dict(),
+        )
+
+    def test_merge(self):
+        predictor = lambda X: np.full(X.shape[0], 0.7)
+        first = evaluate(self.reber, predictor, 2, batch_size=500)
+        second = evaluate(self.reber, predictor, 3, batch_size=500)
+        first.merge(second)
+        self.assertEqual(2500, first.num_rows)
+        self.assertEqual(
+            2500,
+            sum(matrix.sum() for matrix in first.confusion_matrices().values()),
+        )
+        with self.assertRaises(ValueError):
+            first.merge(StreamingEvaluation(MAX_LENGTH, threshold=0.9))
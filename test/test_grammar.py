@@ -0,0 +1,396 @@
+import itertools
+import json
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from grammar import Grammar, StringIndex
+from reber import EMBEDDED_REBER_GRAMMAR_SPEC, ReberGenerator
+
+# strings of one or more "A"s followed by "B", or "AC"
+AB_SPEC = {
+    "alphabet": "ABC",
+    "start_graph": "main",
+    "graphs": {
+        "main": {
+            "start": "start",
+            "end": "end",
+            "edges": [
+                ["start", "as", "A", 3],
+                ["start", "c", "A"],
+                ["as", "as", "A"],
+                ["as", "end", "B"],
+                ["c", "end", "C"],
+            ],
+        }
+    },
+}
+
+
+class TestGrammar(TestCase):
+    def _encode(self, grammar, strings, width):
+        X = np.zeros((len(strings), width), dtype=np.int64)
+        for row, string in enumerate(strings):
+            X[row, : len(string)] = [grammar.letter_to_int[c] for c in string]
+        return X
+
+    def test_embedded_reber_alternates(self):
+        # these used to be written out by hand in ReberGenerator
+        grammar = Grammar.from_spec(EMBEDDED_REBER_GRAMMAR_SPEC)
+        expected_alternates = {
+            "B": set(),
+            "E": set(),
+            "P": {"T", "V"},
+            "T": {"P", "V"},
+            "S": {"X"},
+            "V": {"T", "P"},
+            "X": {"S"},
+        }
+        self.assertEqual(expected_alternates, grammar.alternates)
+
+    def test_embedded_reber_next_chars(self):
+        grammar = Grammar.from_spec(EMBEDDED_REBER_GRAMMAR_SPEC)
+        self.assertEqual({"B"}, grammar.next_chars[""])
+        # e.g. "BTB..." and "BPB..."
+        self.assertIn("B", grammar.next_chars["T"])
+        self.assertIn("B", grammar.next_chars["P"])
+        # e.g. "...PVVE..."
+        self.assertEqual({"E", "P", "V"}, grammar.next_chars["V"])
+
+    def test_weights(self):
+        grammar = Grammar.from_spec(AB_SPEC)
+        first_letter_probabilities = grammar.probability[grammar.start_state]
+        self.assertEqual([0.75, 0.25], first_letter_probabilities.tolist())
+
+    def test_nondeterministic_spec_is_recognized(self):
+        grammar = Grammar.from_spec(AB_SPEC)
+        X = self._encode(grammar, ["AB", "AAAB", "AC", "AAC", "A", "B", "ACB"], 4)
+        self.assertEqual(
+            [True, True, True, False, False, False, False],
+            grammar.recognizer.accepts(X).tolist(),
+        )
+
+    def test_derived_letter_sets(self):
+        grammar = Grammar.from_spec(AB_SPEC)
+        self.assertEqual({"A"}, grammar.next_chars[""])
+        self.assertEqual({"A", "B", "C"}, grammar.next_chars["A"])
+        self.assertEqual(set(), grammar.next_chars["B"])
+        self.assertEqual({"B", "C"}, grammar.alternates["A"])
+
+    def test_multi_letter_labels(self):
+        spec = {
+            "alphabet": "AB",
+            "start_graph": "main",
+            "graphs": {
+                "main": {"start": 0, "end": 2, "edges": [[0, 1, "AB"], [1, 2, "A"]]}
+            },
+        }
+        grammar = Grammar.from_spec(spec)
+        counts = grammar.path_counts(3)[grammar.start_state]
+        self.assertEqual([0, 0, 0, 1], counts.tolist())
+        X = self._encode(grammar, ["ABA", "AB", "A"], 3)
+        self.assertEqual([True, False, False], grammar.recognizer.accepts(X).tolist())
+
+    def test_empty_label(self):
+        spec = {
+            "alphabet": "A",
+            "start_graph": "main",
+            "graphs": {"main": {"start": 0, "end": 1, "edges": [[0, 1, ""]]}},
+        }
+        with self.assertRaisesRegex(ValueError, "must emit at least one letter"):
+            Grammar.from_spec(spec)
+
+    def test_from_json(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+            json.dump(EMBEDDED_REBER_GRAMMAR_SPEC, f)
+            f.flush()
+            grammar = Grammar.from_json(f.name)
+        counts = grammar.path_counts(9)[grammar.start_state]
+        self.assertEqual(4, counts[9])
+
+    def test_unknown_letter(self):
+        spec = dict(AB_SPEC, alphabet="AB")
+        with self.assertRaisesRegex(ValueError, r"Letters \['C'\] of graph main"):
+            Grammar.from_spec(spec)
+
+    def test_unknown_graph(self):
+        spec = {
+            "alphabet": "A",
+            "start_graph": "main",
+            "graphs": {
+                "main": {"start": 0, "end": 1, "edges": [[0, 1, {"graph": "x"}]]}
+            },
+        }
+        with self.assertRaisesRegex(ValueError, "Unknown graph x"):
+            Grammar.from_spec(spec)
+
+    def test_graph_containing_itself(self):
+        spec = {
+            "alphabet": "A",
+            "start_graph": "main",
+            "graphs": {
+                "main": {
+                    "start": 0,
+                    "end": 1,
+                    "edges": [[0, 1, "A"], [0, 1, {"graph": "main"}]],
+                }
+            },
+        }
+        with self.assertRaisesRegex(ValueError, "isn't regular"):
+            Grammar.from_spec(spec)
+
+    def test_malformed_specs(self):
+        for edges, message in [
+            # the walk would stop at 1 before ever taking the "X"
+            ([[0, 1, "T"], [0, 1, "P"], [1, 1, "X"]], "end node 1 of graph main"),
+            ([[0, 1, "T", -1], [0, 1, "P"]], "0 -> 1 of graph main has a negative"),
+            (
+                [[0, 1, "T", 0], [0, 1, "P", 0]],
+                "node 0 of graph main must have a positive",
+            ),
+        ]:
+            spec = {
+                "alphabet": "PTX",
+                "start_graph": "main",
+                "graphs": {"main": {"start": 0, "end": 1, "edges": edges}},
+            }
+            with self.subTest(message=message):
+                with self.assertRaisesRegex(ValueError, message):
+                    Grammar.from_spec(spec)
+
+    def test_zero_weight_edges_are_left_out(self):
+        spec = {
+            "alphabet": "PT",
+            "start_graph": "main",
+            "graphs": {
+                "main": {"start": 0, "end": 1, "edges": [[0, 1, "T"], [0, 1, "P", 0]]}
+            },
+        }
+        grammar = Grammar.from_spec(spec)
+        X = self._encode(grammar, ["T", "P"], 1)
+
+        self.assertEqual([True, False], grammar.recognizer.accepts(X).tolist())
+        self.assertEqual([0.0, -np.inf], grammar.log_probabilities(X).tolist())
+        self.assertEqual(1, len(StringIndex(grammar.recognizer, max_length=1)))
+
+    def test_generator_with_custom_grammar(self):
+        grammar = Grammar.from_spec(AB_SPEC)
+        reber = ReberGenerator(max_length=6, grammar=grammar, seed=0)
+        X = np.empty((200, 6), dtype=np.int64)
+
+        reber._fill_valid_rows(X)
+
+        self.assertTrue(grammar.recognizer.accepts(X).all())
+        self.assertIn(reber.make_valid_embedded_reber_string()[-1], "BC")
+
+    def test_make_data_with_custom_grammar(self):
+        # no letter can be replaced, and "B" and "ABABABABB" have nowhere to insert one into
+        spec = {
+            "alphabet": "AB",
+            "start_graph": "main",
+            "graphs": {
+                "main": {"start": 0, "end": 1, "edges": [[0, 0, "AB", 3], [0, 1, "B"]]}
+            },
+        }
+        for spec, max_length in [(spec, 9), (AB_SPEC, 6)]:
+            for num_perturbations, vectorized in itertools.product(
+                [1, 2], [True, False]
+            ):
+                with self.subTest(
+                    alphabet=spec["alphabet"],
+                    num_perturbations=num_perturbations,
+                    vectorized=vectorized,
+                ):
+                    grammar = Grammar.from_spec(spec)
+                    reber = ReberGenerator(
+                        max_length, num_perturbations, grammar=grammar, seed=0
+                    )
+
+                    X, y = reber.make_data(
+                        1000,
+                        vectorized=vectorized,
+                        as_frame=False,
+                        valid=50,
+                        perturbed=50,
+                        symmetry_disturbed=0,
+                        random=0,
+                    )
+
+                    self.assertLessEqual(X.max(), len(spec["alphabet"]))
+                    self.assertTrue(grammar.recognizer.accepts(X[:500]).all())
+                    self.assertLess(grammar.recognizer.predict(X)[y == 0].mean(), 0.1)
+
+    def test_unsupported_datatypes(self):
+        # no "T" or "P" to flip
+        abc_spec = dict(AB_SPEC, alphabet="ABCD")
+        # "T" and "P", but one letter long
+        tp_spec = {
+            "alphabet": "PT",
+            "start_graph": "main",
+            "graphs": {
+                "main": {"start": 0, "end": 1, "edges": [[0, 1, "T"], [0, 1, "P"]]}
+            },
+        }
+        # "BXTE" has an "X" as its second letter
+        bxte_spec = {
+            "alphabet": "BEPTX",
+            "start_graph": "main",
+            "graphs": {
+                "main": {
+                    "start": 0,
+                    "end": 1,
+                    "edges": [[0, 1, "BTXE"], [0, 1, "BXTE"]],
+                }
+            },
+        }
+        # every string of two or more letters, so no edit can guarantee an invalid string
+        any_spec = {
+            "alphabet": "AB",
+            "start_graph": "main",
+            "graphs": {
+                "main": {
+                    "start": 0,
+                    "end": 2,
+                    "edges": [
+                        [0, 1, "A"],
+                        [0, 1, "B"],
+                        [1, 1, "A"],
+                        [1, 1, "B"],
+                        [1, 2, "A"],
+                        [1, 2, "B"],
+                    ],
+                }
+            },
+        }
+        for spec, datatype, message in [
+            (abc_spec, "symmetry_disturbed", "T/P symmetry"),
+            (tp_spec, "symmetry_disturbed", "T/P symmetry"),
+            (bxte_spec, "symmetry_disturbed", "T/P symmetry"),
+            (any_spec, "perturbed", "can't make perturbed rows"),
+        ]:
+            with self.subTest(alphabet=spec["alphabet"], datatype=datatype):
+                reber = ReberGenerator(6, grammar=Grammar.from_spec(spec), seed=0)
+                kwargs = dict(valid=50, perturbed=0, symmetry_disturbed=0, random=0)
+                kwargs[datatype] = 50
+                with self.assertRaisesRegex(ValueError, message):
+                    reber.make_data(1000, as_frame=False, **kwargs)
+                with self.assertRaisesRegex(ValueError, message):
+                    next(reber.iter_batches(100, **kwargs))
+                # the other datatypes can still be made
+                reber.make_data(
+                    1000,
+                    as_frame=False,
+                    valid=100,
+                    perturbed=0,
+                    symmetry_disturbed=0,
+                    random=0,
+                )
+
+    def test_symmetry_disturbed_rows_of_custom_grammar(self):
+        spec = {
+            "alphabet": "ABEPT",
+            "start_graph": "main",
+            "graphs": {
+                "main": {
+                    "start": 0,
+                    "end": 1,
+                    "edges": [[0, 1, "BTATE"], [0, 1, "BPAPE"]],
+                }
+            },
+        }
+        grammar = Grammar.from_spec(spec)
+        reber = ReberGenerator(6, grammar=grammar, seed=0)
+
+        X, _ = reber.make_data(
+            1000, as_frame=False, valid=0, perturbed=0, symmetry_disturbed=100, random=0
+        )
+
+        self.assertEqual({"BPATE", "BTAPE"}, set(reber.decode_many(X)))
+
+    def test_log_probabilities_of_nondeterministic_grammar(self):
+        # "A" may lead to two states, so "AB" and "AC" each take one of two paths
+        grammar = Grammar.from_spec(AB_SPEC)
+        self.assertIsNone(grammar._letter_transitions)
+        X = self._encode(grammar, ["AC", "AB", "AAB", "AA", "", "BA"], width=4)
+        X = np.vstack([X, [[1, 0, 2, 0]]])  # padding in the middle
+
+        probabilities = np.exp(grammar.log_probabilities(X))
+
+        np.testing.assert_allclose(
+            [1 / 4, 3 / 4 * 1 / 2, 3 / 4 * 1 / 4, 0, 0, 0, 0], probabilities
+        )
+
+    def test_log_probabilities_paths_agree(self):
+        grammar = Grammar.from_spec(EMBEDDED_REBER_GRAMMAR_SPEC)
+        reber = ReberGenerator(max_length=12, grammar=grammar, seed=0)
+        X = reber.make_data(1000, as_frame=False)[0]
+
+        walked = grammar.log_probabilities(X)
+        grammar._letter_transitions = None
+        np.testing.assert_allclose(walked, grammar.log_probabilities(X))
+        self.assertTrue(np.isfinite(walked[:500]).all())
+
+    def test_log_probabilities_of_out_of_range_values(self):
+        grammar = Grammar.from_spec(AB_SPEC)
+        with self.assertRaises(ValueError):
+            grammar.log_probabilities(np.array([[4, 0]]))
+
+
+class TestStringIndex(TestCase):
+    def setUp(self):
+        grammar = Grammar.from_spec(AB_SPEC)
+        self.index = StringIndex(grammar.recognizer, max_length=4)
+        # "AB" and "AC" both start with an "A" that comes from different edges, but are only counted once each
+        self.strings_in_order = ["AAAB", "AAB", "AB", "AC"]
+        self.X = np.array(
+            [
+                [1, 1, 1, 2],
+                [1, 1, 2, 0],
+                [1, 2, 0, 0],
+                [1, 3, 0, 0],
+            ]
+        )
+
+    def test_counts(self):
+        self.assertEqual(4, len(self.index))
+        self.assertEqual([0, 0, 2, 1, 1], self.index.length_counts.tolist())
+
+    def test_unrank(self):
+        np.testing.assert_array_equal(self.X, self.index.unrank(np.arange(4)))
+
+    def test_rank(self):
+        self.assertEqual([3, 1], self.index.rank(self.X[[3, 1]]).tolist())
+
+    def test_rank_rejects_strings_outside_of_the_index(self):
+        with self.assertRaisesRegex(ValueError, "2 rows aren't valid strings"):
+            self.index.rank([[1, 1, 1, 2, 0], [1, 1, 1, 1, 2], [2, 0, 0, 0, 0]])
+
+    def test_unrank_rejects_ranks_outside_of_the_index(self):
+        with self.assertRaises(ValueError):
+            self.index.unrank([4])
+
+    def test_iter_rows(self):
+        np.testing.assert_array_equal(
+            self.X, np.concatenate(list(self.index.iter_rows(batch_size=3)))
+        )
+
+    def test_sample(self):
+        X = self.index.sample(4, np.random.default_rng(0))
+        self.assertEqual([0, 1, 2, 3], sorted(self.index.rank(X).tolist()))
+        with self.assertRaises(ValueError):
+            self.index.sample(5, np.random.default_rng(0))
+
+    def test_embedded_reber_round_trip(self):
+        reber = ReberGenerator(max_length=21, seed=0)
+        index = reber.get_string_index()
+        X = index.unrank(np.arange(len(index)))
+        self.assertTrue(reber.recognizer.accepts(X).all())
+        self.assertEqual(len(index), np.unique(X, axis=0).shape[0])
+        np.testing.assert_array_equal(np.arange(len(index)), index.rank(X))
+        strings = reber.decode_many(X)
+        self.assertEqual(sorted(strings), strings)
+
+    def test_too_many_strings(self):
+        with self.assertRaises(OverflowError):
+            StringIndex(Grammar.from_spec(EMBEDDED_REBER_GRAMMAR_SPEC).recognizer, 200)
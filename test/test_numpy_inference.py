@@ -0,0 +1,145 @@
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from numpy_inference import NumpyLSTMClassifier, export_keras_model
+from test.fake_keras import (
+    LSTM,
+    Activation,
+    Bidirectional,
+    Dense,
+    Dropout,
+    Embedding,
+    FakeModel,
+)
+
+
+def _sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def _reference_lstm(inputs, kernel, recurrent_kernel, bias, return_sequences):
+    """
+    One row, one timestep at a time, like keras' LSTM with tanh and sigmoid activations
+    """
+    units = recurrent_kernel.shape[0]
+    h = np.zeros(units)
+    c = np.zeros(units)
+    outputs = []
+    for x in inputs:
+        z = x @ kernel + h @ recurrent_kernel + bias
+        i, f, g, o = (
+            z[:units],
+            z[units : 2 * units],
+            z[2 * units : 3 * units],
+            z[3 * units :],
+        )
+        c = _sigmoid(f) * c + _sigmoid(i) * np.tanh(g)
+        h = _sigmoid(o) * np.tanh(c)
+        outputs.append(h)
+    return np.array(outputs) if return_sequences else h
+
+
+class TestNumpyLSTMClassifier(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.num_symbols, embedding_dim, units = 8, 5, 6
+        self.embeddings = rng.normal(size=(self.num_symbols, embedding_dim))
+        self.lstm_weights = [
+            [
+                rng.normal(size=(input_dim, 4 * units)),
+                rng.normal(size=(units, 4 * units)),
+                rng.normal(size=4 * units),
+            ]
+            for input_dim in (embedding_dim, units)
+        ]
+        self.dense_weights = [rng.normal(size=(units, 1)), rng.normal(size=1)]
+        lengths = rng.integers(0, 11, size=300)
+        self.X = np.where(
+            np.arange(10) < lengths[:, None], rng.integers(1, 8, size=(300, 10)), 0
+        )
+
+    def _make_model(self, mask_zero, num_lstms=1):
+        layers = [
+            Embedding("embedding", {"mask_zero": mask_zero}, [self.embeddings]),
+            Dropout("dropout", {}, []),
+        ]
+        for lstm_idx in range(num_lstms):
+            layers.append(
+                LSTM(
+                    f"lstm_{lstm_idx}",
+                    {
+                        "activation": "tanh",
+                        "recurrent_activation": "sigmoid",
+                        "return_sequences": lstm_idx < num_lstms - 1,
+                    },
+                    self.lstm_weights[lstm_idx],
+                )
+            )
+        layers.append(Dense("dense", {"activation": "linear"}, self.dense_weights))
+        layers.append(Activation("activation", {"activation": "sigmoid"}, []))
+        return FakeModel(layers)
+
+    def _reference_predict(self, X, mask_zero, num_lstms=1):
+        predictions = []
+        for row in X:
+            if mask_zero:
+                row = row[row != 0]
+            values = self.embeddings[row]
+            for lstm_idx in range(num_lstms):
+                values = _reference_lstm(
+                    values,
+                    *self.lstm_weights[lstm_idx],
+                    return_sequences=lstm_idx < num_lstms - 1,
+                )
+            kernel, bias = self.dense_weights
+            predictions.append(_sigmoid(values @ kernel + bias))
+        return np.array(predictions)
+
+    def _export_and_load(self, model):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = f"{tmp_dir}/model.npz"
+            export_keras_model(model, path)
+            return NumpyLSTMClassifier.from_file(path)
+
+    def test_matches_reference(self):
+        for mask_zero in (False, True):
+            for num_lstms in (1, 2):
+                with self.subTest(mask_zero=mask_zero, num_lstms=num_lstms):
+                    classifier = self._export_and_load(
+                        self._make_model(mask_zero, num_lstms)
+                    )
+                    predictions = classifier.predict(self.X, batch_size=64)
+                    self.assertEqual((300, 1), predictions.shape)
+                    self.assertEqual(np.float32, predictions.dtype)
+                    np.testing.assert_allclose(
+                        self._reference_predict(self.X, mask_zero, num_lstms),
+                        predictions,
+                        rtol=1e-4,
+                        atol=1e-5,
+                    )
+
+    def test_masked_predictions_ignore_padding_width(self):
+        classifier = self._export_and_load(self._make_model(mask_zero=True))
+        np.testing.assert_allclose(
+            classifier.predict(self.X),
+            classifier.predict(np.pad(self.X, [(0, 0), (0, 5)])),
+            rtol=1e-5,
+        )
+
+    def test_no_rows(self):
+        classifier = self._export_and_load(self._make_model(mask_zero=True))
+        self.assertEqual((0, 1), classifier.predict(self.X[:0]).shape)
+
+    def test_symbols_outside_of_the_embedding(self):
+        classifier = self._export_and_load(self._make_model(mask_zero=True))
+        with self.assertRaises(ValueError):
+            classifier.predict([[self.num_symbols]])
+
+    def test_unsupported_layer(self):
+        model = self._make_model(mask_zero=True)
+        model.layers[2] = Bidirectional("bidirectional", {}, [])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaisesRegex(ValueError, "Bidirectional isn't supported"):
+                export_keras_model(model, f"{tmp_dir}/model.npz")
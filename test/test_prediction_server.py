@@ -0,0 +1,151 @@
+import asyncio
+import json
+import tempfile
+import threading
+from unittest import TestCase
+
+from prediction_server import (
+    STATS_REQUEST,
+    MicroBatcher,
+    PredictionServer,
+    make_recognizer_predictor,
+)
+from reber import ReberGenerator
+
+MAX_LENGTH = 15
+VALID_STRING = "BTBTXSETE"
+INVALID_STRING = "BTBTXSETP"
+
+
+class TestMicroBatcher(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(MAX_LENGTH, seed=0)
+        self.rows = [
+            self.reber.encode_as_padded_ints(s)
+            for s in [VALID_STRING, INVALID_STRING] * 5
+        ]
+
+    def _predict_concurrently(self, batcher, rows):
+        async def run():
+            await batcher.start()
+            try:
+                return await asyncio.gather(*map(batcher.predict, rows))
+            finally:
+                await batcher.stop()
+
+        return asyncio.run(run())
+
+    def test_predictions(self):
+        batcher = MicroBatcher(make_recognizer_predictor(self.reber))
+        predictions = self._predict_concurrently(batcher, self.rows)
+        self.assertEqual([1.0, 0.0] * 5, predictions)
+        # everything arrived at once, so it all fit into one batch
+        self.assertEqual({10: 1}, batcher.batch_size_histogram)
+
+    def test_max_batch_size(self):
+        batcher = MicroBatcher(make_recognizer_predictor(self.reber), max_batch_size=4)
+        self._predict_concurrently(batcher, self.rows)
+        self.assertEqual({4: 2, 2: 1}, batcher.batch_size_histogram)
+        stats = batcher.stats()
+        self.assertEqual(10, stats["num_requests"])
+        self.assertEqual(0, stats["queue_depth"])
+        self.assertLessEqual(stats["latency_p50_seconds"], stats["latency_p99_seconds"])
+
+    def test_predictor_errors_reach_every_caller_of_the_batch(self):
+        def predictor(X):
+            raise RuntimeError("broken model")
+
+        with self.assertRaisesRegex(RuntimeError, "broken model"):
+            self._predict_concurrently(MicroBatcher(predictor), self.rows)
+
+    def test_stop_fails_unpredicted_rows(self):
+        predicting = threading.Event()
+        may_finish = threading.Event()
+
+        def predictor(X):
+            predicting.set()
+            may_finish.wait()
+            return X[:, 0]
+
+        batcher = MicroBatcher(predictor, max_batch_size=4)
+
+        async def run():
+            await batcher.start()
+            predictions = [
+                asyncio.ensure_future(batcher.predict(row)) for row in self.rows
+            ]
+            # the first batch is being predicted and the rest are queued
+            while not predicting.is_set():
+                await asyncio.sleep(0.001)
+            await batcher.stop()
+            may_finish.set()
+            return await asyncio.wait_for(
+                asyncio.gather(*predictions, return_exceptions=True), timeout=5
+            )
+
+        outcomes = asyncio.run(run())
+        self.assertEqual(len(self.rows), len(outcomes))
+        for outcome in outcomes:
+            self.assertIsInstance(outcome, RuntimeError)
+        self.assertEqual(0, batcher.stats()["queue_depth"])
+
+
+class TestPredictionServer(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(MAX_LENGTH, seed=0)
+
+    @staticmethod
+    async def _read_answer(reader):
+        # a line that never gets an answer fails the test rather than hanging it
+        return json.loads(await asyncio.wait_for(reader.readline(), timeout=5))
+
+    def _serve(self, server, lines):
+        """
+        :return: the answers to lines, sent over one connection, and then the answer to a stats request
+        """
+
+        async def run(socket_path):
+            asyncio_server = await server.serve(socket_path=socket_path)
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            try:
+                writer.write("".join(f"{line}\n" for line in lines).encode())
+                await writer.drain()
+                answers = [await self._read_answer(reader) for _ in range(len(lines))]
+                writer.write(f"{STATS_REQUEST}\n".encode())
+                stats = await self._read_answer(reader)
+                return answers, stats
+            finally:
+                writer.close()
+                asyncio_server.close()
+                await asyncio_server.wait_closed()
+                await server.batcher.stop()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            return asyncio.run(run(f"{tmp_dir}/reber.sock"))
+
+    def test_serves_lines_in_order(self):
+        server = PredictionServer(
+            self.reber,
+            MicroBatcher(make_recognizer_predictor(self.reber), max_batch_size=8),
+        )
+        lines = [VALID_STRING, INVALID_STRING, "BTX?", "B" * (MAX_LENGTH + 1)] * 3
+        answers, stats = self._serve(server, lines)
+
+        for answer_idx in range(0, len(lines), 4):
+            self.assertEqual({"prediction": 1.0}, answers[answer_idx])
+            self.assertEqual({"prediction": 0.0}, answers[answer_idx + 1])
+            self.assertIn("uppercase reber alphabet", answers[answer_idx + 2]["error"])
+            self.assertIn("must be at most", answers[answer_idx + 3]["error"])
+        self.assertEqual(6, stats["num_requests"])
+
+    def test_failing_predictor_answers_every_line(self):
+        def predictor(X):
+            raise RuntimeError("broken model")
+
+        server = PredictionServer(self.reber, MicroBatcher(predictor))
+        answers, stats = self._serve(server, [VALID_STRING, "BTX?", INVALID_STRING])
+
+        self.assertIn("broken model", answers[0]["error"])
+        self.assertIn("uppercase reber alphabet", answers[1]["error"])
+        self.assertIn("broken model", answers[2]["error"])
+        self.assertEqual(0, stats["num_requests"])
@@ -0,0 +1,124 @@
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from prefetch import PrefetchingBatches, WorkerError
+from ragged import RaggedRows, to_padded
+from reber import COMPACT_DTYPE, ORIGIN_DTYPE, ReberDataType, ReberGenerator
+
+MAX_LENGTH = 15
+
+
+class TestPrefetchingBatches(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(MAX_LENGTH, seed=0)
+
+    def test_yields_num_batches(self):
+        for num_workers in (1, 3):
+            with self.subTest(num_workers=num_workers):
+                with PrefetchingBatches(
+                    self.reber, 32, num_batches=10, num_workers=num_workers
+                ) as batches:
+                    X_batches = [X for X, _ in batches]
+                self.assertEqual(10, len(X_batches))
+                for X in X_batches:
+                    self.assertEqual((32, MAX_LENGTH), X.shape)
+                    self.assertEqual(COMPACT_DTYPE, X.dtype)
+                self.assertEqual(10, batches.stats()["num_batches"])
+
+    def test_batches_are_labelled_correctly(self):
+        with PrefetchingBatches(
+            self.reber,
+            100,
+            num_batches=3,
+            valid=50,
+            perturbed=50,
+            symmetry_disturbed=0,
+            random=0,
+        ) as batches:
+            for X, y in batches:
+                np.testing.assert_array_equal(
+                    self.reber.recognizer.predict(X) > 0, y > 0
+                )
+
+    def test_seeded_single_worker_is_reproducible(self):
+        def first_batch():
+            with PrefetchingBatches(
+                ReberGenerator(MAX_LENGTH, seed=1), 16, num_batches=1
+            ) as batches:
+                ((X, _),) = batches
+            return X
+
+        np.testing.assert_array_equal(first_batch(), first_batch())
+
+    def test_processes(self):
+        with PrefetchingBatches(
+            self.reber, 16, num_batches=4, num_workers=2, use_processes=True
+        ) as batches:
+            self.assertEqual(4, len(list(batches)))
+
+    def test_ragged_batches_with_origins(self):
+        for use_processes in (False, True):
+            with self.subTest(use_processes=use_processes):
+                with PrefetchingBatches(
+                    self.reber,
+                    32,
+                    num_batches=4,
+                    num_workers=2,
+                    use_processes=use_processes,
+                    ragged=True,
+                    return_origins=True,
+                ) as batches:
+                    for X, y, origins in batches:
+                        self.assertIsInstance(X, RaggedRows)
+                        self.assertEqual(ORIGIN_DTYPE, origins.dtype)
+                        is_valid = origins["datatype"] == list(ReberDataType).index(
+                            ReberDataType.VALID
+                        )
+                        X = to_padded(X, MAX_LENGTH)
+                        self.assertTrue(
+                            self.reber.recognizer.accepts(X[is_valid]).all()
+                        )
+                        np.testing.assert_array_equal(is_valid, y == 1)
+                self.assertEqual(4, batches.stats()["num_batches"])
+
+    def test_backpressure(self):
+        batches = PrefetchingBatches(self.reber, 16, queue_depth=2)
+        try:
+            time.sleep(0.3)
+            # the worker generates forever, but can only get ahead by the depth of the queue
+            self.assertEqual(2, batches._queue.qsize())
+        finally:
+            batches.close()
+        self.assertFalse(any(worker.is_alive() for worker in batches._workers))
+
+    def test_close_stops_infinite_workers(self):
+        with PrefetchingBatches(
+            self.reber, 16, num_workers=2, queue_depth=1
+        ) as batches:
+            next(batches)
+        self.assertFalse(any(worker.is_alive() for worker in batches._workers))
+        with self.assertRaises(StopIteration):
+            next(batches)
+
+    @patch("reber.ReberGenerator._fill_valid_rows", side_effect=ValueError("broken"))
+    def test_worker_exception_reaches_consumer(self, _):
+        with self.assertRaises(WorkerError) as context:
+            with PrefetchingBatches(self.reber, 16, num_batches=5) as batches:
+                list(batches)
+        self.assertIsInstance(context.exception.__cause__, ValueError)
+        self.assertIn("broken", str(context.exception))
+
+    def test_wait_counters(self):
+        with PrefetchingBatches(
+            self.reber, 16, num_batches=5, queue_depth=5
+        ) as batches:
+            time.sleep(0.3)  # let the worker fill the queue
+            list(batches)
+        stats = batches.stats()
+        self.assertEqual(5, stats["num_batches"])
+        # the last get waits for the worker to say that it's done
+        self.assertLessEqual(stats["num_waits"], 1)
+        self.assertGreaterEqual(stats["wait_seconds"], 0)
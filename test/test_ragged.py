@@ -0,0 +1,75 @@
+from unittest import TestCase
+
+import numpy as np
+
+from ragged import LengthBucketedBatches, RaggedRows, row_lengths, to_padded, to_ragged
+
+
+class TestRaggedRows(TestCase):
+    def setUp(self):
+        self.X = np.array([[1, 2, 3, 0], [4, 0, 0, 0], [0, 0, 0, 0], [5, 6, 7, 1]])
+
+    def test_to_ragged(self):
+        rows = to_ragged(self.X)
+        self.assertEqual([1, 2, 3, 4, 5, 6, 7, 1], rows.symbols.tolist())
+        self.assertEqual([0, 3, 4, 4, 8], rows.offsets.tolist())
+
+    def test_round_trip(self):
+        np.testing.assert_array_equal(self.X, to_padded(to_ragged(self.X)))
+        np.testing.assert_array_equal(
+            np.pad(self.X, [(0, 0), (0, 2)]), to_padded(to_ragged(self.X), width=6)
+        )
+
+    def test_to_padded_of_a_slice_of_the_buffer(self):
+        rows = RaggedRows(symbols=np.array([9, 1, 2, 3]), offsets=np.array([1, 3, 4]))
+        np.testing.assert_array_equal([[1, 2], [3, 0]], to_padded(rows))
+
+    def test_rows_too_long_for_width(self):
+        with self.assertRaises(ValueError):
+            to_padded(to_ragged(self.X), width=3)
+
+
+class TestLengthBucketedBatches(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        lengths = rng.integers(1, 11, size=1000)
+        self.X = np.where(
+            np.arange(10) < lengths[:, None], 1 + rng.integers(0, 7, size=(1000, 10)), 0
+        )
+        self.y = np.arange(1000)
+
+    def test_every_row_once(self):
+        batches = LengthBucketedBatches(self.X, self.y, 32, seed=0)
+        ys = np.concatenate([y for _, y in batches])
+        self.assertEqual(self.y.tolist(), sorted(ys.tolist()))
+
+    def test_batches_are_padded_to_their_bucket(self):
+        batches = LengthBucketedBatches(
+            self.X, self.y, 32, bucket_boundaries=[3, 6], seed=0
+        )
+        self.assertEqual(len(batches), len(list(batches)))
+        for X_batch, y_batch in batches:
+            self.assertIn(X_batch.shape[1], (3, 6, 10))
+            self.assertLessEqual(X_batch.shape[0], 32)
+            lengths = row_lengths(self.X[y_batch])
+            self.assertTrue((lengths <= X_batch.shape[1]).all())
+            self.assertTrue((lengths > {3: 0, 6: 3, 10: 6}[X_batch.shape[1]]).all())
+            np.testing.assert_array_equal(self.X[y_batch, : X_batch.shape[1]], X_batch)
+
+    def test_padding_report(self):
+        batches = LengthBucketedBatches(
+            self.X, self.y, 32, bucket_boundaries=[5], seed=0
+        )
+        lengths = row_lengths(self.X)
+        self.assertEqual((10 - lengths).sum(), batches.num_unbucketed_padding_cells)
+        self.assertEqual(
+            np.where(lengths <= 5, 5, 10).sum() - lengths.sum(),
+            batches.num_padding_cells,
+        )
+        self.assertAlmostEqual(
+            1 - batches.num_padding_cells / batches.num_unbucketed_padding_cells,
+            batches.saved_padding_fraction,
+        )
+        self.assertEqual(
+            1.0, LengthBucketedBatches(self.X, self.y, 32).saved_padding_fraction
+        )
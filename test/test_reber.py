@@ -1,11 +1,25 @@
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
 from unittest import TestCase
 from unittest.mock import patch, Mock
 
+import numpy as np
+
+from ragged import to_padded
 from reber import (
+    COMPACT_DTYPE,
+    PADDING_VALUE,
     DatatypeToRowCount,
+    EditKind,
+    EncodingError,
     ReberDataType,
     ReberDatatypeToPercentage,
     ReberGenerator,
+    _choose_weighted,
+    make_origins,
 )
 
 MAX_LENGTH = 15
@@ -70,7 +84,7 @@ class TestReberGenerator(TestCase):
 
     # TODO: maybe make separate test classes instead of breaking it up like this
     # ------------------------- string generator fns
-    @patch("reber.random.random", return_value=0)  # index to change = 1
+    @patch("reber.random.Random.random", return_value=0)  # index to change = 1
     def test_symmetry_disturbed(self, _):
         # can't actually create a str of length 5 but whatever
         reber = ReberGenerator(max_length=5)
@@ -80,8 +94,8 @@ class TestReberGenerator(TestCase):
         sym_disturbed_str = reber.make_symmetry_disturbed_reber_string()
         self.assertEqual("BPSTE", sym_disturbed_str)
 
-    @patch("reber.random.choice")
-    @patch("reber.random.randrange")
+    @patch("reber.random.Random.choice")
+    @patch("reber.random.Random.randrange")
     def test_make_random(self, mock_randrange, mock_choice):
         length_of_string = 8
         mock_randrange.return_value = length_of_string
@@ -92,7 +106,7 @@ class TestReberGenerator(TestCase):
 
         self.assertEqual("BTSSVXTE", actual)
 
-    @patch("reber.random.choice")
+    @patch("reber.random.Random.choice")
     def test_perturb_str_list_do_not_add_chars_to_max_len_str(self, mock_choice):
         reber = ReberGenerator(max_length=MAX_LENGTH, num_perturbations=1)
         str_list = ["B"] * MAX_LENGTH
@@ -101,7 +115,7 @@ class TestReberGenerator(TestCase):
 
         mock_choice.assert_called_once_with([reber._randomly_inplace_edit_str_list])
 
-    @patch("reber.random.choice")
+    @patch("reber.random.Random.choice")
     def test_perturb_str_list_add_char_to_short_enough_str(self, mock_choice):
         # TODO: actually do this
         reber = ReberGenerator(max_length=MAX_LENGTH, num_perturbations=1)
@@ -114,8 +128,8 @@ class TestReberGenerator(TestCase):
             [reber._randomly_inplace_edit_str_list, reber._add_random_char_to_str_list]
         )
 
-    @patch("random.choice")
-    @patch("random.randrange")
+    @patch("reber.random.Random.choice")
+    @patch("reber.random.Random.randrange")
     def test_add_random_char_to_beginning_of_list(self, mock_randrange, mock_choice):
         r = ReberGenerator(MAX_LENGTH)
         mock_randrange.return_value = 0
@@ -132,8 +146,8 @@ class TestReberGenerator(TestCase):
         expected_str_list = ["X"] + str_list
         self.assertEqual(expected_str_list, actual_str_list)
 
-    @patch("random.choice")
-    @patch("random.randrange")
+    @patch("reber.random.Random.choice")
+    @patch("reber.random.Random.randrange")
     def test_add_random_char_to_middle_of_list(self, mock_randrange, mock_choice):
         r = ReberGenerator(MAX_LENGTH)
         mock_randrange.return_value = 2
@@ -142,8 +156,8 @@ class TestReberGenerator(TestCase):
 
         actual_str_list = r._add_random_char_to_str_list(str_list)
         actual_possible_letters_to_add = mock_choice.mock_calls[0][1][0]
-        # if we add after a V, we can add anything except P or E
-        expected_possible_letters_to_add = ["B", "V", "X", "T", "S"]
+        # if we add after a V, we can add anything except P, E or V
+        expected_possible_letters_to_add = ["B", "X", "T", "S"]
         self.assertCountEqual(
             expected_possible_letters_to_add, actual_possible_letters_to_add
         )
@@ -158,7 +172,7 @@ class TestReberGenerator(TestCase):
     def test_make_reber_str_list(self):
         pass
 
-    @patch("reber.random.choice")
+    @patch("reber.random.Random.choice")
     def test_perturb_str_list(self, mock_choice):
         reber = ReberGenerator(max_length=MAX_LENGTH, num_perturbations=2)
         mock_choice.return_value = lambda sl: sl + ["W"]
@@ -187,3 +201,796 @@ class TestReberGenerator(TestCase):
             f"String is length {excessive_length}; must be at most {MAX_LENGTH}",
         ):
             reber.encode_as_padded_ints("B" * excessive_length)
+
+
+# all the valid embedded reber strings of length at most 9
+SHORTEST_VALID_STRINGS = {"BTBTXSETE", "BTBPVVETE", "BPBTXSEPE", "BPBPVVEPE"}
+
+
+class TestVectorizedEngine(TestCase):
+    def test_choose_weighted_draw_rounded_up_to_the_total(self):
+        # a draw of random() * total that rounds up to total
+        np_random = Mock(random=Mock(return_value=np.ones(2)))
+        weights = np.array([[1.0, 2.0, 0.0], [0.0, 3.0, 1.0]])
+
+        self.assertEqual([1, 2], _choose_weighted(weights, np_random).tolist())
+
+    def test_fill_valid_rows_only_yields_valid_strings(self):
+        reber = ReberGenerator(max_length=9)
+        out = np.empty((500, 9), dtype=np.int64)
+
+        reber._fill_valid_rows(out)
+
+        self.assertEqual(SHORTEST_VALID_STRINGS, set(reber.decode_many(out)))
+
+    def test_fill_valid_rows_padding_is_at_the_end(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        out = np.empty((500, MAX_LENGTH), dtype=np.int64)
+
+        reber._fill_valid_rows(out)
+
+        lengths = (out != PADDING_VALUE).sum(axis=1)
+        expected_padding = np.arange(MAX_LENGTH) >= lengths[:, None]
+        np.testing.assert_array_equal(expected_padding, out == PADDING_VALUE)
+        # second and second to last chars match
+        np.testing.assert_array_equal(out[:, 1], out[np.arange(500), lengths - 2])
+
+    def test_fill_symmetry_disturbed_rows(self):
+        reber = ReberGenerator(max_length=9)
+        # index to change = 1
+        reber._np_random = Mock(random=Mock(return_value=np.zeros(3)))
+        reber._fill_valid_rows = Mock(
+            side_effect=lambda out: out.__setitem__(
+                slice(None), reber.encode_as_padded_ints("BTBTXSETE")
+            )
+        )
+        out = np.empty((3, 9), dtype=np.int64)
+
+        reber._fill_symmetry_disturbed_rows(out)
+
+        self.assertEqual(["BPBTXSETE"] * 3, reber.decode_many(out))
+
+    def test_fill_random_rows_length(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        out = np.empty((500, MAX_LENGTH), dtype=np.int64)
+
+        reber._fill_random_rows(out)
+
+        lengths = (out != PADDING_VALUE).sum(axis=1)
+        self.assertGreaterEqual(lengths.min(), 8)
+        self.assertLess(lengths.max(), MAX_LENGTH)
+
+    def test_make_data_vectorized_labels(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        X, y = reber.make_data(
+            m_total=1000, valid=50, perturbed=10, symmetry_disturbed=30, random=10
+        )
+        self.assertEqual((1000, MAX_LENGTH), X.shape)
+        self.assertEqual(500, y.sum())
+        self.assertEqual("int64", X.dtypes.unique()[0])
+
+    def test_make_data_as_arrays(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        X, y = reber.make_data(m_total=1000, as_frame=False)
+        self.assertIsInstance(X, np.ndarray)
+        self.assertEqual(COMPACT_DTYPE, X.dtype)
+        self.assertTrue(X.flags["C_CONTIGUOUS"])
+        self.assertEqual((1000,), y.shape)
+        self.assertEqual(COMPACT_DTYPE, y.dtype)
+
+    def test_make_data_as_arrays_not_vectorized(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        X, y = reber.make_data(
+            m_total=100, vectorized=False, as_frame=False, dtype=np.int16
+        )
+        self.assertEqual((100, MAX_LENGTH), X.shape)
+        self.assertEqual(np.int16, X.dtype)
+
+    def test_make_data_peak_memory_per_row(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        m_total = 200_000
+        bytes_per_row = MAX_LENGTH + 1  # one byte per symbol plus one for the label
+
+        tracemalloc.start()
+        try:
+            X, y = reber.make_data(m_total=m_total, as_frame=False)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(m_total * bytes_per_row, X.nbytes + y.nbytes)
+        # everything on top of the output is bounded by the size of the chunks that rows are generated in
+        self.assertLess(peak_bytes - m_total * bytes_per_row, 8 * 2**20)
+
+
+class TestLengthConditionedSampling(TestCase):
+    def test_avoided_rejection_rate(self):
+        # a walk is only short enough if both inner reber strings take the shortest path, which happens 1 / 4 times
+        reber = ReberGenerator(max_length=9)
+        self.assertAlmostEqual(0.75, reber.avoided_rejection_rate)
+
+    def test_path_counts(self):
+        reber = ReberGenerator(max_length=9)
+        grammar = reber.grammar
+        counts = grammar.path_counts(9)[grammar.start_state]
+        self.assertEqual([0] * 9 + [len(SHORTEST_VALID_STRINGS)], counts.tolist())
+
+    def test_length_distribution(self):
+        reber = ReberGenerator(
+            max_length=MAX_LENGTH, length_distribution={10: 1, 14: 3}
+        )
+        out = np.empty((4000, MAX_LENGTH), dtype=np.int64)
+
+        reber._fill_valid_rows(out)
+
+        lengths = (out != PADDING_VALUE).sum(axis=1)
+        self.assertEqual({10, 14}, set(lengths))
+        self.assertAlmostEqual(0.75, (lengths == 14).mean(), delta=0.05)
+
+    def test_length_distribution_impossible_length(self):
+        with self.assertRaisesRegex(
+            ValueError, r"No valid embedded reber string has length \[8\]"
+        ):
+            ReberGenerator(max_length=MAX_LENGTH, length_distribution={8: 1, 9: 1})
+
+    def test_single_strings_follow_the_walk(self):
+        reber = ReberGenerator(max_length=12, seed=0)
+        X = reber.encode_many(
+            [reber.make_valid_embedded_reber_string() for _ in range(20_000)]
+        )
+        distinct_X, counts = np.unique(X, axis=0, return_counts=True)
+        self.assertTrue(reber.recognizer.accepts(distinct_X).all())
+        np.testing.assert_allclose(
+            reber.probabilities(distinct_X), counts / counts.sum(), atol=0.01
+        )
+
+    def test_max_length_too_short_for_any_valid_string(self):
+        reber = ReberGenerator(max_length=8)
+        with self.assertRaisesRegex(ValueError, "No valid embedded reber string"):
+            reber.make_valid_embedded_reber_string()
+
+
+class TestIterBatches(TestCase):
+    def test_num_batches(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        batches = list(reber.iter_batches(batch_size=32, num_batches=3))
+        self.assertEqual(3, len(batches))
+        for X, y in batches:
+            self.assertEqual((32, MAX_LENGTH), X.shape)
+            self.assertEqual((32,), y.shape)
+            self.assertEqual(COMPACT_DTYPE, X.dtype)
+
+    def test_endless(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        batches = reber.iter_batches(batch_size=10)
+        for _ in range(5):
+            next(batches)
+
+    def test_every_batch_has_the_same_mix(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        batches = reber.iter_batches(
+            batch_size=100,
+            num_batches=4,
+            valid=30,
+            perturbed=30,
+            symmetry_disturbed=20,
+            random=20,
+        )
+        for _, y in batches:
+            self.assertEqual(30, y.sum())
+
+    def test_rows_are_shuffled(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        reber._np_random = Mock(
+            wraps=reber._np_random,
+            permutation=Mock(side_effect=lambda n: np.arange(n)[::-1]),
+        )
+        ((_, y),) = reber.iter_batches(
+            batch_size=100,
+            num_batches=1,
+            valid=50,
+            perturbed=50,
+            symmetry_disturbed=0,
+            random=0,
+        )
+        # valid rows are generated first, so reversing puts them last
+        self.assertEqual([0] * 50 + [1] * 50, y.tolist())
+
+
+class TestSeeding(TestCase):
+    def test_same_seed_same_data(self):
+        X_a, y_a = ReberGenerator(MAX_LENGTH, seed=7).make_data(500, as_frame=False)
+        X_b, y_b = ReberGenerator(MAX_LENGTH, seed=7).make_data(500, as_frame=False)
+        np.testing.assert_array_equal(X_a, X_b)
+        np.testing.assert_array_equal(y_a, y_b)
+
+    def test_different_seed_different_data(self):
+        X_a, _ = ReberGenerator(MAX_LENGTH, seed=7).make_data(500, as_frame=False)
+        X_b, _ = ReberGenerator(MAX_LENGTH, seed=8).make_data(500, as_frame=False)
+        self.assertFalse(np.array_equal(X_a, X_b))
+
+    def test_repeated_calls_give_new_data(self):
+        reber = ReberGenerator(MAX_LENGTH, seed=7)
+        X_a, _ = reber.make_data(500, as_frame=False)
+        X_b, _ = reber.make_data(500, as_frame=False)
+        self.assertFalse(np.array_equal(X_a, X_b))
+
+    def test_same_output_whatever_the_number_of_workers(self):
+        outputs = []
+        for num_workers in [1, 3]:
+            reber = ReberGenerator(MAX_LENGTH, seed=7)
+            reber._shard_num_rows = 64
+            outputs.append(
+                reber.make_data(1000, as_frame=False, num_workers=num_workers)
+            )
+        (X_a, y_a), (X_b, y_b) = outputs
+        np.testing.assert_array_equal(X_a, X_b)
+        np.testing.assert_array_equal(y_a, y_b)
+        self.assertEqual(500, y_b.sum())
+
+    def test_seeded_strings(self):
+        reber_a = ReberGenerator(MAX_LENGTH, seed=3)
+        reber_b = ReberGenerator(MAX_LENGTH, seed=3)
+        self.assertEqual(
+            [reber_a.make_perturbed_embedded_reber_string() for _ in range(10)],
+            [reber_b.make_perturbed_embedded_reber_string() for _ in range(10)],
+        )
+
+    def test_same_strings_whatever_the_hash_seed(self):
+        # set iteration order changes with PYTHONHASHSEED, so it must never decide which letter is chosen
+        script = (
+            "from reber import ReberGenerator; r = ReberGenerator(15, seed=7); "
+            "X, _ = r.make_data(200, vectorized=False, as_frame=False); "
+            "print(X.tolist(), r.make_random(), r.make_perturbed_embedded_reber_string())"
+        )
+        outputs = {
+            subprocess.run(
+                [sys.executable, "-c", script],
+                env=dict(os.environ, PYTHONHASHSEED=str(hash_seed)),
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            for hash_seed in (1, 2, 3)
+        }
+        self.assertEqual(1, len(outputs))
+
+    def test_multiple_workers_must_be_vectorized(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        with self.assertRaisesRegex(ValueError, "Only vectorized generation"):
+            reber.make_data(100, vectorized=False, num_workers=2)
+
+
+class TestRecognizer(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(MAX_LENGTH)
+
+    def test_accepts_valid_strings(self):
+        X = self.reber.encode_many(sorted(SHORTEST_VALID_STRINGS) + ["BPBPTVPSEPE"])
+        self.assertTrue(self.reber.recognizer.accepts(X).all())
+
+    def test_rejects_invalid_strings(self):
+        invalid_strings = [
+            "BPBTXSETE",  # symmetry disturbed
+            "BTBTXSET",  # incomplete
+            "BTBTXSETEE",  # extra char at the end
+            "BTBTXXETE",
+            "",
+        ]
+        X = self.reber.encode_many(invalid_strings)
+        self.assertFalse(self.reber.recognizer.accepts(X).any())
+
+    def test_rejects_letters_after_padding(self):
+        X = self.reber.encode_many(["BTBTXSETE"])
+        X[0, -1] = 1
+        self.assertFalse(self.reber.recognizer.accepts(X)[0])
+
+    def test_accepts_any_width(self):
+        X = np.array([ReberGenerator(9).encode_as_padded_ints("BTBTXSETE")])
+        self.assertTrue(self.reber.recognizer.accepts(X)[0])
+
+    def test_out_of_range_values(self):
+        with self.assertRaisesRegex(
+            ValueError, r"X may only contain values in \[0, 8\)"
+        ):
+            self.reber.recognizer.accepts(np.array([[1, 8]]))
+
+    def test_agrees_with_generated_valid_and_symmetry_disturbed_rows(self):
+        X, y = self.reber.make_data(
+            1000, as_frame=False, valid=50, perturbed=0, symmetry_disturbed=50, random=0
+        )
+        np.testing.assert_array_equal(y, self.reber.recognizer.predict(X))
+
+    def test_make_data_repair_labels(self):
+        X, y = self.reber.make_data(
+            1000,
+            as_frame=False,
+            check_labels="repair",
+            valid=0,
+            perturbed=50,
+            symmetry_disturbed=0,
+            random=50,
+        )
+        np.testing.assert_array_equal(self.reber.recognizer.predict(X), y)
+
+    def test_make_data_verify_labels(self):
+        self.reber.recognizer.predict = Mock(side_effect=lambda X: np.zeros(len(X)))
+        with self.assertRaisesRegex(AssertionError, "50 rows are mislabelled"):
+            self.reber.make_data(100, check_labels="verify")
+
+
+class TestVectorizedPerturbations(TestCase):
+    def test_replacement_masks_match_alternates(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        for letter, alternates in reber._reber_alternates.items():
+            mask = reber._replacement_masks[reber._reber_letter_shifted_idx[letter]]
+            allowed = {reber._reber_letters[idx - 1] for idx in np.flatnonzero(mask)}
+            self.assertEqual(reber._reber_letters_set - alternates - {letter}, allowed)
+
+    def test_insertion_masks_match_next_chars(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        mask = reber._insertion_masks[PADDING_VALUE]
+        allowed = {reber._reber_letters[idx - 1] for idx in np.flatnonzero(mask)}
+        self.assertEqual(
+            reber._reber_letters_set - reber._reber_next_chars[""], allowed
+        )
+
+    def test_perturb_rows_single_edit(self):
+        reber = ReberGenerator(MAX_LENGTH, num_perturbations=1, seed=0)
+        original = "BTBPTVVETE"
+        X = reber.encode_many([original] * 200)
+
+        reber.perturb_rows(X)
+
+        num_replacements = 0
+        for perturbed in reber.decode_many(X):
+            if len(perturbed) == len(original):
+                num_replacements += 1
+                num_differences = sum(a != b for a, b in zip(original, perturbed))
+                self.assertEqual(1, num_differences)
+            else:
+                self.assertEqual(len(original) + 1, len(perturbed))
+                self.assertTrue(
+                    any(
+                        perturbed[:i] + perturbed[i + 1 :] == original
+                        for i in range(len(perturbed))
+                    )
+                )
+        self.assertTrue(0 < num_replacements < 200)
+
+    def test_perturb_rows_do_not_add_chars_to_max_len_rows(self):
+        reber = ReberGenerator(max_length=9, num_perturbations=3, seed=0)
+        X = reber.encode_many(sorted(SHORTEST_VALID_STRINGS) * 50)
+
+        reber.perturb_rows(X)
+
+        self.assertTrue((X != PADDING_VALUE).all())
+
+    def test_perturb_rows_yields_invalid_strings(self):
+        reber = ReberGenerator(MAX_LENGTH, num_perturbations=1, seed=0)
+        X = np.empty((1000, MAX_LENGTH), dtype=np.int64)
+        reber._fill_valid_rows(X)
+
+        reber.perturb_rows(X)
+
+        self.assertFalse(reber.recognizer.accepts(X).any())
+
+    def test_symmetry_disturb_rows(self):
+        reber = ReberGenerator(MAX_LENGTH)
+        X = reber.encode_many(["BTBTXSETE", "BPBPVVEPE"])
+        reber._np_random = Mock(random=Mock(return_value=np.array([0, 0.9])))
+
+        reber.symmetry_disturb_rows(X)
+
+        self.assertEqual(["BPBTXSETE", "BPBPVVETE"], reber.decode_many(X))
+
+
+class TestBulkEncoding(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(MAX_LENGTH)
+        self.strings = ["BTBTXSETE", "XBEPSTVX", ""]
+        self.expected_X = np.array(
+            [self.reber.encode_as_padded_ints(s) for s in self.strings]
+        )
+
+    def test_encode_many(self):
+        X = self.reber.encode_many(self.strings)
+        self.assertEqual(COMPACT_DTYPE, X.dtype)
+        np.testing.assert_array_equal(self.expected_X, X)
+
+    def test_encode_many_from_array(self):
+        X = self.reber.encode_many(np.array(self.strings), dtype=np.int64)
+        self.assertEqual(np.int64, X.dtype)
+        np.testing.assert_array_equal(self.expected_X, X)
+
+    def test_encode_many_from_generator(self):
+        X = self.reber.encode_many(s for s in self.strings)
+        np.testing.assert_array_equal(self.expected_X, X)
+
+    def test_encode_many_from_bytes(self):
+        X = self.reber.encode_many(b"BTBTXSETE\nXBEPSTVX\n\n")
+        np.testing.assert_array_equal(self.expected_X, X)
+
+    def test_encode_many_from_bytes_without_trailing_newline(self):
+        X = self.reber.encode_many(b"BTBTXSETE\nXBEPSTVX")
+        np.testing.assert_array_equal(self.expected_X[:2], X)
+
+    def test_encode_many_reports_every_offending_row(self):
+        strings = ["BTBTXSETE", "btbtxsete", "B" * (MAX_LENGTH + 1), "BT\u00c9", "B\nT"]
+        with self.assertRaisesRegex(
+            EncodingError, "3 strings have chars outside of the alphabet"
+        ) as context:
+            self.reber.encode_many(strings)
+        self.assertEqual(
+            [1, 3, 4], context.exception.unrecognized_letter_row_idxes.tolist()
+        )
+        self.assertEqual([2], context.exception.too_long_row_idxes.tolist())
+
+    def test_encoding_error_is_an_assertion_error(self):
+        with self.assertRaises(AssertionError):
+            self.reber.encode_many(["B" * (MAX_LENGTH + 1)])
+
+    def test_decode_many(self):
+        self.assertEqual(self.strings, self.reber.decode_many(self.expected_X))
+
+    def test_round_trip(self):
+        X, _ = self.reber.make_data(1000, as_frame=False)
+        np.testing.assert_array_equal(
+            X, self.reber.encode_many(self.reber.decode_many(X))
+        )
+
+
+class TestDeduplication(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(21, seed=0)
+        self.percentages = dict(valid=5, perturbed=40, symmetry_disturbed=5, random=50)
+
+    def test_make_data_deduplicate(self):
+        X, y = self.reber.make_data(
+            20_000, as_frame=False, deduplicate=True, **self.percentages
+        )
+        self.assertEqual(20_000, np.unique(X, axis=0).shape[0])
+        self.assertEqual(
+            {
+                ReberDataType.VALID: 1000,
+                ReberDataType.PERTURBED: 8000,
+                ReberDataType.SYMMETRY_DISTURBED: 1000,
+                ReberDataType.RANDOM: 10_000,
+            },
+            self.reber.count_distinct_rows(X, **self.percentages),
+        )
+        np.testing.assert_array_equal(self.reber.recognizer.predict(X)[:1000], y[:1000])
+
+    def test_make_data_deduplicate_not_vectorized(self):
+        X, y = self.reber.make_data(
+            1000,
+            vectorized=False,
+            as_frame=False,
+            deduplicate=True,
+            **self.percentages,
+        )
+        self.assertEqual(1000, np.unique(X, axis=0).shape[0])
+        np.testing.assert_array_equal(self.reber.recognizer.predict(X)[:50], y[:50])
+
+    def test_count_distinct_rows(self):
+        reber = ReberGenerator(MAX_LENGTH, seed=0)
+        X, _ = reber.make_data(1000, as_frame=False)
+        datatype_to_count = reber.count_distinct_rows(X)
+        self.assertEqual(
+            np.unique(X[:500], axis=0).shape[0],
+            datatype_to_count[ReberDataType.VALID],
+        )
+
+    def test_too_few_valid_strings(self):
+        reber = ReberGenerator(MAX_LENGTH, seed=0)
+        with self.assertRaisesRegex(ValueError, "Only 134 distinct valid strings"):
+            reber.make_data(1000, deduplicate=True)
+
+    def test_max_length_too_wide_to_deduplicate(self):
+        with self.assertRaisesRegex(
+            ValueError, "max_length up to 21; max_length is 25"
+        ):
+            ReberGenerator(25, seed=0).make_data(1000, deduplicate=True)
+
+    def test_too_few_strings_of_other_datatypes(self):
+        reber = ReberGenerator(MAX_LENGTH, seed=0)
+        with self.assertRaisesRegex(ValueError, "symmetry_disturbed"):
+            reber.make_data(
+                1000,
+                deduplicate=True,
+                valid=10,
+                perturbed=0,
+                symmetry_disturbed=90,
+                random=0,
+            )
+
+
+class TestSampleDistinctValidRows(TestCase):
+    def test_rows_are_distinct_and_valid(self):
+        reber = ReberGenerator(MAX_LENGTH, seed=0)
+        X = reber.sample_distinct_valid_rows(134)
+        self.assertEqual(COMPACT_DTYPE, X.dtype)
+        self.assertTrue(reber.recognizer.accepts(X).all())
+        self.assertEqual(134, np.unique(X, axis=0).shape[0])
+
+    def test_lengths_are_uniform_over_strings(self):
+        reber = ReberGenerator(21, seed=0)
+        X = reber.sample_distinct_valid_rows(1000)
+        # the longest strings make up a third of all strings, while the walk rarely produces them
+        self.assertGreater((X[:, -1] != PADDING_VALUE).mean(), 0.25)
+
+    def test_too_many_rows(self):
+        with self.assertRaisesRegex(ValueError, "Only 134 distinct strings"):
+            ReberGenerator(MAX_LENGTH, seed=0).sample_distinct_valid_rows(135)
+
+
+class TestRaggedOutput(TestCase):
+    def test_make_data_ragged(self):
+        rows, y = ReberGenerator(MAX_LENGTH, seed=0).make_data(
+            1000, as_frame=False, ragged=True
+        )
+        X, _ = ReberGenerator(MAX_LENGTH, seed=0).make_data(1000, as_frame=False)
+        self.assertEqual(1001, rows.offsets.size)
+        self.assertEqual(np.count_nonzero(X), rows.symbols.size)
+        np.testing.assert_array_equal(X, to_padded(rows, MAX_LENGTH))
+
+    def test_ragged_frame(self):
+        with self.assertRaises(ValueError):
+            ReberGenerator(MAX_LENGTH).make_data(1000, ragged=True)
+
+    def test_iter_batches_ragged(self):
+        reber = ReberGenerator(MAX_LENGTH, seed=0)
+        ((rows, y),) = reber.iter_batches(100, num_batches=1, ragged=True)
+        self.assertEqual(101, rows.offsets.size)
+        np.testing.assert_array_equal(
+            reber.recognizer.predict(to_padded(rows, MAX_LENGTH))[y == 1], y[y == 1]
+        )
+
+
+class TestGenerationStats(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(MAX_LENGTH, seed=0)
+        self.percentages = dict(
+            valid=40, perturbed=30, symmetry_disturbed=20, random=10
+        )
+
+    def test_disabled_by_default(self):
+        self.reber.make_data(100)
+        self.assertIsNone(self.reber.stats)
+
+    def _assert_counts(self, stats, m_total, num_calls=1):
+        self.assertEqual(num_calls, stats.num_make_data_calls)
+        self.assertEqual(
+            {
+                ReberDataType.VALID: 0.4 * m_total,
+                ReberDataType.PERTURBED: 0.3 * m_total,
+                ReberDataType.SYMMETRY_DISTURBED: 0.2 * m_total,
+                ReberDataType.RANDOM: 0.1 * m_total,
+            },
+            stats.datatype_to_num_rows,
+        )
+        self.assertEqual(
+            0.3 * m_total * self.reber.num_perturbations,
+            stats.num_replacements + stats.num_insertions,
+        )
+        self.assertEqual(0.2 * m_total, stats.num_symmetry_flips)
+        for datatype in ReberDataType:
+            self.assertGreater(stats.datatype_to_seconds[datatype], 0)
+
+    def test_vectorized(self):
+        stats = self.reber.enable_stats()
+        self.reber.make_data(1000, **self.percentages)
+        self.reber.make_data(1000, **self.percentages)
+        self._assert_counts(stats, 2000, num_calls=2)
+        self.assertGreater(stats.frame_seconds, 0)
+
+    def test_workers(self):
+        stats = self.reber.enable_stats()
+        self.reber.make_data(1000, num_workers=2, as_frame=False, **self.percentages)
+        self._assert_counts(stats, 1000)
+        self.assertEqual(0, stats.frame_seconds)
+
+    def test_not_vectorized(self):
+        stats = self.reber.enable_stats()
+        self.reber.make_data(1000, vectorized=False, **self.percentages)
+        self._assert_counts(stats, 1000)
+        self.assertGreater(stats.encode_seconds, 0)
+
+    def test_rejected_rows(self):
+        reber = ReberGenerator(MAX_LENGTH, seed=0)
+        stats = reber.enable_stats()
+        reber.make_data(
+            1000,
+            deduplicate=True,
+            valid=10,
+            perturbed=40,
+            symmetry_disturbed=0,
+            random=50,
+        )
+        self.assertGreater(stats.num_rejected_rows, 0)
+
+    def test_every_generated_row_is_returned_or_rejected(self):
+        reber = ReberGenerator(MAX_LENGTH, seed=0)
+        stats = reber.enable_stats()
+        X, _ = reber.make_data(
+            1000,
+            as_frame=False,
+            deduplicate=True,
+            valid=10,
+            perturbed=40,
+            symmetry_disturbed=0,
+            random=50,
+        )
+        self.assertGreater(stats.num_refill_rows, 0)
+        # the rows that were asked for, not the refill rows that took the place of duplicates
+        self.assertEqual(1000, sum(stats.datatype_to_num_rows.values()))
+        num_generated_rows = (
+            sum(stats.datatype_to_num_rows.values()) + stats.num_refill_rows
+        )
+        self.assertEqual(X.shape[0], num_generated_rows - stats.num_rejected_rows)
+
+    def test_log_line_per_call(self):
+        self.reber.enable_stats(log_each_call=True)
+        with self.assertLogs("reber", level="INFO") as logs:
+            self.reber.make_data(1000, **self.percentages)
+            self.reber.make_data(1000, **self.percentages)
+        self.assertEqual(2, len(logs.records))
+        call_stats = json.loads(logs.records[1].getMessage().split(" ", 1)[1])
+        self.assertEqual(1, call_stats["num_make_data_calls"])
+        self.assertEqual(400, call_stats["datatype_to_num_rows"]["valid"])
+
+    def test_disable(self):
+        self.reber.enable_stats()
+        self.reber.disable_stats()
+        self.reber.make_data(100)
+        self.assertIsNone(self.reber.stats)
+
+
+class TestRowOrigins(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(MAX_LENGTH, seed=0)
+
+    def test_datatypes_match_labels(self):
+        X, y, origins = self.reber.make_data(1000, as_frame=False, return_origins=True)
+        datatypes = np.array(list(ReberDataType))[origins["datatype"]]
+        self.assertEqual(
+            [datatype.get_class_label() for datatype in datatypes], y.tolist()
+        )
+        is_valid = origins["datatype"] == 0
+        self.assertTrue((origins["edit_kinds"][is_valid] == 0).all())
+        self.assertTrue((origins["first_edit_col"][is_valid] == -1).all())
+
+    def test_edit_kinds(self):
+        _, _, origins = self.reber.make_data(1000, as_frame=False, return_origins=True)
+        perturbed_kinds = set(origins["edit_kinds"][origins["datatype"] == 1])
+        self.assertTrue(perturbed_kinds)
+        self.assertTrue(perturbed_kinds <= {1, 2, 3})
+        self.assertEqual(
+            {EditKind.SYMMETRY_FLIP},
+            set(origins["edit_kinds"][origins["datatype"] == 2]),
+        )
+
+    def test_first_edit_col(self):
+        # with more edits, a later replacement could undo an earlier one
+        reber = ReberGenerator(MAX_LENGTH, num_perturbations=1, seed=0)
+        X = np.empty((2000, MAX_LENGTH), dtype=COMPACT_DTYPE)
+        reber._fill_valid_rows(X)
+        origins = make_origins(X.shape[0])
+        perturbed_X = X.copy()
+        reber.perturb_rows(perturbed_X, origins)
+        first_diff_cols = (perturbed_X != X).argmax(axis=1)
+        self.assertTrue((origins["first_edit_col"] >= 0).all())
+        # a replaced letter always changes, while an inserted letter may equal the one it pushes to the right
+        is_replaced_only = origins["edit_kinds"] == EditKind.REPLACEMENT
+        self.assertTrue(is_replaced_only.any())
+        np.testing.assert_array_equal(
+            origins["first_edit_col"][is_replaced_only],
+            first_diff_cols[is_replaced_only],
+        )
+        self.assertTrue((first_diff_cols <= origins["first_edit_col"]).all())
+
+    def test_symmetry_flip_col(self):
+        X = np.empty((1000, MAX_LENGTH), dtype=COMPACT_DTYPE)
+        self.reber._fill_valid_rows(X)
+        origins = make_origins(X.shape[0])
+        disturbed_X = X.copy()
+        self.reber.symmetry_disturb_rows(disturbed_X, origins)
+        np.testing.assert_array_equal(
+            (disturbed_X != X).argmax(axis=1), origins["first_edit_col"]
+        )
+
+    def test_origins_follow_deduplicated_rows(self):
+        reber = ReberGenerator(21, seed=0)
+        X, y, origins = reber.make_data(
+            2000,
+            as_frame=False,
+            deduplicate=True,
+            return_origins=True,
+            valid=5,
+            perturbed=60,
+            symmetry_disturbed=30,
+            random=5,
+        )
+        self.assertEqual(
+            [100, 1200, 600, 100], np.bincount(origins["datatype"]).tolist()
+        )
+        is_symmetry_disturbed = origins["datatype"] == 2
+        self.assertTrue(
+            (
+                origins["edit_kinds"][is_symmetry_disturbed] == EditKind.SYMMETRY_FLIP
+            ).all()
+        )
+
+    def test_workers_dont_change_origins(self):
+        origins = [
+            ReberGenerator(MAX_LENGTH, seed=3).make_data(
+                1000, as_frame=False, num_workers=num_workers, return_origins=True
+            )[2]
+            for num_workers in (1, 2)
+        ]
+        np.testing.assert_array_equal(*origins)
+
+    def test_as_frame(self):
+        _, _, origins = self.reber.make_data(1000, return_origins=True)
+        self.assertEqual(
+            ["datatype", "edit_kinds", "first_edit_col"], list(origins.columns)
+        )
+        self.assertEqual(
+            {"valid": 500, "perturbed": 50, "symmetry_disturbed": 400, "random": 50},
+            origins["datatype"].value_counts().to_dict(),
+        )
+
+    def test_iter_batches(self):
+        X, y, origins = next(self.reber.iter_batches(200, return_origins=True))
+        self.assertEqual(200, origins.shape[0])
+        np.testing.assert_array_equal(y, origins["datatype"] == 0)
+
+    def test_not_vectorized(self):
+        with self.assertRaises(ValueError):
+            self.reber.make_data(1000, vectorized=False, return_origins=True)
+
+
+class TestLogProbabilities(TestCase):
+    def setUp(self):
+        self.reber = ReberGenerator(MAX_LENGTH, seed=0)
+        self.all_valid_rows = np.concatenate(
+            list(self.reber.get_string_index().iter_rows())
+        )
+
+    def test_sums_to_one_over_all_valid_strings(self):
+        self.assertAlmostEqual(1, self.reber.probabilities(self.all_valid_rows).sum())
+
+    def test_untruncated_walk(self):
+        # the walk emits a string that fits into MAX_LENGTH unless it would have been rejected
+        self.assertAlmostEqual(
+            1 - self.reber.avoided_rejection_rate,
+            self.reber.probabilities(self.all_valid_rows, truncated=False).sum(),
+        )
+
+    def test_length_distribution(self):
+        reber = ReberGenerator(MAX_LENGTH, length_distribution={10: 1, 12: 3})
+        probabilities = reber.probabilities(self.all_valid_rows)
+        lengths = (self.all_valid_rows != PADDING_VALUE).sum(axis=1)
+        self.assertAlmostEqual(0.25, probabilities[lengths == 10].sum())
+        self.assertAlmostEqual(0.75, probabilities[lengths == 12].sum())
+        self.assertEqual(0, probabilities[(lengths != 10) & (lengths != 12)].sum())
+
+    def test_matches_generated_frequencies(self):
+        X = self.reber.make_data(
+            50_000,
+            as_frame=False,
+            valid=100,
+            perturbed=0,
+            symmetry_disturbed=0,
+            random=0,
+        )[0]
+        rows, counts = np.unique(X, axis=0, return_counts=True)
+        np.testing.assert_allclose(
+            counts / X.shape[0], self.reber.probabilities(rows), atol=0.006
+        )
+
+    def test_invalid_rows(self):
+        X = self.all_valid_rows.copy()
+        self.reber.symmetry_disturb_rows(X)
+        self.assertTrue(np.isneginf(self.reber.log_probabilities(X)).all())
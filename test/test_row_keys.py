@@ -0,0 +1,105 @@
+from unittest import TestCase
+
+import numpy as np
+
+from row_keys import (
+    KeyIndex,
+    max_packed_length,
+    pack_rows,
+    split_without_leaks,
+    unpack_rows,
+)
+
+
+class TestPackRows(TestCase):
+    def test_round_trip(self):
+        X = np.random.default_rng(0).integers(0, 8, size=(1000, 21), dtype=np.uint8)
+        np.testing.assert_array_equal(X, unpack_rows(pack_rows(X), X.shape[1]))
+
+    def test_equal_rows_have_equal_keys(self):
+        keys = pack_rows(np.array([[1, 2, 0], [1, 2, 0], [1, 0, 2], [0, 1, 2]]))
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(3, np.unique(keys).size)
+
+    def test_keys_sort_like_rows(self):
+        X = np.array([[2, 0, 0], [1, 7, 7], [1, 2, 0], [0, 0, 1]])
+        self.assertEqual([3, 2, 1, 0], np.argsort(pack_rows(X)).tolist())
+
+    def test_rows_too_wide_for_one_key(self):
+        self.assertEqual(21, max_packed_length())
+        with self.assertRaisesRegex(ValueError, "at most 21"):
+            pack_rows(np.zeros((1, 22), dtype=np.uint8))
+
+    def test_values_too_big_for_bits_per_symbol(self):
+        with self.assertRaises(ValueError):
+            pack_rows(np.array([[8]]))
+
+
+class TestKeyIndex(TestCase):
+    def test_add_marks_first_occurrences_of_new_keys(self):
+        key_index = KeyIndex()
+        self.assertEqual(
+            [True, True, False, True], key_index.add([5, 3, 5, 9]).tolist()
+        )
+        self.assertEqual(
+            [False, True, True, False], key_index.add([9, 4, 1, 4]).tolist()
+        )
+        self.assertEqual(5, len(key_index))
+        self.assertEqual(
+            [True, False, True, False], key_index.contains([1, 2, 9, 10]).tolist()
+        )
+
+    def test_many_batches_match_a_set(self):
+        np_random = np.random.default_rng(0)
+        key_index = KeyIndex()
+        seen = set()
+        for _ in range(50):
+            keys = np_random.integers(0, 5000, size=200).astype(np.uint64)
+            is_new = key_index.add(keys)
+            expected_is_new = []
+            for key in keys.tolist():
+                expected_is_new.append(key not in seen)
+                seen.add(key)
+            self.assertEqual(expected_is_new, is_new.tolist())
+        self.assertEqual(len(seen), len(key_index))
+        # the index stays sorted without being re-sorted
+        self.assertEqual(sorted(seen), key_index._keys.tolist())
+
+
+class TestSplitWithoutLeaks(TestCase):
+    def setUp(self):
+        # few distinct rows, so most rows have copies
+        self.X = np.random.default_rng(0).integers(0, 3, size=(10_000, 4))
+
+    def test_splits_partition_the_rows(self):
+        train_idxes, validation_idxes, test_idxes = split_without_leaks(
+            self.X, 0.2, 0.1, seed=0
+        )
+        np.testing.assert_array_equal(
+            np.arange(self.X.shape[0]),
+            np.sort(np.concatenate([train_idxes, validation_idxes, test_idxes])),
+        )
+
+    def test_no_row_is_in_two_splits(self):
+        splits = split_without_leaks(self.X, 0.2, 0.1, seed=0)
+        split_keys = [set(pack_rows(self.X[idxes]).tolist()) for idxes in splits]
+        for i in range(3):
+            for j in range(i + 1, 3):
+                self.assertFalse(split_keys[i] & split_keys[j])
+
+    def test_split_sizes_are_close_to_the_fractions(self):
+        _, validation_idxes, test_idxes = split_without_leaks(self.X, 0.2, 0.1, seed=0)
+        max_copies = np.unique(pack_rows(self.X), return_counts=True)[1].max()
+        self.assertLess(abs(test_idxes.size - 2000), max_copies)
+        self.assertLess(abs(validation_idxes.size - 1000), 2 * max_copies)
+
+    def test_seed(self):
+        for a, b in zip(
+            split_without_leaks(self.X, 0.3, seed=1),
+            split_without_leaks(self.X, 0.3, seed=1),
+        ):
+            np.testing.assert_array_equal(a, b)
+
+    def test_invalid_fractions(self):
+        with self.assertRaises(ValueError):
+            split_without_leaks(self.X, 0.8, 0.3)